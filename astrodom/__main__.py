@@ -1,7 +1,7 @@
-import os, sys, logging
+import os, sys, logging, sqlite3
 
 from PyQt6.QtWidgets import QFileDialog, QMainWindow, QVBoxLayout, QWidget,QPushButton,QComboBox,QTextEdit,QLineEdit,QStyle
-from PyQt6.QtWidgets import QMessageBox
+from PyQt6.QtWidgets import QMessageBox, QCheckBox
 from PyQt6.QtSql import QSqlQuery,QSqlDatabase
 from PyQt6 import uic
 from PyQt6.QtGui import QIcon
@@ -9,6 +9,7 @@ from PyQt6.QtCore import Qt
 import importlib_resources
 from astrodom.plotDialog import PlotDialog 
 from astrodom.dashboardTreeView import DashboardTreeView
+from astrodom.imageSource import create_summary
 from astrodom.syncImages import SyncImages
 from astrodom.loadSettings import *  # Import the constants
 from astrodom.logHandler import QTextEditLogger,ColorFormatter  
@@ -153,6 +154,12 @@ class MainWindow(QMainWindow):
         # Target items are loaded when a project is selected in load_projects_combobox
         self.targetComboBox = self.findChild(QComboBox, 'targetComboBox')
         self.targetComboBox.currentIndexChanged.connect(self.filter_dashboard)
+
+        # Search in the file names and hide the rejected images
+        self.fileSearchEdit = self.findChild(QLineEdit, 'fileSearchEdit')
+        self.fileSearchEdit.textChanged.connect(self.filter_dashboard)
+        self.hideRejectedCheckBox = self.findChild(QCheckBox, 'hideRejectedCheckBox')
+        self.hideRejectedCheckBox.toggled.connect(self.filter_dashboard)
         # Start the file monitor thread
 
     def autoSyncButtonPressed(self):
@@ -184,8 +191,8 @@ class MainWindow(QMainWindow):
         QThread.sleep(2)
         files_path=[file_path]
         self.sync_images_thread = SyncImages(project_id=project_id, base_dir=base_directory, bResync=False, bAutoSync=True,files_path=file_path, parent=self)
-        self.sync_images_thread.threadLogger.connect(lambda message,logType: self.threadLogger(message,logType))
-        self.sync_images_thread.taskCompleted.connect(self.dashboardTreeView.load_data)
+        self.sync_images_thread.threadLogBatch.connect(self.threadLogBatch)
+        self.sync_images_thread.filesChanged.connect(self.dashboardTreeView.update_files)
 
         self.sync_images_thread.start()
 
@@ -228,7 +235,7 @@ class MainWindow(QMainWindow):
   
             #Check if images are already in the database for this project
             bResync = True                          
-            query.prepare("SELECT COUNT(*) FROM images WHERE PROJECT_ID = :id")
+            query.prepare("SELECT IFNULL(SUM(COUNT), 0) FROM image_summary WHERE PROJECT_ID = :id")
             query.bindValue(":id", selected_project_id)
             if query.exec() and query.next():    
                 if query.value(0) > 0:
@@ -249,11 +256,11 @@ Examples: If you want to update values like  FWHM, SNR, etc.), you have to resyn
 
             # The SyncImages thread is created and started 
             # Two signals are connected to the thread: one for logging and one for updating the dashboard
-            # when the thread is completed.
+            # with the files inserted and deleted in the database.
             try:
                 self.thread = SyncImages(project_id=selected_project_id, base_dir=base_dir, bResync=bResync,bAutoSync=False,parent=self)
-                self.thread.taskCompleted.connect(self.dashboardTreeView.load_data)
-                self.thread.threadLogger.connect(lambda message,logType: self.threadLogger(message,logType))
+                self.thread.filesChanged.connect(self.dashboardTreeView.update_files)
+                self.thread.threadLogBatch.connect(self.threadLogBatch)
                 self.thread.start()
             except Exception as e:
                 logging.error(f"An error occurred: {e}")
@@ -299,7 +306,7 @@ Examples: If you want to update values like  FWHM, SNR, etc.), you have to resyn
     def setup_logging(self):
         logger = logging.getLogger()
         logger.setLevel(level=LOGGING_LEVEL)
-        qt_handler = QTextEditLogger(self.logEdit)
+        qt_handler = QTextEditLogger(self.logEdit, LOG_MAX_LINES)
         qt_handler.setFormatter(ColorFormatter(' %(levelname)s - %(message)s'))
         logger.addHandler(qt_handler)
         
@@ -329,6 +336,12 @@ Examples: If you want to update values like  FWHM, SNR, etc.), you have to resyn
         else: 
             logging.info(message)
 
+    # Log messages sent in batches by a thread through a ThreadLogBuffer (logHandler module)
+    # threadLogBatch = pyqtSignal(list) of (message, logType) tuples
+    def threadLogBatch(self, records):
+        for message, logType in records:
+            self.threadLogger(message, logType)
+
     # Load the projects into the projectsComboBox
     def load_projects_combobox(self, project_id=None,status="Active"):
         self.projectsComboBox.clear()
@@ -364,7 +377,8 @@ Examples: If you want to update values like  FWHM, SNR, etc.), you have to resyn
 
 
         query = QSqlQuery()
-        query.prepare("SELECT DISTINCT OBJECT FROM images WHERE PROJECT_ID = :id")
+        # Targets of the group totals (imageSource module), one row for each filter
+        query.prepare("SELECT DISTINCT OBJECT FROM image_summary WHERE PROJECT_ID = :id")
         query.bindValue(":id", project_id)
         query.exec()
 
@@ -412,9 +426,9 @@ Examples: If you want to update values like  FWHM, SNR, etc.), you have to resyn
 
         self.dashboardTreeView.applyThreshold(fwhm, snr, alt, eccentricity,)
 
-    # Filter the dashboard
+    # Filter the dashboard, the images are filtered in memory (no reload from the database)
     def filter_dashboard(self):
-        self.dashboardTreeView.load_data()
+        self.dashboardTreeView.apply_filters()
 
         return    
         
@@ -514,7 +528,7 @@ Examples: If you want to update values like  FWHM, SNR, etc.), you have to resyn
     # Open the charts dialog
     def open_plot_dialog(self):
         logging.debug("Opening charts dialog")
-        plotDialog = PlotDialog(self.dashboardTreeView.df, self)
+        plotDialog = PlotDialog(self.dashboardTreeView.visible_df(), self)
         plotDialog.exec()
     
     # Open the projects dialog
@@ -600,6 +614,14 @@ Examples: If you want to update values like  FWHM, SNR, etc.), you have to resyn
                 except Exception as e:
                     logging.error(f"An error occurred: {e}")
 
+            # Group totals of the targets and filters, created on the databases of previous versions too
+            try:
+                conn = sqlite3.connect(db_path)
+                create_summary(conn)
+                conn.close()
+            except Exception as e:
+                logging.error(f"An error occurred creating the summary of the images: {e}")
+
     # Override the closeEvent method to stop running threads
     def closeEvent(self, event):
         if hasattr(self, 'thread') :
@@ -612,6 +634,9 @@ Examples: If you want to update values like  FWHM, SNR, etc.), you have to resyn
                 self.monitor_thread.stop()
                 self.monitor_thread.wait()
                 logging.info("Stopped running thread before closing the application.")
+        # The Star Analysis dialogs are destroyed with the window, their measurement threads must be finished
+        for starAnalysisDialog in self.findChildren(StarAnalysisDialog):
+            starAnalysisDialog.stop_measurements()
         event.accept()  # Accept the event to close the window
 
 
@@ -1,12 +1,25 @@
 from PyQt6.QtWidgets import  QDialog,QHBoxLayout
 import os,  logging
 from PyQt6.QtSql import QSqlQuery
-from PyQt6.QtWidgets import QVBoxLayout,QPushButton,QSizePolicy,QLabel, QMessageBox,QStyle
+from PyQt6.QtWidgets import QVBoxLayout,QPushButton,QSizePolicy,QLabel, QMessageBox,QStyle,QCheckBox
+from PyQt6.QtCore import QTimer
 from astrodom.previewAndDataWidget import PreviewAndDataWidget
+from astrodom.folderScanner import FolderScanner
+from astrodom.framePrefetcher import FramePrefetcher, PREFETCH_FRAMES
+from astrodom.loadSettings import *
+
+# Milliseconds between two frames when the blink is played
+PLAY_INTERVAL = 250
 
 # This class is a dialog that allows the user to check FITS files in the project folder
 # and eventually delete them.
 # It relies on the PreviewAndDataWidget class to display the FITS files.
+# The frames are prepared in the background by a FramePrefetcher (framePrefetcher module): the current file
+# and the PREFETCH_FRAMES files before and after it, so that stepping or playing the blink shows a frame
+# that is already read and stretched. The zoom is kept from frame to frame, the visible region of a zoomed
+# preview is read again at a higher resolution by PreviewAndDataWidget.refineView.
+# Lock Stretch uses the display limits of the frame shown for all the frames, so that the frames are compared
+# with the same stretch.
 class BlinkDialog(QDialog):
     def __init__(self, project_id,parent=None):
         super().__init__(parent)
@@ -21,11 +34,10 @@ class BlinkDialog(QDialog):
 
         if query.exec() and query.next():
             base_directory = query.value(0)
-        self.fits_files = []
-        for root, dirs, files in os.walk(base_directory):
-            for file in files:
-                if file.lower().endswith(('.fits', '.fit')):
-                    self.fits_files.append(os.path.join(root, file))
+        # The scan index is only read: the differences are left to the next sync
+        with FolderScanner(str(self.parent.rsc_path.joinpath(DBNAME)), self.project_id, base_directory) as scanner:
+            scanner.scan(save=False)
+        self.fits_files = scanner.files
 
 
         self.setWindowTitle("Blink Dialog")
@@ -34,6 +46,8 @@ class BlinkDialog(QDialog):
 
         self.previewWidget = PreviewAndDataWidget(previewWidth=760)
         self.previewWidget.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
+        self.prefetcher = FramePrefetcher(previewWidth=760, parent=self)
+        self.prefetcher.frameReady.connect(self.on_frame_ready)
         
         delete_button = QPushButton("Delete", self)
         delete_button.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_DialogCloseButton))
@@ -45,12 +59,24 @@ class BlinkDialog(QDialog):
         next_button = QPushButton("Next", self)
         next_button.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_ArrowForward))
 
+        self.play_button = QPushButton("Play", self)
+        self.play_button.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_MediaPlay))
+        self.play_timer = QTimer(self)
+        self.play_timer.setInterval(PLAY_INTERVAL)
+        self.play_timer.timeout.connect(self.play_next)
+
+        self.lock_stretch = QCheckBox("Lock Stretch", self)
+        self.lock_stretch.toggled.connect(self.toggle_lock_stretch)
+
         prev_button.clicked.connect(self.prev_item)
         next_button.clicked.connect(self.next_item)
+        self.play_button.clicked.connect(self.toggle_play)
 
         button_layout = QHBoxLayout()
         button_layout.addWidget(prev_button)
+        button_layout.addWidget(self.play_button)
         button_layout.addWidget(next_button)
+        button_layout.addWidget(self.lock_stretch)
         
         layout = QVBoxLayout()
         layout.addWidget(self.file_name_label)
@@ -61,10 +87,54 @@ class BlinkDialog(QDialog):
         self.update_preview()
         self.setLayout(layout)
 
+    # The frame of the current file is shown if it's ready, otherwise when the prefetcher has read it
     def update_preview(self):
         if self.fits_files:
-            self.file_name_label.setText(os.path.basename(self.fits_files[self.current_fits_index]))
-            self.previewWidget.setBlinkItem(self.fits_files[self.current_fits_index])
+            fits_path = self.fits_files[self.current_fits_index]
+            self.file_name_label.setText(os.path.basename(fits_path))
+
+            # Current file first, then the nearest ones
+            fits_paths = [fits_path]
+            for step in range(1, PREFETCH_FRAMES + 1):
+                for index in (self.current_fits_index + step, self.current_fits_index - step):
+                    if 0 <= index < len(self.fits_files):
+                        fits_paths.append(self.fits_files[index])
+            self.prefetcher.prefetch(fits_paths)
+
+            frame = self.prefetcher.frame(fits_path)
+            if frame is not None:
+                self.previewWidget.showFrame(fits_path, frame)
+
+    def on_frame_ready(self, fits_path):
+        if not self.fits_files or fits_path != self.fits_files[self.current_fits_index]:
+            return
+        frame = self.prefetcher.frame(fits_path)
+        if frame is not None:
+            self.previewWidget.showFrame(fits_path, frame)
+
+    # Play the blink from the current file to the last one
+    def toggle_play(self):
+        if self.play_timer.isActive():
+            self.stop_play()
+        else:
+            self.play_timer.start()
+            self.play_button.setText("Pause")
+            self.play_button.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_MediaPause))
+
+    def toggle_lock_stretch(self, checked):
+        self.prefetcher.setLimits(self.previewWidget.limits if checked else None)
+        self.update_preview()
+
+    def stop_play(self):
+        self.play_timer.stop()
+        self.play_button.setText("Play")
+        self.play_button.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_MediaPlay))
+
+    def play_next(self):
+        if self.current_fits_index >= len(self.fits_files) - 1:
+            self.stop_play()
+            return
+        self.next_item()
 
     def prev_item(self):
         if self.current_fits_index > 0:
@@ -84,6 +154,7 @@ class BlinkDialog(QDialog):
             if reply == QMessageBox.StandardButton.No:
                 return
             file_to_delete = self.fits_files.pop(self.current_fits_index)
+            self.prefetcher.discard(file_to_delete)
             
             try:
                 os.remove(file_to_delete)
@@ -94,3 +165,9 @@ class BlinkDialog(QDialog):
             if self.current_fits_index >= len(self.fits_files):
                 self.current_fits_index = len(self.fits_files) - 1
             self.update_preview()
+
+    # Called when the dialog is closed
+    def done(self, result):
+        self.stop_play()
+        self.prefetcher.close()
+        super().done(result)
@@ -0,0 +1,169 @@
+import sys, os, json, time, logging, argparse, sqlite3
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import importlib_resources
+from astrodom import __version__
+from astrodom.loadSettings import *
+from astrodom.syncEngine import SyncEngine
+from astrodom.starMeasurement import get_measure_params, measure_stars
+
+# Command line entry point (astrodom console script), it runs the sync and the star measurement without the GUI.
+# astrodom sync PROJECT_ID   syncs the base folder of a project (or only --files) to the database
+#                            with the same engine used by the sync button (syncEngine module)
+# astrodom measure FILE ...  measures the stars of FITS files without writing to the database
+# Worker processes, database batch size and star measurement parameters are options, the defaults
+# are the settings (SYNC_WORKERS, SYNC_BATCH_SIZE) and the Star Analysis defaults.
+# The output on stdout is machine readable: a JSON object per line for every file with its timings
+# (seconds) and a final summary line. Log messages go to stderr (--log-level).
+
+measureOptions = [
+    ("nStars", "--n-stars", int, "number of stars measured"),
+    ("cropFactor", "--crop-factor", int, "crop the image by this factor of its width and height"),
+    ("threshold", "--threshold", float, "star detection threshold (times the std of the background)"),
+    ("bit", "--bit", int, "bit depth of the sensor, used to cut saturated stars"),
+    ("bin", "--bin", int, "binning factor"),
+    ("radius", "--radius", int, "radius of the stars in pixels"),
+    ("saturationLimit", "--saturation-limit", float, "saturation limit (percent of the max value)"),
+]
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="astrodom", description="AstroDom headless sync and star measurement")
+    parser.add_argument("--version", action="version", version=f"%(prog)s {__version__}")
+    parser.add_argument("--log-level", default="WARNING", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+                        help="level of the log messages written to stderr")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    measureParent = argparse.ArgumentParser(add_help=False)
+    group = measureParent.add_argument_group("star measurement")
+    for key, option, type_, help in measureOptions:
+        group.add_argument(option, dest=key, type=type_, help=f"{help} (default {get_measure_params()[key]})")
+    measureParent.add_argument("--workers", type=int, default=SYNC_WORKERS,
+                               help="worker processes, 0 means one per CPU (default SYNC_WORKERS setting)")
+
+    sync = subparsers.add_parser("sync", parents=[measureParent], help="sync a project folder to the database")
+    sync.add_argument("project_id", type=int, help="ID of the project")
+    sync.add_argument("--base-dir", help="folder to sync (default the base folder of the project)")
+    sync.add_argument("--db", help="database file (default the AstroDom database)")
+    sync.add_argument("--resync", action="store_true", help="parse all the files again")
+    sync.add_argument("--files", nargs="+", help="sync only these files (as autosync)")
+    sync.add_argument("--batch-size", type=int, default=SYNC_BATCH_SIZE,
+                      help="files written to the database in a transaction (default SYNC_BATCH_SIZE setting)")
+    sync.set_defaults(func=run_sync)
+
+    measure = subparsers.add_parser("measure", parents=[measureParent], help="measure the stars of FITS files")
+    measure.add_argument("files", nargs="+", help="FITS files")
+    measure.set_defaults(func=run_measure)
+
+    return parser
+
+def main(argv=None):
+    multiprocessing.freeze_support()
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(stream=sys.stderr, level=getattr(logging, args.log_level),
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    return args.func(args)
+
+# Write a JSON object on a line of stdout
+def output(values):
+    print(json.dumps(values), flush=True)
+
+def log(message, logType="info"):
+    getattr(logging, logType, logging.info)(message)
+
+def measure_params(args):
+    return {key: getattr(args, key) for key, _, _, _ in measureOptions if getattr(args, key) is not None}
+
+def default_db_path():
+    return str(importlib_resources.files("astrodom").joinpath('rsc', DBNAME))
+
+def run_sync(args):
+    db_path = args.db or default_db_path()
+    base_dir = args.base_dir
+    if base_dir is None:
+        conn = sqlite3.connect(db_path)
+        try:
+            row = conn.execute("SELECT BASE_DIR FROM projects WHERE ID = ?", (args.project_id,)).fetchone()
+        except sqlite3.Error as e:
+            row = None
+            logging.error(f"Error reading the project: {e}")
+        finally:
+            conn.close()
+        if row is None:
+            logging.error(f"Project {args.project_id} not found in {db_path}")
+            return 2
+        base_dir = row[0]
+
+    counts = {"parsed": 0, "skipped": 0, "error": 0}
+    def file_parsed(file_path, status, timings):
+        counts[status] += 1
+        output({"file": file_path, "status": status, **(timings or {})})
+
+    engine = SyncEngine(args.project_id, base_dir, db_path, bResync=args.resync, files_path=args.files,
+                        measureParams=measure_params(args), nWorkers=args.workers, batchSize=args.batch_size,
+                        log=log, fileParsed=file_parsed)
+    start = time.perf_counter()
+    try:
+        engine.run()
+    except KeyboardInterrupt:
+        logging.warning("Sync interrupted")
+        return 130
+    elapsed = time.perf_counter() - start
+
+    output({"summary": "sync", "project_id": args.project_id, "base_dir": base_dir, **counts,
+            "saved": engine.nSaved, "removed": engine.nRemoved, "workers": engine.nWorkers,
+            "seconds": round(elapsed, 4), "files_per_second": round(counts["parsed"] / elapsed, 2) if elapsed > 0 else None})
+    return 1 if counts["error"] else 0
+
+# Star measurement of a file as done by the sync, the log messages are returned to the main process
+def measure_file(file_path, measureParams):
+    log = []
+    start = time.perf_counter()
+    try:
+        result = measure_stars(file_path, measureParams, log)
+        error = None
+    except Exception as e:
+        result = None
+        error = str(e)
+    return result, error, log, time.perf_counter() - start
+
+def run_measure(args):
+    params = measure_params(args)
+    nWorkers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    nWorkers = min(nWorkers, len(args.files))
+    counts = {"measured": 0, "no_stars": 0, "error": 0}
+
+    start = time.perf_counter()
+    if nWorkers <= 1:
+        results = (measure_file(file_path, params) for file_path in args.files)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=nWorkers, mp_context=multiprocessing.get_context("spawn"))
+        results = executor.map(measure_file, args.files, [params] * len(args.files))
+
+    try:
+        for file_path, (result, error, messages, seconds) in zip(args.files, results):
+            for message, logType in messages:
+                log(message, logType)
+            values = {"file": file_path, "seconds": round(seconds, 4)}
+            if error is not None:
+                counts["error"] += 1
+                logging.error(f"Error measuring stars of {file_path}: {error}")
+                values.update(status="error", error=error)
+            elif result is None:
+                counts["no_stars"] += 1
+                values.update(status="no_stars")
+            else:
+                counts["measured"] += 1
+                values.update(status="measured", **dict(zip(("fwhm", "eccentricity", "mean", "median", "std"), map(float, result))))
+            output(values)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    elapsed = time.perf_counter() - start
+
+    output({"summary": "measure", **counts, "workers": nWorkers, "params": get_measure_params(params),
+            "seconds": round(elapsed, 4), "files_per_second": round(len(args.files) / elapsed, 2) if elapsed > 0 else None})
+    return 1 if counts["error"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
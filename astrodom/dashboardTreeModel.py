@@ -1,46 +1,237 @@
 import pandas as pd
 import numpy as np
-import logging
+import logging, bisect
+from collections import OrderedDict
 
 from PyQt6.QtCore import QAbstractItemModel, QModelIndex, Qt, QVariant, QSize
-from PyQt6.QtGui import QBrush, QColor, QFont
 from PyQt6.QtCore import QSortFilterProxyModel, Qt
 
-from astrodom.utils import format_seconds, format_file_size  # Import utility functions
+from astrodom.utils import format_seconds, format_file_size, format_column, format_decimals, format_dates, format_angles  # Import utility functions
+from astrodom.renderCache import RenderCache
+from astrodom.imageSource import DataFrameImageSource
 from astrodom.loadSettings import *
-from PyQt6.QtGui import QIcon
 
+# Images read from the source when a filter is expanded or scrolled to its end, and images kept in memory
+# for the collapsed filters (the filters collapsed first are released first)
+PAGE_SIZE = 500
+CACHE_IMAGES = 20000
+
+# Filtering and sorting of the dashboard in memory: the images table is loaded once per project and
+# the filter and target combos, the file search, date and value ranges and the hide rejected option
+# only change the rows accepted by the proxy.
+# The images of a filter are accepted with a boolean mask calculated at once on the column arrays
+# (imageMask): the mask of the criteria is kept until the criteria or the images change, hiding
+# the rejected images is a single operation with the rejection mask of the model.
+# Target and filter rows are accepted by name and hidden when none of their images is accepted.
+# The criteria of the images need all the images of the filters: while they are set the model reads
+# the filters whole (DashboardTreeModel.setLoadAll), otherwise only the images of the expanded filters are read.
+# Sorting is done by the source model with the sort keys of the columns (DashboardTreeModel.sort)
 class CustomFilterProxyModel(QSortFilterProxyModel):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.filter_string = ""
-
+        self.target = None
+        self.filter_name = None
+        self.dateRange = (None, None)
+        self.ranges = {}
+        self.hideRejected = False
+        # filter item -> (columns, criteria mask) and (columns, rejected, accepted mask)
+        self.criteriaMasks = {}
+        self.masks = {}
+
+    # Text searched in the file path of the images (case insensitive)
     def setFilterString(self, filter_string):
+        if filter_string == self.filter_string:
+            return
         self.filter_string = filter_string
+        self.invalidateCriteria()
+
+    # Only the rows of a target and of a filter, None for all
+    def setGroupFilter(self, target=None, filter_name=None):
+        if (target, filter_name) == (self.target, self.filter_name):
+            return
+        self.target = target
+        self.filter_name = filter_name
         self.invalidateFilter()
 
-    def filterAcceptsRow(self, source_row, source_parent):
+    # Images taken between start and end (included), None for no limit
+    def setDateRange(self, start=None, end=None):
+        if (start, end) == self.dateRange:
+            return
+        self.dateRange = (start, end)
+        self.invalidateCriteria()
+
+    # Images with the values of a column ("FWHM", "SNR", "ALT", ...) between minimum and maximum (included),
+    # None for no limit. Images without a value are hidden while the range is set
+    def setRange(self, column, minimum=None, maximum=None):
+        if self.ranges.get(column, (None, None)) == (minimum, maximum):
+            return
+        if minimum is None and maximum is None:
+            self.ranges.pop(column, None)
+        else:
+            self.ranges[column] = (minimum, maximum)
+        self.invalidateCriteria()
+
+    def setHideRejected(self, hideRejected):
+        if hideRejected == self.hideRejected:
+            return
+        self.hideRejected = hideRejected
+        self.masks.clear()
+        self.sourceModel().setLoadAll(self.hasImageCriteria())
+        self.invalidateFilter()
+
+    def invalidateCriteria(self):
+        self.criteriaMasks.clear()
+        self.masks.clear()
+        self.sourceModel().setLoadAll(self.hasImageCriteria())
+        self.invalidateFilter()
+
+    # True if only some images can be accepted
+    def hasImageCriteria(self):
+        return bool(self.filter_string or self.dateRange != (None, None) or self.ranges or self.hideRejected)
+
+    # Mask of the images of the filter item that match the criteria
+    def criteriaMask(self, filter_item):
+        model = self.sourceModel()
+        cached = self.criteriaMasks.get(filter_item)
+        if cached is not None and cached[0] is filter_item.columns:
+            return cached[1]
+
+        mask = np.ones(filter_item.childCount(), dtype=bool)
+        if self.filter_string:
+            mask &= pd.Index(filter_item.columns[model.columnIndex["File"]]).astype(str).str.contains(
+                self.filter_string, case=False, regex=False)
+        start, end = self.dateRange
+        if start is not None or end is not None:
+            mask &= self.rangeMask(model.sortKey(filter_item, model.columnIndex["Date"]),
+                                   None if start is None else pd.Timestamp(start).timestamp(),
+                                   None if end is None else pd.Timestamp(end).timestamp())
+        for column, (minimum, maximum) in self.ranges.items():
+            mask &= self.rangeMask(model.sortKey(filter_item, model.columnIndex[column]), minimum, maximum)
+
+        self.criteriaMasks[filter_item] = (filter_item.columns, mask)
+        return mask
+
+    def rangeMask(self, values, minimum, maximum):
+        mask = ~np.isnan(values)
+        if minimum is not None:
+            mask &= values >= float(minimum)
+        if maximum is not None:
+            mask &= values <= float(maximum)
+        return mask
+
+    # Mask of the accepted images of the filter item (empty if its images are not read)
+    def imageMask(self, filter_item):
+        if filter_item.columns is None:
+            return np.zeros(0, dtype=bool)
+        rejected = filter_item.columns[self.sourceModel().columnIndex["Rejected"]]
+        cached = self.masks.get(filter_item)
+        if cached is not None and cached[0] is filter_item.columns and cached[1] is rejected:
+            return cached[2]
+
+        mask = self.criteriaMask(filter_item)
+        if self.hideRejected:
+            mask = mask & ~rejected
+        self.masks[filter_item] = (filter_item.columns, rejected, mask)
+        return mask
 
+    def filterAcceptsRow(self, source_row, source_parent):
         model = self.sourceModel()
-        index = model.index(source_row, 0, source_parent)
+        parentItem = model.childrenItem(source_parent)
+        if parentItem is None:
+            return False
 
-        return True
+        # Image rows
+        if parentItem.level == 2:
+            return not self.hasImageCriteria() or bool(self.imageMask(parentItem)[source_row])
+
+        item = parentItem.child(source_row)
+        if item.level == 1:
+            if self.target is not None and item.data(0) != self.target:
+                return False
+            filter_items = [filter_item for filter_item in item.childItems
+                            if self.filter_name is None or filter_item.data(0) == self.filter_name]
+        else:
+            if self.filter_name is not None and item.data(0) != self.filter_name:
+                return False
+            filter_items = [item]
+
+        if self.target is None and self.filter_name is None and not self.hasImageCriteria():
+            return True
+        if not self.hasImageCriteria():
+            return len(filter_items) > 0
+        return any(self.imageMask(filter_item).any() for filter_item in filter_items)
+
+    # The source model is sorted (DashboardTreeModel.sort), the proxy keeps its order
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        self.sourceModel().sort(column, order)
+
+    # Files of the accepted images (with criteria, when all the images are read)
+    def visibleFiles(self):
+        model = self.sourceModel()
+        files = []
+        for object_item in model.rootItem.childItems:
+            if self.target is not None and object_item.data(0) != self.target:
+                continue
+            for filter_item in object_item.childItems:
+                if self.filter_name is not None and filter_item.data(0) != self.filter_name:
+                    continue
+                if filter_item.columns is None:
+                    continue
+                filter_files = filter_item.columns[model.columnIndex["File"]]
+                files.extend((filter_files[self.imageMask(filter_item)] if self.hasImageCriteria() else filter_files).tolist())
+        return files
 
  
+# Group rows of the tree (targets and filters) and the root item (header labels).
+# Image rows are not items: a filter item keeps the column arrays of its images (columns, None until
+# the images are read) and the rows of the arrays are its children.
+# The images of a filter are read in pages: lastKey is the (DATE_OBS, FILE) of the last image read and
+# complete is True when all of them are. checkedFiles and rejectedFiles are the checked and rejected
+# files of the images not read (or released), the arrays have the state of the images read.
+# level is 0 for the root, 1 for targets and 2 for filters. itemData has the native values
+# (numbers are not converted to strings), "" for the empty columns, computed from the totals
+# of the group (sums and number of values, see DashboardTreeModel.group_data)
+# The position of an item in its parent is saved (itemRow) because Qt asks
+# for the parent row of the indexes all the time while painting and scrolling
 class TreeItem:
-    def __init__(self, data, parent=None):
+    def __init__(self, data, parent=None, level=0, totals=None, columns=None):
         self.parentItem = parent
-        self.itemData = [str(d) for d in data]
+        self.itemData = list(data)
         self.childItems = []
+        self.itemRow = 0
+        self.level = level
+        self.totals = totals
+        self.columns = columns
+        # Sort keys of the image columns (DashboardTreeModel.sortKey)
+        self.sortKeys = {}
+        self.lastKey = None
+        self.complete = False
+        self.expanded = False
+        self.checkedFiles = set()
+        self.rejectedFiles = set()
 
     def appendChild(self, item):
+        item.itemRow = len(self.childItems)
         self.childItems.append(item)
 
+    def insertChild(self, row, item):
+        self.childItems.insert(row, item)
+        for n in range(row, len(self.childItems)):
+            self.childItems[n].itemRow = n
+
+    def removeChild(self, row):
+        del self.childItems[row]
+        for n in range(row, len(self.childItems)):
+            self.childItems[n].itemRow = n
+
     def child(self, row):
         return self.childItems[row]
 
+    # A filter item has the images read as children
     def childCount(self):
-
+        if self.level == 2:
+            return len(self.columns[0]) if self.columns is not None else 0
         return len(self.childItems)
 
     def columnCount(self):
@@ -55,140 +246,193 @@ class TreeItem:
         return self.parentItem
 
     def row(self):
-        if self.parentItem:
-            return self.parentItem.childItems.index(self)
-        return 0
-
+        return self.itemRow
+
+# The model is built from an image source (imageSource module, the database of the project or a dataframe):
+# only the totals of the targets and filters are read when it is built, so opening a project is proportional
+# to the number of groups. The images of a filter are read in pages of PAGE_SIZE (canFetchMore, fetchMore)
+# when it is expanded or scrolled to its end, with a column array per dashboard column (native types).
+# The images of the collapsed filters are kept up to CACHE_IMAGES and then released (setGroupExpanded),
+# so the memory is proportional to what is expanded. Their check and rejection state is kept as files.
+# Target and filter rows are TreeItem with the aggregated values of the source.
+# The internalPointer of an index is the item of its parent (the root for the target rows),
+# so image indexes don't need an item: the image is the row index.row() of the filter item arrays.
+# index(), parent() and rowCount() are constant time, as the column lookups (columnIndex) in data()
+# After a sync the model is updated in place (insertImages, removeFiles): the rows of the images read are
+# inserted and removed with the begin/end signals of Qt, only the arrays of the changed filters are copied
+# and the totals of the groups are read again from the source, so the expanded state of the view is kept.
+# Groups are created and removed as needed.
+# The text of the formatted columns of the images (dates, angles, decimals...) is calculated once for all the rows
+# when the column arrays are built (textFormats), the brushes, fonts and icons are shared (renderCache module),
+# so painting the dashboard only reads arrays and dictionaries.
 class DashboardTreeModel(QAbstractItemModel):
     def __init__(self, data, parent=None):
         super().__init__(parent)
 
-        self.checked_items = set() # Initialize the set to keep track of checked items
-
         self.itemList = ["Target", "#", "Exposure", "Size", "Date", "Time","Filter","FWHM", "Eccentricity","SNR","ALT", "AZ", "Temp", "Frame",
                          "Bin","RA", "DEC", "Gain", "Offset", "Mean", "Median", "Site Lat", "Site Long", "Moon Phase", "Moon Separation","File"]
+        # Database column of each dashboard column (None if the column is calculated or empty for the images)
+        # STD is not displayed, its array is after the dashboard columns (needed by the SNR of the filters)
+        # followed by the rejection mask of the images (calculated by rejection_mask) and the check state of
+        # the images (check box of the Target column). Both are boolean arrays aligned to the rows, so they
+        # follow the images when rows are inserted or removed and the checked files are read without indexes
+        self.dbColumns = ["OBJECT", None, "EXPOSURE", "SIZE", "DATE_OBS", "DATE_OBS", "FILTER", "FWHM", "ECCENTRICITY", None, "OBJECT_ALT", "OBJECT_AZ", "CCD_TEMP", "IMAGETYP",
+                          "XBINNING", "OBJECT_RA", "OBJECT_DEC", "GAIN", "OFFSET", "MEAN", "MEDIAN", "SITELAT", "SITELONG", "MOON_PHASE", "MOON_SEPARATION", "FILE", "STD", None, None]
+        self.columnIndex = {column: n for n, column in enumerate(self.itemList)}
+        self.columnIndex["STD"] = len(self.itemList)
+        self.columnIndex["Rejected"] = len(self.itemList) + 1
+        self.columnIndex["Checked"] = len(self.itemList) + 2
+
+        # Text of the image rows of the formatted columns, the arrays are after the check state (textColumns)
+        # and as the other arrays they are sliced, sorted and concatenated with the rows
+        self.textFormats = {
+            "Exposure": lambda values: [format_seconds(value, "s") for value in values],
+            "Size": lambda values: [format_file_size(value) for value in values],
+            "Date": lambda values: format_dates(values, DATE_FORMAT),
+            "Time": lambda values: format_dates(values, "%H:%M:%S"),
+            "FWHM": format_decimals,
+            "Eccentricity": format_decimals,
+            "SNR": format_decimals,
+            "ALT": format_angles,
+            "AZ": format_angles,
+            "RA": lambda values: format_angles(values, hours=True),
+            "DEC": format_angles,
+            "Mean": format_decimals,
+            "Median": format_decimals,
+            "Site Lat": format_angles,
+            "Site Long": format_angles,
+            "Moon Separation": format_angles,
+        }
+        self.textColumns = {self.columnIndex[column]: len(self.dbColumns) + n for n, column in enumerate(self.textFormats)}
+
+        # Alignment of the columns, the angles are right aligned except ALT
+        rightColumns = ["Exposure", "Size", "AZ", "RA", "DEC", "Site Lat", "Site Long", "Moon Separation"]
+        self.alignments = [Qt.AlignmentFlag.AlignLeft if column == "Target" else
+                           Qt.AlignmentFlag.AlignRight if column in rightColumns else
+                           Qt.AlignmentFlag.AlignCenter for column in self.itemList]
+        RenderCache.load()
 
         self.rootItem = TreeItem(self.itemList, None)
+        # -1 is the default order: targets and filters by name, images by date
+        self.sortColumn = -1
+        self.sortOrder = Qt.SortOrder.AscendingOrder
         self.rsc_path = importlib_resources.files("astrodom").joinpath('rsc')
         self.parent = parent
 
-        self.setupModelData(data, self.rootItem)
+        # A dataframe of the images table is read in memory
+        self.source = DataFrameImageSource(data) if isinstance(data, pd.DataFrame) else data
+        # Filters read whole, needed by the criteria of the proxy (setLoadAll)
+        self.loadAll = False
+        # Filters with images read, the least recently used first
+        self.loadedGroups = OrderedDict()
+        # True while a page is inserted
+        self.fetching = False
+
+        self.setupModelData(self.rootItem)
 
     def columnCount(self, parent=QModelIndex()):
-        if parent.isValid():
-            return parent.internalPointer().columnCount()
         return self.rootItem.columnCount()
 
+    # The item of a group row or (filter item, image row in the column arrays) for an image row
+    def itemAt(self, index):
+        parentItem = index.internalPointer()
+        if parentItem.level == 2:
+            return parentItem, index.row()
+        return parentItem.child(index.row()), None
+
+    # Native value of a cell, "" for the empty columns
+    def value(self, item, image, column):
+        if image is None:
+            return item.data(column)
+        if item.columns[column] is None:
+            return ""
+        return item.columns[column][image]
+
     def data(self, index, role=Qt.ItemDataRole.DisplayRole):
         if not index.isValid():
             return QVariant()
 
-        item = index.internalPointer()
+        item, image = self.itemAt(index)
         
         match role:
             case Qt.ItemDataRole.DisplayRole:
-                # Format the date and time
-                if index.column() == self.itemList.index("Exposure"):
-                    if not item.parent().parent(): # Target grouping row
-                        return format_seconds(item.data(index.column()), "hms")
-                    elif item.parent() and item.parent().parent() == self.rootItem: #Filter grouping row
-                        return format_seconds(item.data(index.column()), "hms")
+                # Image rows: text calculated with the column arrays
+                if image is not None:
+                    text = self.textColumns.get(index.column())
+                    if text is not None:
+                        return item.columns[text][image]
+                    return str(self.value(item, image, index.column()))
+
+                value = item.data(index.column())
 
-                    else:
-                        return format_seconds(item.data(index.column()), "s") # Image row
+                # Format the date and time
+                if index.column() == self.columnIndex["Exposure"]:
+                    return format_seconds(value, "hms")
 
                 # Format the file size
-                if index.column() == self.itemList.index("Size"):
-                    return format_file_size(item.data(index.column()))
-
-                #  Add the check box for the target rows
-                if (index.column() == self.itemList.index("FWHM") and hasattr(self, 'fwhm') and item.data(index.column()) and float(item.data(index.column())) > self.fwhm) or \
-                    (index.column() == self.itemList.index("Eccentricity") and hasattr(self, 'eccentricity') and item.data(index.column()) and float(item.data(index.column())) > self.eccentricity) or \
-                    (index.column() == self.itemList.index("SNR") and hasattr(self, 'snr') and item.data(index.column()) and float(item.data(index.column())) < self.snr) or \
-                    (index.column() == self.itemList.index("ALT") and hasattr(self, 'alt') and item.data(index.column()) and float(item.data(index.column())) < self.alt) :
-                    parent_parent_row = index.parent().parent().row()
-                    parent_row = index.parent().row()            
-                    if parent_parent_row >=0 and parent_row >=0:
-                        self.checked_items.add((parent_parent_row,parent_row, index.row()))
-                
+                if index.column() == self.columnIndex["Size"]:
+                    return format_file_size(value)
+
                 # Format FWHM and Eccentricity
-                
-                if index.column() == self.itemList.index("FWHM") or index.column() == self.itemList.index("Eccentricity") or \
-                    index.column() == self.itemList.index("SNR") or index.column() == self.itemList.index("Mean") or \
-                    index.column() == self.itemList.index("Median"):
+                if index.column() in (self.columnIndex["FWHM"], self.columnIndex["Eccentricity"], self.columnIndex["SNR"],
+                                      self.columnIndex["Mean"], self.columnIndex["Median"]):
+                    return format_decimals([value])[0]
 
-                    if item.data(index.column()) == "":
-                        return ""
-                    else:
-                        return f"{float(item.data(index.column())):.2f}"
+                return str(value)
+
+            # Native value (eg the ALT of the image for the threshold of the delegate)
+            case Qt.ItemDataRole.UserRole:
+                return self.value(item, image, index.column())
 
-                return item.data(index.column())
-        
             case Qt.ItemDataRole.DecorationRole:
-                if index.column() == self.itemList.index("Date"):
-                    moon_icon = QIcon(str(self.rsc_path.joinpath( 'icons', self.get_moon_phase_icon(item.data(self.itemList.index("Moon Phase"))))))
-                    return moon_icon
+                if index.column() == self.columnIndex["Date"]:
+                    return RenderCache.moonIcons[self.get_moon_phase_icon(self.value(item, image, self.columnIndex["Moon Phase"]))]
             
             case Qt.ItemDataRole.ToolTipRole:
-                if index.column() == self.itemList.index("Date"):
-                    return f"Moon Illumination: {item.data(self.itemList.index("Moon Phase"))}%\nMoon to Target Separation: {item.data(self.itemList.index("Moon Separation"))} degrees"
+                # Number of images of a group over the thresholds
+                if index.column() == self.columnIndex["#"] and image is None and hasattr(self, 'fwhm'):
+                    return f"Rejected: {self.rejectedCount(item)}"
+                if index.column() == self.columnIndex["Date"]:
+                    return f"Moon Illumination: {self.value(item, image, self.columnIndex["Moon Phase"])}%\nMoon to Target Separation: {self.value(item, image, self.columnIndex["Moon Separation"])} degrees"
                 
             case Qt.ItemDataRole.BackgroundRole:
                 # Set the background color for the filters for  filter grouped rows 
-                if item.parent() and item.parent().parent() == self.rootItem:
-                    if item.data(0) in ["Luminance", "luminance", "Lum", "lum", "L", "l"]:
-                        return QBrush(QColor(244, 244, 244, 35))
-                    elif item.data(0) in ["Red", "R", "r", "red"]:
-                        return QBrush(QColor(255, 0, 0, 35))
-                    elif item.data(0) in ["Blue", "B", "b", "blue"]:
-                        return QBrush(QColor(55, 55, 255, 35))
-                    elif item.data(0) in ["Green", "G", "g", "green"]:
-                        return QBrush(QColor(0, 140, 55, 35))
-                    elif item.data(0) in ["Ha", "ha", "Halpha", "halpha", "H_alpha", "h_alpha", "H_Alpha", "h_Alpha"]:
-                        return QBrush(QColor(190, 255, 0, 35))
-                    elif item.data(0) in ["OIII", "Oiii", "oiii", "O3"]:
-                        return QBrush(QColor(150, 200, 255, 35))
-                    elif item.data(0) in ["SII", "Sii", "sii"]:
-                        return QBrush(QColor(255, 120, 190, 35))
+                if image is None and item.level == 2:
+                    return RenderCache.filterBrushes.get(item.data(0), QVariant())
                 return QVariant()
                 
             case Qt.ItemDataRole.FontRole:
                 # Set the font style for the grouped rows at target level
-                if not item.parent().parent():
-                    font = QFont()
-                    font.setBold(True)
-                    font.setItalic(True)
-
-                    return font
+                if image is None and item.level == 1:
+                    return RenderCache.targetFont
                 # Set the font style for the grouped rows at filter level
-                elif item.parent() and item.parent().parent() == self.rootItem:
-                    font = QFont()
-                    font.setItalic(True)
-                    return font
+                elif image is None and item.level == 2:
+                    return RenderCache.filterFont
 
                 return QVariant()
-        
 
             # Set the text alignment for the columns
             case Qt.ItemDataRole.TextAlignmentRole:
-                if index.column() == self.itemList.index("Target"):
-                    return Qt.AlignmentFlag.AlignLeft
-                elif index.column() == self.itemList.index("Exposure") or index.column() == self.itemList.index("Size"): 
-                    return Qt.AlignmentFlag.AlignRight
-                else:
-                    return Qt.AlignmentFlag.AlignCenter
+                return self.alignments[index.column()]
 
             case Qt.ItemDataRole.CheckStateRole:
-                if index.column() == self.itemList.index("Target") and item.childCount() == 0:
-                    if (index.parent().parent().row(),index.parent().row(), index.row()) in self.checked_items:
-                        return Qt.CheckState.Checked
-                    else:
+                if index.column() == self.columnIndex["Target"]:
+                    if image is not None:
+                        if item.columns[self.columnIndex["Checked"]][image]:
+                            return Qt.CheckState.Checked
+                        else:
+                            return Qt.CheckState.Unchecked
+
+                    # Target and filter rows are checked when all their images are
+                    checked, count = self.checkedCount(item), self.imageCount(item)
+                    if checked == 0:
                         return Qt.CheckState.Unchecked
+                    return Qt.CheckState.Checked if checked >= count else Qt.CheckState.PartiallyChecked
 
         return None
        
     def get_moon_phase_icon(self,phase):
-        if phase == "":
+        if isinstance(phase, str) and phase == "":
             return ""
         phase = float(phase)
 
@@ -209,50 +453,228 @@ class DashboardTreeModel(QAbstractItemModel):
         else:
             return "waninggibbous.png"
     
+    # The images over the thresholds are rejected: the rejection mask of every filter is calculated
+    # at once (rejection_mask) and only the rejected images are checked, so that all of them are
+    # in get_checked_files and not only the ones already painted.
+    # The rejection of the images not read is calculated on the measures of the source (a few columns)
     def setThresholds(self, fwhm, snr, alt, eccentricity):
         self.fwhm = float(fwhm)
         self.snr = float(snr)
         self.alt = float(alt)
         self.eccentricity = float(eccentricity)
-        self.checked_items.clear()
+
+        for filter_item in self.filterItems():
+            if filter_item.columns is not None:
+                rejected = self.rejection_mask(filter_item.columns)
+                filter_item.columns[self.columnIndex["Rejected"]] = rejected
+                filter_item.columns[self.columnIndex["Checked"]] = rejected.copy()
+            filter_item.rejectedFiles = set()
+            filter_item.checkedFiles = set()
+
+        if all(filter_item.complete for filter_item in self.filterItems()):
+            return None
+
+        measures = self.source.measures()
+        std = measures['STD'].to_numpy(dtype=float)
+        rejected = measures[self.rejected(measures['FWHM'], measures['ECCENTRICITY'],
+                                          self.image_snr(measures['MEDIAN'].to_numpy(dtype=float), std), measures['OBJECT_ALT'])]
+        groups = {}
+        for object_name, filter_name, file in zip(rejected['OBJECT'], rejected['FILTER'], rejected['FILE']):
+            groups.setdefault((object_name, filter_name), set()).add(file)
+        for filter_item in self.filterItems():
+            files = groups.get((filter_item.parent().data(0), filter_item.data(0)), set())
+            if filter_item.columns is not None:
+                files.difference_update(filter_item.columns[self.columnIndex["File"]].tolist())
+            filter_item.rejectedFiles = files
+            filter_item.checkedFiles = set(files)
 
         return None
-    
+
+    # Boolean array of the images over the thresholds (all False before setThresholds)
+    # Missing values (eg ALT of images without coordinates) are not rejected
+    def rejection_mask(self, columns):
+        if not hasattr(self, 'fwhm'):
+            return np.zeros(len(columns[0]), dtype=bool)
+        return self.rejected(columns[self.columnIndex["FWHM"]], columns[self.columnIndex["Eccentricity"]],
+                             columns[self.columnIndex["SNR"]], columns[self.columnIndex["ALT"]])
+
+    def rejected(self, fwhm, eccentricity, snr, alt):
+        def values(column):
+            return np.asarray(pd.to_numeric(column, errors='coerce'), dtype=float)
+
+        return (values(fwhm) > self.fwhm) | (values(eccentricity) > self.eccentricity) | \
+               (values(snr) < self.snr) | (values(alt) < self.alt)
+
+    # Number of rejected images of a target or filter (read or not)
+    def rejectedCount(self, item):
+        if item.level == 1:
+            return sum(self.rejectedCount(filter_item) for filter_item in item.childItems)
+        count = len(item.rejectedFiles)
+        if item.columns is not None:
+            count += int(np.count_nonzero(item.columns[self.columnIndex["Rejected"]]))
+        return count
+
+    # Number of checked images of a target or filter (read or not)
+    def checkedCount(self, item):
+        if item.level == 1:
+            return sum(self.checkedCount(filter_item) for filter_item in item.childItems)
+        count = len(item.checkedFiles)
+        if item.columns is not None:
+            count += int(np.count_nonzero(item.columns[self.columnIndex["Checked"]]))
+        return count
+
+    # Number of images under a target or filter (the target totals include images without filter)
+    def imageCount(self, item):
+        if item.level == 1:
+            return sum(filter_item.totals['count'] for filter_item in item.childItems)
+        return item.totals['count']
+
+    # Sort key of a column of the images of a filter as floats, NaN for the missing values: numbers,
+    # dates as seconds and text as ranks. The key is kept until the column array is replaced
+    def sortKey(self, filter_item, column):
+        values = filter_item.columns[column]
+        if values is None:
+            return np.zeros(filter_item.childCount())
+        cached = filter_item.sortKeys.get(column)
+        if cached is not None and cached[0] is values:
+            return cached[1]
+
+        if column == self.columnIndex["Date"] or column == self.columnIndex["Time"]:
+            dates = pd.to_datetime(values, errors='coerce', format='ISO8601')
+            key = np.where(dates.isna(), np.nan, dates.asi8 / 1e9)
+        else:
+            key = np.asarray(pd.to_numeric(values, errors='coerce'), dtype=float)
+            # Text columns (eg File, Frame)
+            if np.count_nonzero(~np.isnan(key)) < np.count_nonzero(~pd.isna(values)):
+                codes = pd.factorize(values, sort=True)[0]
+                key = np.where(codes < 0, np.nan, codes).astype(float)
+
+        filter_item.sortKeys[column] = (values, key)
+        return key
+
+    # Sort the rows by a column: the images of every filter with the numpy argsort of the sort key (stable,
+    # missing values last), targets and filters by their values. The arrays of the images are reordered,
+    # rejection and check state included, and the persistent indexes (expanded rows, selection) are moved
+    # The filters with images read are read whole first, the others are sorted when they are read
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        self.sortColumn = column
+        self.sortOrder = order
+        if column >= 0:
+            for filter_item in self.filterItems():
+                if filter_item.columns is not None:
+                    self.loadImages(filter_item)
+
+        self.layoutAboutToBeChanged.emit([], QAbstractItemModel.LayoutChangeHint.VerticalSortHint)
+        persistent = self.persistentIndexList()
+        # Group item or image row of the persistent indexes
+        before = [index.internalPointer().child(index.row()) if index.internalPointer().level < 2 else index.row()
+                  for index in persistent]
+
+        descending = order == Qt.SortOrder.DescendingOrder
+        for parentItem in [self.rootItem] + self.rootItem.childItems:
+            values = [(item, item.data(column if column >= 0 else 0)) for item in parentItem.childItems]
+            present = [value for value in values if not self.missing(value[1])]
+            try:
+                present.sort(key=lambda value: value[1], reverse=descending)
+            except TypeError:
+                present.sort(key=lambda value: str(value[1]), reverse=descending)
+            parentItem.childItems = [item for item, value in present] + [item for item, value in values if self.missing(value)]
+            for row, item in enumerate(parentItem.childItems):
+                item.itemRow = row
+
+        newRows = {}
+        for filter_item in self.filterItems():
+            if filter_item.columns is None:
+                continue
+            key = self.sortKey(filter_item, column if column >= 0 else self.columnIndex["Date"])
+            rows = np.argsort(-key if descending else key, kind='stable')
+            # The sort keys still valid are reordered with the columns
+            sortKeys = {n: sortKey[rows] for n, (values, sortKey) in filter_item.sortKeys.items() if values is filter_item.columns[n]}
+            filter_item.columns = [values[rows] if values is not None else None for values in filter_item.columns]
+            filter_item.sortKeys = {n: (filter_item.columns[n], sortKey) for n, sortKey in sortKeys.items()}
+            newRows[filter_item] = np.argsort(rows)
+
+        self.changePersistentIndexList(persistent, [
+            self.createIndex(item.row(), index.column(), index.internalPointer()) if not isinstance(item, int)
+            else self.createIndex(int(newRows[index.internalPointer()][item]), index.column(), index.internalPointer())
+            for index, item in zip(persistent, before)])
+        self.layoutChanged.emit([], QAbstractItemModel.LayoutChangeHint.VerticalSortHint)
+
+    def missing(self, value):
+        return value is None or (isinstance(value, str) and value == "") or (isinstance(value, float) and np.isnan(value))
+
+    # The filter items of all the targets
+    def filterItems(self):
+        return [filter_item for object_item in self.rootItem.childItems for filter_item in object_item.childItems]
+
     # This function is called from the mainWindow when the 'file operation' button is pressed.
     # It returns a list of selected file names that will be managed by FileOperationDialog
     def get_checked_files(self):
         files = []
-        
-        # Iterate over the checked_items and retrieve the file name from 'File' column
-        for parent_parent_row, parent_row, row in self.checked_items:
-            parent_parent_index = self.index(parent_parent_row, 0, QModelIndex())
-            parent_index = self.index(parent_row, 0, parent_parent_index)
-            index = self.index(row, self.itemList.index("File"), parent_index)
-        
-            files.append(self.data(index, Qt.ItemDataRole.DisplayRole))
-            #logging.debug(self.data(index, Qt.ItemDataRole.DisplayRole))
-        
+        for filter_item in self.filterItems():
+            if filter_item.columns is not None:
+                files.extend(filter_item.columns[self.columnIndex["File"]][filter_item.columns[self.columnIndex["Checked"]]].tolist())
+            files.extend(filter_item.checkedFiles)
         return files
 
+    # Boolean array of the images of a filter that are in files (a hash lookup, np.isin sorts the object arrays)
+    def fileMask(self, filter_item, files):
+        return pd.Index(filter_item.columns[self.columnIndex["File"]]).isin(files)
+
+    # Check only the images of these files (eg the checked files of the model replaced by a reload)
+    # The target and filter of the files not read are read from the source
+    def set_checked_files(self, files):
+        files = list(files)
+        data = self.source.frame(files=files) if files else None
+        groups = {}
+        if data is not None:
+            for object_name, filter_name, file in zip(data['OBJECT'], data['FILTER'], data['FILE']):
+                groups.setdefault((object_name, filter_name), set()).add(file)
+        for filter_item in self.filterItems():
+            filter_item.checkedFiles = groups.get((filter_item.parent().data(0), filter_item.data(0)), set())
+            if filter_item.columns is not None:
+                filter_item.columns[self.columnIndex["Checked"]] = self.fileMask(filter_item, files)
+                filter_item.checkedFiles.difference_update(filter_item.columns[self.columnIndex["File"]].tolist())
+        if self.rootItem.childCount():
+            self.dataChanged.emit(self.index(0, 0), self.index(self.rootItem.childCount() - 1, 0), [Qt.ItemDataRole.CheckStateRole])
+
+    # Check (or uncheck) all the images of a target or filter row, the files not read are read from the source
+    def setGroupChecked(self, item, checked):
+        for filter_item in (item.childItems if item.level == 1 else [item]):
+            filter_item.checkedFiles = set()
+            if checked and not filter_item.complete:
+                filter_item.checkedFiles = set(self.source.files(filter_item.parent().data(0), filter_item.data(0)))
+            if filter_item.columns is not None:
+                filter_item.checkedFiles.difference_update(filter_item.columns[self.columnIndex["File"]].tolist())
+                filter_item.columns[self.columnIndex["Checked"]] = np.full(filter_item.childCount(), checked)
+            if filter_item.childCount():
+                self.dataChanged.emit(self.createIndex(0, 0, filter_item), self.createIndex(filter_item.childCount() - 1, 0, filter_item),
+                                      [Qt.ItemDataRole.CheckStateRole])
+            self.dataChanged.emit(self.groupIndex(filter_item), self.groupIndex(filter_item), [Qt.ItemDataRole.CheckStateRole])
+        if item.level == 2:
+            self.dataChanged.emit(self.groupIndex(item.parent()), self.groupIndex(item.parent()), [Qt.ItemDataRole.CheckStateRole])
+
     def setData(self, index, value, role):
         if not index.isValid():
             return False
 
         if role == Qt.ItemDataRole.CheckStateRole :
-            # Target level
-            parent_parent_row = index.parent().parent().row()
-            # Filter level
-            parent_row = index.parent().row()           
-
-            # If the selected checkbox in a row is already in the checked_items set, it is removed
-            if (parent_parent_row,parent_row, index.row()) in self.checked_items:
-                self.checked_items.discard((parent_parent_row,parent_row, index.row()))
-
-            else:
-                # The item row is added to the checked_items set
-                self.checked_items.add((parent_parent_row,parent_row, index.row()))
-
-            #self.dataChanged.emit(index, index,  [Qt.ItemDataRole.CheckStateRole])
+            item, image = self.itemAt(index)
+
+            # A target or filter row checks all its images, or unchecks them if they are all checked
+            if image is None:
+                self.setGroupChecked(item, self.checkedCount(item) < self.imageCount(item))
+                return True
+
+            # The check box of the image is toggled
+            checked = item.columns[self.columnIndex["Checked"]]
+            checked[image] = not checked[image]
+
+            self.dataChanged.emit(index, index,  [Qt.ItemDataRole.CheckStateRole])
+            filter_index = self.groupIndex(item)
+            self.dataChanged.emit(filter_index, filter_index, [Qt.ItemDataRole.CheckStateRole])
+            object_index = self.groupIndex(item.parent())
+            self.dataChanged.emit(object_index, object_index, [Qt.ItemDataRole.CheckStateRole])
             return True
 
         return False
@@ -264,7 +686,7 @@ class DashboardTreeModel(QAbstractItemModel):
 
         flags = super().flags(index)
         # Set the flags for the target column
-        if index.column() == self.itemList.index("Target") :  
+        if index.column() == self.columnIndex["Target"] :  
             flags |= Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsUserCheckable | Qt.ItemFlag.ItemIsSelectable 
 
         return flags
@@ -272,7 +694,7 @@ class DashboardTreeModel(QAbstractItemModel):
 
     def getItem(self, index):
         if index.isValid():
-            item = index.internalPointer()
+            item, image = self.itemAt(index)
             if item:
                 return item
         return self.rootItem
@@ -283,107 +705,368 @@ class DashboardTreeModel(QAbstractItemModel):
 
         return QVariant()
 
+    # The item whose children are the rows under parent, None for an image (no children)
+    def childrenItem(self, parent):
+        if not parent.isValid():
+            return self.rootItem
+        parentItem = parent.internalPointer()
+        if parentItem.level == 2 or parent.column() > 0:
+            return None
+        return parentItem.childItems[parent.row()]
+
+    # Bounds are checked here instead of hasIndex that would call rowCount back through Qt
     def index(self, row, column, parent=QModelIndex()):
-        if not self.hasIndex(row, column, parent):
+        parentItem = self.childrenItem(parent)
+        if parentItem is None or row < 0 or column < 0 or row >= parentItem.childCount() or column >= len(self.itemList):
             return QModelIndex()
 
-        if not parent.isValid():
-            parentItem = self.rootItem
-        else:
-            parentItem = parent.internalPointer()
-
-        childItem = parentItem.child(row)
-        if childItem:
-            return self.createIndex(row, column, childItem)
-        return QModelIndex()
+        return self.createIndex(row, column, parentItem)
 
     def parent(self, index):
         if not index.isValid():
             return QModelIndex()
 
-        childItem = index.internalPointer()
-        parentItem = childItem.parent()
+        parentItem = index.internalPointer()
 
-        if parentItem == self.rootItem:
+        if parentItem is self.rootItem:
             return QModelIndex()
 
-        return self.createIndex(parentItem.row(), 0, parentItem)
+        return self.createIndex(parentItem.row(), 0, parentItem.parent())
 
     def rowCount(self, parent=QModelIndex()):
-        if parent.column() > 0:
+        parentItem = self.childrenItem(parent)
+        if parentItem is None:
             return 0
-
-        if not parent.isValid():
-            parentItem = self.rootItem
-        else:
-            parentItem = parent.internalPointer()
-
         return parentItem.childCount()
 
-    def setupModelData(self, data, parent):
+    # Filters have children before their images are read (canFetchMore)
+    def hasChildren(self, parent=QModelIndex()):
+        parentItem = self.childrenItem(parent)
+        if parentItem is None:
+            return False
+        if parentItem.level == 2:
+            return parentItem.childCount() > 0 or not parentItem.complete
+        return parentItem.childCount() > 0
+
+    # No page is read while the rows of another one are inserted (views ask for more rows on rowsInserted)
+    def canFetchMore(self, parent):
+        parentItem = self.childrenItem(parent)
+        return parentItem is not None and parentItem.level == 2 and not parentItem.complete and not self.fetching
+
+    def fetchMore(self, parent):
+        if not self.canFetchMore(parent):
+            return
+        parentItem = self.childrenItem(parent)
+        self.loadImages(parentItem, PAGE_SIZE)
+        if self.sortColumn >= 0:
+            self.sort(self.sortColumn, self.sortOrder)
+
+    def setupModelData(self, parent):
         # The dashboard is a tree structure with the following hierarchy:
         # Target/object -> Filter -> Image
-        # The first iteration is on the object level, the second on the filter level, and the third on the image level
-        for object_name, object_group in data.groupby('OBJECT'):
-
-            object_item = TreeItem([object_name, len(object_group), str(object_group['EXPOSURE'].sum()), object_group['SIZE'].sum(), 
-                                    "","", "", str(object_group['FWHM'].mean()), str(object_group['ECCENTRICITY'].mean()), 
-                                    "", "", "", "", "", "", "", "", "", "", "", "", 
-                                    "", "", "", "", "", ""], parent)
+        # Images without target or filter are not shown (the source has no group for them), the totals
+        # of a target include its images without filter
+        object_items = {}
+        for object_name, totals in self.source.group_totals('OBJECT'):
+            object_item = TreeItem(self.group_data(object_name, totals, 1), parent, level=1, totals=totals)
             parent.appendChild(object_item)
-
-            
-            #Second iteration on the filter level
-            for filter_name, filter_group in object_group.groupby('FILTER'):
-
-                #Compute SNR at filter level
-                if np.sqrt(np.sum(np.square(filter_group['STD']))) != 0:
-                    filter_snr = str((filter_group['MEDIAN']-BIAS_SIGNAL).sum()/np.sqrt(np.sum(np.square(filter_group['STD']))))
-                else:
-                    filter_snr = ""
-
-                filter_item = TreeItem([filter_name, len(filter_group), filter_group['EXPOSURE'].sum(), filter_group['SIZE'].sum(), 
-                                        "", "", "", str(filter_group['FWHM'].mean()), str(filter_group['ECCENTRICITY'].mean()), 
-                                        filter_snr, "", "", 
-                                        "", "", "", "", "", "", "", str(filter_group['MEAN'].mean()), str(filter_group['MEDIAN'].mean()), 
-                                        "", "", "", "", "", ""], object_item)
-                
-                object_item.appendChild(filter_item)
-
-
-                for _, image_row in filter_group.iterrows():
-                    
-                    if image_row['STD'] != 0:
-                        image_snr = round((image_row['MEDIAN'] - BIAS_SIGNAL) / image_row['STD'], 2)
-                    else:
-                        image_snr = 0
-                    
-                    image_item = TreeItem([
-                        image_row['OBJECT'], 
-                        "", 
-                        image_row['EXPOSURE'], 
-                        image_row['SIZE'], 
-                        image_row['DATE_OBS'], 
-                        image_row['DATE_OBS'], # Second column DATE_OBS needed for splitting date and time
-                        image_row['FILTER'], 
-                        image_row['FWHM'],
-                        image_row['ECCENTRICITY'],
-                        image_snr,
-                        image_row['OBJECT_ALT'], 
-                        image_row['OBJECT_AZ'],
-                        image_row['CCD_TEMP'], 
-                        image_row['IMAGETYP'], 
-                        image_row['XBINNING'], 
-                        image_row['OBJECT_RA'], 
-                        image_row['OBJECT_DEC'], 
-                        image_row['GAIN'],
-                        image_row['OFFSET'],
-                        image_row['MEAN'],
-                        image_row['MEDIAN'],
-                        image_row['SITELAT'],
-                        image_row['SITELONG'],
-                        image_row['MOON_PHASE'],
-                        image_row['MOON_SEPARATION'],
-                        image_row['FILE'],
-                    ], filter_item)
-                    filter_item.appendChild(image_item)
+            object_items[object_name] = object_item
+
+        # The images of the filters are read when they are expanded
+        for (object_name, filter_name), totals in self.source.group_totals(['OBJECT', 'FILTER']):
+            object_item = object_items[object_name]
+            object_item.appendChild(TreeItem(self.group_data(filter_name, totals, 2), object_item, level=2, totals=totals))
+
+    # Read the next page of images of a filter (limit None for all the images not read) and add them after the
+    # images already read. A filter is read whole when the rows are sorted by a column or when loadAll is set
+    # The check and rejection state of the images read is moved from the files to the arrays
+    def loadImages(self, filter_item, limit=None):
+        if filter_item.complete or self.fetching:
+            return
+        if self.sortColumn >= 0 or self.loadAll:
+            limit = None
+        self.fetching = True
+
+        data = self.source.page(filter_item.parent().data(0), filter_item.data(0), filter_item.lastKey, limit)
+        columns = self.image_columns(data)
+        files = columns[self.columnIndex["File"]]
+        columns[self.columnIndex["Checked"]] = np.asarray(pd.Index(files).isin(filter_item.checkedFiles), dtype=bool)
+        filter_item.checkedFiles.difference_update(files.tolist())
+        filter_item.rejectedFiles.difference_update(files.tolist())
+        if len(data):
+            date = data['DATE_OBS'].iloc[-1]
+            filter_item.lastKey = (None if self.missing(date) else date, data['FILE'].iloc[-1])
+        filter_item.complete = limit is None or len(data) < limit
+
+        if filter_item.columns is None:
+            filter_item.columns = [column[:0] if column is not None else None for column in columns]
+        if len(data):
+            first = filter_item.childCount()
+            self.beginInsertRows(self.groupIndex(filter_item), first, first + len(data) - 1)
+            filter_item.columns = [np.concatenate((old, new)) if old is not None else None
+                                   for old, new in zip(filter_item.columns, columns)]
+            self.endInsertRows()
+        self.fetching = False
+
+        self.loadedGroups[filter_item] = None
+        self.loadedGroups.move_to_end(filter_item)
+        self.trimCache()
+
+    # Read all the images of every filter (the criteria of the proxy need them) or release them again
+    # when the filters are collapsed
+    def setLoadAll(self, loadAll):
+        self.loadAll = loadAll
+        if not loadAll:
+            self.trimCache()
+            return
+        for filter_item in self.filterItems():
+            self.loadImages(filter_item)
+        if self.sortColumn >= 0:
+            self.sort(self.sortColumn, self.sortOrder)
+
+    # Called by the view when a filter row is expanded or collapsed: the images of the collapsed filters
+    # are kept in memory until they are more than CACHE_IMAGES
+    def setGroupExpanded(self, filter_item, expanded):
+        filter_item.expanded = expanded
+        if filter_item in self.loadedGroups:
+            self.loadedGroups.move_to_end(filter_item)
+        self.trimCache()
+
+    # Release the least recently used collapsed filters over CACHE_IMAGES images, the last filter read is
+    # kept (it is read before the view emits expanded)
+    def trimCache(self):
+        if self.loadAll:
+            return
+        count = sum(filter_item.childCount() for filter_item in self.loadedGroups)
+        collapsed = [filter_item for filter_item in list(self.loadedGroups)[:-1] if not filter_item.expanded]
+        for filter_item in collapsed:
+            if count <= CACHE_IMAGES:
+                break
+            count -= filter_item.childCount()
+            self.releaseImages(filter_item)
+
+    # Remove the images of a filter from memory, the files keep their check and rejection state
+    def releaseImages(self, filter_item):
+        self.loadedGroups.pop(filter_item, None)
+        columns = filter_item.columns
+        if columns is None:
+            return
+        files = columns[self.columnIndex["File"]]
+        filter_item.checkedFiles.update(files[columns[self.columnIndex["Checked"]]].tolist())
+        filter_item.rejectedFiles.update(files[columns[self.columnIndex["Rejected"]]].tolist())
+
+        if filter_item.childCount():
+            self.beginRemoveRows(self.groupIndex(filter_item), 0, filter_item.childCount() - 1)
+        filter_item.columns = None
+        filter_item.sortKeys = {}
+        filter_item.lastKey = None
+        filter_item.complete = False
+        if len(files):
+            self.endRemoveRows()
+
+    # Column arrays of the images of a dataframe (dashboard columns, STD, rejection mask, check state and
+    # text of the formatted columns), the SNR is calculated
+    def image_columns(self, data):
+        columns = [data[db_column].to_numpy() if db_column is not None else None for db_column in self.dbColumns]
+
+        columns[self.columnIndex["SNR"]] = self.image_snr(data['MEDIAN'].to_numpy(dtype=float), data['STD'].to_numpy(dtype=float))
+        columns[self.columnIndex["Rejected"]] = self.rejection_mask(columns)
+        columns[self.columnIndex["Checked"]] = columns[self.columnIndex["Rejected"]].copy()
+        for column, function in self.textFormats.items():
+            columns.append(format_column(columns[self.columnIndex[column]], function))
+        return columns
+
+    # SNR of the images, 0 without noise
+    def image_snr(self, median, std):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            image_snr = np.round((median - BIAS_SIGNAL) / std, 2)
+        return np.where(std != 0, image_snr, 0.0)
+
+    # Values of a target (level 1) or filter (level 2) row from its totals
+    def group_data(self, name, totals, level):
+        def average(key):
+            return totals[key] / totals[key + 'Count'] if totals[key + 'Count'] else np.nan
+
+        if level == 1:
+            return [name, totals['count'], totals['exposure'], totals['size'], 
+                    "","", "", average('fwhm'), average('eccentricity'), 
+                    "", "", "", "", "", "", "", "", "", "", "", "", 
+                    "", "", "", "", ""]
+
+        #Compute SNR at filter level
+        if np.sqrt(totals['noise']) != 0:
+            filter_snr = totals['signal'] / np.sqrt(totals['noise'])
+        else:
+            filter_snr = ""
+
+        return [name, totals['count'], totals['exposure'], totals['size'], 
+                "", "", "", average('fwhm'), average('eccentricity'), 
+                filter_snr, "", "", 
+                "", "", "", "", "", "", "", average('mean'), average('median'), 
+                "", "", "", "", ""]
+
+    # Key of a target ((target,)) or filter ((target, filter)) row that doesn't change when the rows
+    # are sorted, filtered or the model is built again
+    def groupKey(self, item):
+        if item.level == 2:
+            return (item.parent().data(0), item.data(0))
+        return (item.data(0),)
+
+    # Index of the row of a group item (invalid for the root)
+    def groupIndex(self, item, column=0):
+        if item is self.rootItem:
+            return QModelIndex()
+        return self.createIndex(item.row(), column, item.parent())
+
+    # The child group with this name and totals, created at its sorted position if missing (at the end if the
+    # rows are sorted by a column, insertImages sorts them again). The row is refreshed if the totals changed
+    def group_item(self, parentItem, name, totals):
+        names = [item.data(0) for item in parentItem.childItems]
+        if name in names:
+            item = parentItem.child(names.index(name))
+            if item.totals != totals:
+                item.totals = totals
+                item.itemData = self.group_data(name, totals, item.level)
+                self.dataChanged.emit(self.groupIndex(item), self.groupIndex(item, len(self.itemList) - 1))
+            return item
+        row = bisect.bisect_left(names, name) if self.sortColumn < 0 else len(names)
+
+        item = TreeItem(self.group_data(name, totals, parentItem.level + 1), parentItem, level=parentItem.level + 1, totals=totals)
+        self.beginInsertRows(self.groupIndex(parentItem), row, row)
+        parentItem.insertChild(row, item)
+        self.endInsertRows()
+        return item
+
+    # Totals of the targets and filters read again from the source after the images changed:
+    # the groups are updated, created and removed as needed
+    def refreshGroups(self):
+        object_totals = dict(self.source.group_totals('OBJECT'))
+        filter_totals = dict(self.source.group_totals(['OBJECT', 'FILTER']))
+
+        for object_name, totals in object_totals.items():
+            self.group_item(self.rootItem, object_name, totals)
+        objects = {object_item.data(0): object_item for object_item in self.rootItem.childItems}
+        for (object_name, filter_name), totals in filter_totals.items():
+            self.group_item(objects[object_name], filter_name, totals)
+
+        for object_item in list(self.rootItem.childItems):
+            for filter_item in list(object_item.childItems):
+                if (object_item.data(0), filter_item.data(0)) not in filter_totals:
+                    self.loadedGroups.pop(filter_item, None)
+                    self.beginRemoveRows(self.groupIndex(object_item), filter_item.row(), filter_item.row())
+                    object_item.removeChild(filter_item.row())
+                    self.endRemoveRows()
+            if object_item.data(0) not in object_totals:
+                self.beginRemoveRows(QModelIndex(), object_item.row(), object_item.row())
+                self.rootItem.removeChild(object_item.row())
+                self.endRemoveRows()
+
+    # Key of the order of the images of a filter in the source (missing dates first)
+    def imageKey(self, date, file):
+        return ("" if self.missing(date) else date, file)
+
+    # Rows where images are inserted in the arrays of a filter in source order (the images with the same date
+    # by file)
+    def imagePositions(self, filter_item, dates, files):
+        def keys(values):
+            return np.where(pd.isna(values), "", values)
+
+        oldDates = keys(filter_item.columns[self.columnIndex["Date"]])
+        oldFiles = filter_item.columns[self.columnIndex["File"]]
+        dates = keys(dates)
+        first = np.searchsorted(oldDates, dates, side='left')
+        last = np.searchsorted(oldDates, dates, side='right')
+        return np.array([start + np.searchsorted(oldFiles[start:end], file) for start, end, file in zip(first, last, files)], dtype=int)
+
+    # Insert the images of a dataframe (rows of the images table). In a filter the images are kept
+    # in date order: the new rows are inserted with a beginInsertRows for every position
+    # Only the images before the last one read are added to the arrays, the others will be read with the
+    # next pages (only their check and rejection state is kept)
+    # If the rows are sorted by a column they are sorted again after the insert
+    def insertImages(self, data):
+        if data.empty:
+            return
+        self.source.insert(data)
+        self.refreshGroups()
+
+        # The new images are grouped without pandas, a live update has only a few rows
+        # (the rejected images are checked, see image_columns)
+        new_columns = self.image_columns(data)
+        objects = new_columns[self.columnIndex["Target"]]
+        filters = new_columns[self.columnIndex["Filter"]]
+        groups = {}
+        for row in np.flatnonzero(~(pd.isna(objects) | pd.isna(filters))):
+            groups.setdefault((objects[row], filters[row]), []).append(row)
+
+        filter_items = {(filter_item.parent().data(0), filter_item.data(0)): filter_item for filter_item in self.filterItems()}
+        for key in sorted(groups):
+            filter_item = filter_items.get(key)
+            if filter_item is None:
+                continue
+            rows = sorted(groups[key], key=lambda row: self.imageKey(new_columns[self.columnIndex["Date"]][row], new_columns[self.columnIndex["File"]][row]))
+            columns = [column[rows] if column is not None else None for column in new_columns]
+
+            dates = columns[self.columnIndex["Date"]]
+            files = columns[self.columnIndex["File"]]
+            if filter_item.complete:
+                read = np.ones(len(rows), dtype=bool)
+            elif filter_item.columns is None:
+                read = np.zeros(len(rows), dtype=bool)
+            else:
+                lastKey = self.imageKey(*filter_item.lastKey)
+                read = np.array([self.imageKey(date, file) < lastKey for date, file in zip(dates, files)], dtype=bool)
+
+            # Images not read
+            filter_item.checkedFiles.update(files[~read & columns[self.columnIndex["Checked"]]].tolist())
+            filter_item.rejectedFiles.update(files[~read & columns[self.columnIndex["Rejected"]]].tolist())
+            if not read.any():
+                continue
+            columns = [column[read] if column is not None else None for column in columns]
+            dates = columns[self.columnIndex["Date"]]
+
+            try:
+                positions = self.imagePositions(filter_item, dates, columns[self.columnIndex["File"]])
+            except TypeError:
+                # Dates that can't be compared (eg missing) are added at the end
+                positions = np.full(len(dates), filter_item.childCount())
+
+            # From the last position so that the previous ones are still valid
+            for position in np.unique(positions)[::-1]:
+                rows = np.flatnonzero(positions == position)
+                self.beginInsertRows(self.groupIndex(filter_item), position, position + len(rows) - 1)
+                filter_item.columns = [np.concatenate((old[:position], new[rows], old[position:])) if old is not None else None
+                                       for old, new in zip(filter_item.columns, columns)]
+                self.endInsertRows()
+
+        if self.loadAll:
+            for filter_item in self.filterItems():
+                self.loadImages(filter_item)
+        if self.sortColumn >= 0:
+            self.sort(self.sortColumn, self.sortOrder)
+
+    # Remove the images of a list of files, the groups left empty are removed
+    def removeFiles(self, files):
+        if len(files) == 0:
+            return
+        files = list(files)
+
+        for filter_item in self.filterItems():
+            filter_item.checkedFiles.difference_update(files)
+            filter_item.rejectedFiles.difference_update(files)
+            if filter_item.columns is None:
+                continue
+            rows = np.flatnonzero(self.fileMask(filter_item, files))
+            if len(rows) == 0:
+                continue
+
+            # Consecutive rows are removed together, from the last ones
+            runs = np.split(rows, np.flatnonzero(np.diff(rows) != 1) + 1)
+            for run in reversed(runs):
+                first, last = int(run[0]), int(run[-1])
+                self.beginRemoveRows(self.groupIndex(filter_item), first, last)
+                filter_item.columns = [np.concatenate((column[:first], column[last + 1:])) if column is not None else None
+                                       for column in filter_item.columns]
+                self.endRemoveRows()
+
+        self.source.remove(files)
+        self.refreshGroups()
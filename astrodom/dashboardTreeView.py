@@ -1,15 +1,22 @@
-import sqlite3, logging
-import pandas as pd
+import logging
 from PyQt6.QtWidgets import QTreeView,QHeaderView
 from PyQt6.QtCore import Qt
 from astrodom.dashboardTreeModel import DashboardTreeModel, CustomFilterProxyModel
+from astrodom.imageSource import SqliteImageSource
 from astrodom.viewDelegates import *
 from astrodom.loadSettings import *  # Import the constants
 
 # The Dashboard class is a QTreeView widget that displays the data from the database (load_data method) in a table.
+# During a sync the model is updated only with the files that changed (update_files method)
+# The project is opened once: filter, target, file search and hide rejected are applied in memory
+# by the proxy model (apply_filters method) and the columns are sorted by clicking on the header
+# The images of a filter are read from the database when it is expanded and when its last row read
+# is scrolled into view (fetch_visible method), the model is told which filters are expanded
 # it also handles the presentation of the data through the view delegates
 # The applyThreshold method is called from the main window when the user clicks the "Apply" button.
-# Other methods are used to save and restore the expanded state of the tree view
+# The expanded targets and filters are kept as a set of keys (DashboardTreeModel.groupKey) updated by the
+# expanded and collapsed signals: restore_expanded_state expands them again after the model or the rows
+# of the proxy change, visiting only the target and filter rows
 # The setProjectID method is called from the main window upon class instantiation when a project is selected
 # The hide_columns method hides columns that are not in the ADDITIONAL_COLUMNS list
 class DashboardTreeView(QTreeView):
@@ -17,23 +24,30 @@ class DashboardTreeView(QTreeView):
         super().__init__(parent)
         self.project_id = None
         self.parent = parent
+        # DashboardTreeModel set by load_data
+        self.model = None
         self.itemList = ["Target", "#", "Exposure", "Size", "Date", "Time","Filter","FWHM", "Eccentricity","SNR","ALT", "AZ", "Temp", "Frame",
                          "Bin","RA", "DEC", "Gain", "Offset", "Mean", "Median", "Site Lat", "Site Long", "Moon Phase", "Moon Separation","File"]
         self.setGeometry(100, 100, 800, 600)
         
+        # Keys of the expanded targets and filters
+        self.expandedGroups = set()
+        self.expanded.connect(lambda index: self.on_expanded(index, True))
+        self.collapsed.connect(lambda index: self.on_expanded(index, False))
+        self.verticalScrollBar().valueChanged.connect(self.fetch_visible)
+
         self.load_data()
         self.selectionModel().selectionChanged.connect(self.on_selection_changed)
 
         self.setAlternatingRowColors(True)
+        # No sort indicator at start: the images are in date order
+        self.header().setSortIndicator(-1, Qt.SortOrder.AscendingOrder)
+        self.header().setSortIndicatorClearable(True)
+        self.setSortingEnabled(True)
         self.header().setDefaultAlignment(Qt.AlignmentFlag.AlignCenter)
         self.header().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
 
-        self.dateDelegate = DateDelegate(self)
-        self.setItemDelegateForColumn(self.itemList.index("Date"), self.dateDelegate)
-
-        self.timeDelegate = TimeDelegate(self)
-        self.setItemDelegateForColumn(self.itemList.index("Time"), self.timeDelegate)
-
+        # Dates, angles and decimals are formatted by the model, the delegates color the cells
         self.filterDelegate = FilterDelegate(self)
         self.setItemDelegateForColumn(self.itemList.index("Filter"), self.filterDelegate)
 
@@ -53,31 +67,9 @@ class DashboardTreeView(QTreeView):
         self.setItemDelegateForColumn(self.itemList.index("ALT"), self.altDelegate)
         self.altDelegate.setLimit(ALT_LIMIT_DEFAULT)
 
-        self.azDelegate = DmsDelegate(self)
-        self.setItemDelegateForColumn(self.itemList.index("AZ"), self.azDelegate)
-
         self.frameDelegate = FrameDelegate(self)
         self.setItemDelegateForColumn(self.itemList.index("Frame"), self.frameDelegate)
 
-        self.raDelegate = HmsDelegate(self)
-        self.setItemDelegateForColumn(self.itemList.index("RA"), self.raDelegate)
-
-        self.decDelegate = DmsDelegate(self)
-        self.setItemDelegateForColumn(self.itemList.index("DEC"), self.decDelegate)
-        
-        self.siteLatDelegate = DmsDelegate(self)
-        self.setItemDelegateForColumn(self.itemList.index("Site Lat"), self.siteLatDelegate)
-        
-        self.siteLongDelegate = DmsDelegate(self)
-        self.setItemDelegateForColumn(self.itemList.index("Site Long"), self.siteLongDelegate)
-        
-        self.moonSeparationDelegate = DmsDelegate(self)
-        self.setItemDelegateForColumn(self.itemList.index("Moon Separation"), self.moonSeparationDelegate)
-                
-        self.roundDelegate = RoundDelegate(self)
-        self.setItemDelegateForColumn(self.itemList.index("Mean"), self.roundDelegate)
-        self.setItemDelegateForColumn(self.itemList.index("Median"), self.roundDelegate)
-        
         # Hide columns that are not in the ADDITIONAL_COLUMNS list
         self.hide_columns()
 
@@ -100,59 +92,123 @@ class DashboardTreeView(QTreeView):
         self.eccentricityDelegate.setLimit(float(eccentricity))
         self.altDelegate.setLimit(float(alt))
         self.snrDelegate.setLimit(float(snr))
-        expanded_items = self.save_expanded_state()
         
         # setThresholds sets the threshold values in the model
         self.model.setThresholds(fwhm, snr, alt, eccentricity)
 
+        # The rejected images change
+        if self.proxy_model.hideRejected:
+            self.proxy_model.invalidateFilter()
         self.proxy_model.layoutChanged.emit()
-        self.restore_expanded_state(expanded_items)
+        self.restore_expanded_state()
     
-    # The main method to load data from the database. 
+    # The targets and filters expanded and collapsed in the view, the model keeps in memory the images
+    # of the expanded filters
+    def on_expanded(self, index, expanded):
+        item = self.model.getItem(self.proxy_model.mapToSource(index))
+        if item.level == 0:
+            return
+        if expanded:
+            self.expandedGroups.add(self.model.groupKey(item))
+        else:
+            self.expandedGroups.discard(self.model.groupKey(item))
+        if item.level == 2:
+            self.model.setGroupExpanded(item, expanded)
+
+    # Qt reads the next page of a filter only when it is expanded: the page is read here when the last image
+    # read of a filter is visible
+    def fetch_visible(self):
+        index = self.indexAt(self.viewport().rect().topLeft())
+        bottom = self.viewport().rect().bottom()
+        while index.isValid() and self.visualRect(index).top() <= bottom:
+            parent = index.parent()
+            if parent.isValid() and index.row() == self.proxy_model.rowCount(parent) - 1 and self.proxy_model.canFetchMore(parent):
+                self.proxy_model.fetchMore(parent)
+            index = self.indexBelow(index)
+
+    # The main method to open the project in the database. 
     # Called from the main window upon class instantiation when a project is selected
-    # Filters on filter and target are applied if selected in the GUI
-    # The model is then set through the proxy model using a pandas dataframe
+    # Only the totals of the targets and filters are read, the images when a filter is expanded
+    # The model is then set through the proxy model using an image source of the database (imageSource module)
     def load_data(self):
-        sqlString = ""
-        selected_filter = self.parent.filterSelectComboBox.currentText()
-        selected_target = self.parent.targetComboBox.currentText()
-
-        if selected_filter != "--Filter--" and selected_filter != "":
-            sqlString = f" AND FILTER = '{selected_filter}' "
-
-        if selected_target != "--Target--" and selected_target != "":
-            sqlString += f" AND OBJECT = '{selected_target}' "
-
-        # Connect to the database
         db_path = str(self.parent.rsc_path.joinpath( DBNAME))
-        conn = sqlite3.connect(db_path)
 
         if hasattr(self.parent, 'projectStatus') and self.parent.projectStatus != 'Active':
             self.parent.syncButton.setEnabled(False)
 
-        if not self.project_id or self.project_id == 0:
-            query = f"SELECT * FROM images ORDER BY PROJECT_ID DESC, DATE_OBS ASC"
-
-        elif self.project_id > 0: 
-            query = f"SELECT * FROM images WHERE PROJECT_ID = {self.project_id} {sqlString} ORDER BY  PROJECT_ID DESC,  DATE_OBS ASC"
-            logging.debug(f"Loading data: {query}")   
+        logging.debug(f"Loading data of project: {self.project_id}")
         try:
-            self.df = pd.read_sql_query(query, conn)
-            conn.close()
+            source = SqliteImageSource(db_path, self.project_id)
+            model = DashboardTreeModel(source, parent=self)
         except Exception as e:
             logging.error(f"An error occurred: {e}")
-            conn.close()
             return
 
         # Set the model through the proxy model
-        self.model = DashboardTreeModel(self.df, parent=self)
+        # The thresholds and the checked images of the previous model are kept (the files are the keys)
+        previous_model = self.model
+        self.model = model
+        if previous_model is not None:
+            if hasattr(previous_model, 'fwhm'):
+                self.model.setThresholds(previous_model.fwhm, previous_model.snr, previous_model.alt, previous_model.eccentricity)
+            self.model.set_checked_files(previous_model.get_checked_files())
+            previous_model.source.close()
         self.proxy_model = CustomFilterProxyModel(self)
         self.proxy_model.setSourceModel(self.model)
-
         self.setModel(self.proxy_model)
-        
+
+        # The expanded targets and filters are restored by apply_filters
         # By default, expand the first item so the single filters are visible
-        self.expand(self.proxy_model.index(0, 0))
+        self.apply_filters()
+        if not self.expandedGroups:
+            self.expand(self.proxy_model.index(0, 0))
+
+    # Filter the dashboard with the filter, target, file search and hide rejected selected in the GUI
+    # The proxy model changes the rows shown only if a selection has changed
+    def apply_filters(self):
+        selected_filter = self.parent.filterSelectComboBox.currentText()
+        selected_target = self.parent.targetComboBox.currentText()
+
+        if selected_filter == "--Filter--" or selected_filter == "":
+            selected_filter = None
+        if selected_target == "--Target--" or selected_target == "":
+            selected_target = None
+        self.proxy_model.setGroupFilter(selected_target, selected_filter)
+
+        if hasattr(self.parent, 'fileSearchEdit'):
+            self.proxy_model.setFilterString(self.parent.fileSearchEdit.text().strip())
+        if hasattr(self.parent, 'hideRejectedCheckBox'):
+            self.proxy_model.setHideRejected(self.parent.hideRejectedCheckBox.isChecked())
+        # Rows hidden and shown again by the proxy are collapsed
+        self.restore_expanded_state()
+
+    # Images shown in the dashboard (all the project if nothing is filtered) read from the database
+    def visible_df(self):
+        proxy_model = self.proxy_model
+        if not proxy_model.hasImageCriteria():
+            return self.model.source.frame(proxy_model.target, proxy_model.filter_name)
+        data = self.model.source.frame(files=proxy_model.visibleFiles())
+        return data.sort_values('DATE_OBS', kind='stable').reset_index(drop=True)
+
+    # Called during a sync (filesChanged signal of the SyncImages thread) with the files inserted and
+    # deleted in the database: the model is updated in place instead of loading the whole project again,
+    # so the expanded items, the selection and the scroll position are kept.
+    # Only the inserted files are read from the database
+    def update_files(self, inserted, deleted):
+        if self.model is None:
+            self.load_data()
+            return
+        if deleted:
+            self.model.removeFiles(deleted)
+        if not inserted:
+            return
+
+        try:
+            data = self.model.source.frame(files=inserted)
+        except Exception as e:
+            logging.error(f"An error occurred: {e}")
+            return
+        self.model.insertImages(data.sort_values('DATE_OBS', kind='stable').reset_index(drop=True))
 
     # The project_id is set automatically at startup and updated when a project is selected
     #  called from the main window update_dashboard_contents method
@@ -169,31 +225,17 @@ class DashboardTreeView(QTreeView):
             column_index = self.itemList.index(column_name)
             self.setColumnHidden(column_index, True)
 
-    def save_expanded_state(self):
-        expanded_items = []
-        root_index = self.proxy_model.index(0, 0)
-        self._save_expanded_state_recursive(root_index, expanded_items)
-        return expanded_items
-
-    def _save_expanded_state_recursive(self, index, expanded_items):
-        if not index.isValid():
+    # Expand the target and filter rows of the expanded keys, the image rows are not visited
+    def restore_expanded_state(self):
+        if not self.expandedGroups or self.model is None:
             return
-        if self.isExpanded(index):
-            expanded_items.append(self.proxy_model.data(index, Qt.ItemDataRole.DisplayRole))
-        for row in range(self.proxy_model.rowCount(index)):
-            child_index = self.proxy_model.index(row, 0, index)
-            self._save_expanded_state_recursive(child_index, expanded_items)
-
-    def restore_expanded_state(self, expanded_items):
-        root_index = self.proxy_model.index(0, 0)
-        self._restore_expanded_state_recursive(root_index, expanded_items)
-
-    def _restore_expanded_state_recursive(self, index, expanded_items):
-        if not index.isValid():
-            return
-        if self.proxy_model.data(index, Qt.ItemDataRole.DisplayRole) in expanded_items:
-            self.setExpanded(index, True)
-        for row in range(self.proxy_model.rowCount(index)):
-            child_index = self.proxy_model.index(row, 0, index)
-            self._restore_expanded_state_recursive(child_index, expanded_items)
-
+        for target_row in range(self.proxy_model.rowCount()):
+            target_index = self.proxy_model.index(target_row, 0)
+            target_item = self.model.getItem(self.proxy_model.mapToSource(target_index))
+            if self.model.groupKey(target_item) in self.expandedGroups and not self.isExpanded(target_index):
+                self.setExpanded(target_index, True)
+            for filter_row in range(self.proxy_model.rowCount(target_index)):
+                filter_index = self.proxy_model.index(filter_row, 0, target_index)
+                filter_item = self.model.getItem(self.proxy_model.mapToSource(filter_index))
+                if self.model.groupKey(filter_item) in self.expandedGroups and not self.isExpanded(filter_index):
+                    self.setExpanded(filter_index, True)
@@ -0,0 +1,107 @@
+import ephem
+import numpy as np
+import astropy.units as u
+from astropy.coordinates import AltAz, EarthLocation, SkyCoord
+from astropy.time import Time
+
+# Moon position and phase are memoized by site and time rounded to moonCacheSeconds:
+# frames of the same night and site reuse them (in one minute the moon moves less than 0.01 deg)
+moonCacheSeconds = 60
+moonCache = {}
+
+# Post-parse stage of the sync: ALT/AZ (when missing in the header), moon phase and moon separation
+# are computed for a batch of parsed files at once instead of file by file.
+# parse_fits_file (syncWorker module) leaves in fits_data an EPHEMERIS dictionary with the values needed:
+# obstime (header date string), date (datetime of DATE-OBS), lat/lon of the site and ra/dec of the target
+# in degrees (None if missing) and altaz (True if ALT/AZ must be calculated).
+# compute_ephemeris fills OBJECT-ALT, OBJECT-AZ, MOON_PHASE and MOON_SEPARATION and removes EPHEMERIS.
+# ALT/AZ of all the frames is calculated with a single array valued transform_to, the moon is computed
+# with ephem once per site and rounded time (moonCache) and the separation with numpy on all the frames.
+# Log messages are collected as (message, logType) tuples in the log list.
+
+def compute_ephemeris(records, log):
+    pending = [fits_data for fits_data in records if fits_data is not None and "EPHEMERIS" in fits_data]
+    if not pending:
+        return
+    ephemeris = [fits_data.pop("EPHEMERIS") for fits_data in pending]
+
+    altazIndex = [i for i, values in enumerate(ephemeris) if values["altaz"]]
+    if altazIndex:
+        altitude, azimuth = calculate_altaz([ephemeris[i] for i in altazIndex], log)
+        for n, i in enumerate(altazIndex):
+            pending[i]["OBJECT-ALT"] = round(float(altitude[n]), 4)
+            pending[i]["OBJECT-AZ"] = round(float(azimuth[n]), 4)
+
+    nCached = len(moonCache)
+    moon = [calculate_moon(values, log) for values in ephemeris]
+    separation = calculate_moon_separation(ephemeris, moon)
+    for fits_data, moon_values, moon_separation in zip(pending, moon, separation):
+        fits_data["MOON_PHASE"] = moon_values[0] if moon_values else 0.0
+        fits_data["MOON_SEPARATION"] = moon_separation
+
+    log.append((f"Ephemeris calculated for {len(pending)} files ({len(altazIndex)} ALT/AZ, "
+                f"{len(moonCache) - nCached} new moon positions)", "debug"))
+
+# ALT/AZ of the targets with a single transform. Missing site or target are set to 0, 0 and
+# a missing or wrong date to now (as done when the calculation was per file)
+def calculate_altaz(ephemeris, log):
+    lat = np.array([values["lat"] if values["lat"] is not None else 0.0 for values in ephemeris])
+    lon = np.array([values["lon"] if values["lon"] is not None else 0.0 for values in ephemeris])
+    ra = np.array([values["ra"] if values["ra"] is not None else 0.0 for values in ephemeris])
+    dec = np.array([values["dec"] if values["dec"] is not None else 0.0 for values in ephemeris])
+    for values in ephemeris:
+        if values["lat"] is None or values["lon"] is None:
+            log.append(("Missing site coordinates, ALT/AZ calculated for lat 0, long 0", "error"))
+        if values["ra"] is None or values["dec"] is None:
+            log.append(("Missing target coordinates, ALT/AZ calculated for RA 0, DEC 0", "error"))
+
+    obstime = [values["obstime"] for values in ephemeris]
+    try:
+        times = Time(obstime)
+    except Exception:
+        jd = []
+        for value in obstime:
+            try:
+                jd.append(Time(value).jd)
+            except Exception as e:
+                log.append((f"Error creating Time object: {e}", "error"))
+                jd.append(Time.now().jd)
+        times = Time(jd, format='jd')
+
+    location = EarthLocation(lat=lat*u.deg, lon=lon*u.deg)
+    target = SkyCoord(ra*u.deg, dec*u.deg)
+    altaz = target.transform_to(AltAz(obstime=times, location=location))
+    return np.atleast_1d(altaz.alt.degree), np.atleast_1d(altaz.az.degree)
+
+# Moon phase (percent) and J2000 topocentric RA/DEC (radians) of a frame, None if date or site are missing
+def calculate_moon(values, log):
+    if values["date"] is None or values["lat"] is None or values["lon"] is None:
+        log.append(("Error calculating moon phase: missing date or site coordinates", "error"))
+        return None
+
+    # ephem dates are in days, the moon is computed in the middle of the rounded interval
+    interval = moonCacheSeconds / 86400
+    key = (round(values["lat"], 4), round(values["lon"], 4), int(float(ephem.Date(values["date"])) // interval))
+    if key not in moonCache:
+        observer = ephem.Observer()
+        observer.lon = str(values["lon"])
+        observer.lat = str(values["lat"])
+        observer.date = ephem.Date((key[2] + 0.5) * interval)
+        moon = ephem.Moon(observer)
+        position = ephem.Equatorial(ephem.Equatorial(moon.ra, moon.dec, epoch=observer.date), epoch=ephem.J2000)
+        moonCache[key] = (round(moon.moon_phase * 100, 2), float(position.ra), float(position.dec))
+    return moonCache[key]
+
+# Angular distance between the moon and the targets (degrees), 0 when it can't be calculated
+def calculate_moon_separation(ephemeris, moon):
+    valid = np.array([moon_values is not None and values["ra"] is not None and values["dec"] is not None
+                      for values, moon_values in zip(ephemeris, moon)], dtype=bool)
+    separation = np.zeros(len(ephemeris))
+    if valid.any():
+        moon_ra = np.array([moon_values[1] for moon_values, ok in zip(moon, valid) if ok])
+        moon_dec = np.array([moon_values[2] for moon_values, ok in zip(moon, valid) if ok])
+        ra = np.radians([values["ra"] for values, ok in zip(ephemeris, valid) if ok])
+        dec = np.radians([values["dec"] for values, ok in zip(ephemeris, valid) if ok])
+        cos_sep = np.sin(dec) * np.sin(moon_dec) + np.cos(dec) * np.cos(moon_dec) * np.cos(ra - moon_ra)
+        separation[valid] = np.degrees(np.arccos(np.clip(cos_sep, -1.0, 1.0)))
+    return [round(float(value), 2) for value in separation]
@@ -3,6 +3,7 @@ import os
 from PyQt6.QtWidgets import QApplication, QTableWidget, QTableWidgetItem, QVBoxLayout, QWidget, QHeaderView
 from astropy.io import fits
 from datetime import datetime
+from astrodom.folderScanner import list_fits_files
 
 class FitsHeaderTable(QWidget):
     def __init__(self):
@@ -38,11 +39,7 @@ class FitsHeaderTable(QWidget):
         self.load_fits_headers(self.folder_path)
 
     def load_fits_headers(self, folder_path):
-        fits_files = []
-        for root, dirs, files in os.walk(folder_path):
-            for file in files:
-                if file.lower().endswith(('.fits', '.fit')):
-                    fits_files.append(os.path.join(root, file))
+        fits_files = list_fits_files(folder_path)
 
         if not fits_files:
             print("No FITS files found in the folder.")
@@ -0,0 +1,150 @@
+import os, json, sqlite3
+
+fitsExtensions = ('.fits', '.fit')
+
+# List the FITS files under a folder without an index (os.scandir, no stat calls)
+def list_fits_files(base_dir):
+    fits_files = []
+    dirs = [base_dir]
+    while dirs:
+        current_dir = dirs.pop()
+        subdirs = []
+        try:
+            with os.scandir(current_dir) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(fitsExtensions):
+                        fits_files.append(entry.path)
+        except OSError:
+            continue
+        dirs.extend(sorted(subdirs, reverse=True))
+    return fits_files
+
+# Incremental scan of the FITS files in a project base folder.
+# The scan_index table keeps, for every directory under the base folder, its mtime and its entries
+# (subdirectories and FITS files with size and mtime). A directory whose mtime did not change since
+# the last scan is not listed again: its entries are read from the index, so on a large folder
+# only one stat per directory is needed. Changed directories are listed with os.scandir and their
+# files compared with the index.
+# scan() returns the added, modified and removed FITS files compared to the previous saved scan,
+# the current list of files is in self.files.
+# Note: rewriting a file does not change the mtime of its directory, so a modified file is detected
+# only when its directory is listed again. Use bFull to list all the directories.
+# The index is saved only if save is True (the sync), other users (eg Blink) only read it
+# so that the sync still gets the differences from its own previous scan.
+# The index is kept per project: two projects with the same base folder (eg an archived project
+# and its copy) each get the differences from their own previous sync.
+class FolderScanner:
+    def __init__(self, db_path, project_id, base_dir):
+        self.project_id = project_id
+        self.base_dir = base_dir
+        self.files = []
+        self.nListed = 0
+
+        self.conn = sqlite3.connect(db_path)
+        # The first version of the index had no PROJECT_ID: it is only a cache, so it is dropped
+        # and the next sync lists all the directories again
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(scan_index)")]
+        if columns and "PROJECT_ID" not in columns:
+            self.conn.execute("DROP TABLE scan_index")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS scan_index (
+            PROJECT_ID INTEGER,
+            DIR VARCHAR(255),
+            BASE_DIR VARCHAR(255),
+            MTIME_NS INTEGER,
+            ENTRIES TEXT,
+            PRIMARY KEY (PROJECT_ID, BASE_DIR, DIR)
+            )
+            ''')
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    # Directory -> (mtime, subdirectories, {file: [size, mtime]}) of the last saved scan
+    def load_index(self):
+        cursor = self.conn.execute("SELECT DIR, MTIME_NS, ENTRIES FROM scan_index WHERE PROJECT_ID = ? AND BASE_DIR = ?",
+                                   (self.project_id, self.base_dir))
+        index = {}
+        for directory, mtime, entries in cursor.fetchall():
+            entries = json.loads(entries)
+            index[directory] = (mtime, entries["dirs"], entries["files"])
+        return index
+
+    # List a directory: subdirectories and FITS files with their size and mtime
+    def list_dir(self, directory):
+        subdirs = []
+        files = {}
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subdirs.append(entry.name)
+                elif entry.name.lower().endswith(fitsExtensions):
+                    stat = entry.stat()
+                    files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+        return sorted(subdirs), files
+
+    def scan(self, save=True, bFull=False):
+        oldIndex = self.load_index()
+        newIndex = {}
+        changedDirs = []
+        added, modified, removed = [], [], []
+
+        self.files = []
+        dirs = [self.base_dir]
+        while dirs:
+            directory = dirs.pop()
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+                old = oldIndex.get(directory)
+                if old is not None and old[0] == mtime and not bFull:
+                    subdirs, files = old[1], old[2]
+                else:
+                    subdirs, files = self.list_dir(directory)
+                    changedDirs.append(directory)
+            except OSError:
+                # Unreadable or just deleted, its files are reported as removed
+                continue
+
+            newIndex[directory] = (mtime, subdirs, files)
+            oldFiles = oldIndex[directory][2] if directory in oldIndex else {}
+            for name in sorted(files):
+                file_path = os.path.join(directory, name)
+                self.files.append(file_path)
+                if name not in oldFiles:
+                    added.append(file_path)
+                elif oldFiles[name] != files[name]:
+                    modified.append(file_path)
+            for name in oldFiles:
+                if name not in files:
+                    removed.append(os.path.join(directory, name))
+
+            dirs.extend(os.path.join(directory, subdir) for subdir in reversed(subdirs))
+
+        deletedDirs = [directory for directory in oldIndex if directory not in newIndex]
+        for directory in deletedDirs:
+            removed.extend(os.path.join(directory, name) for name in oldIndex[directory][2])
+
+        if save:
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO scan_index (PROJECT_ID, DIR, BASE_DIR, MTIME_NS, ENTRIES) VALUES (?, ?, ?, ?, ?)",
+                                      ((self.project_id, directory, self.base_dir, newIndex[directory][0],
+                                        json.dumps({"dirs": newIndex[directory][1], "files": newIndex[directory][2]}))
+                                       for directory in changedDirs))
+                self.conn.executemany("DELETE FROM scan_index WHERE PROJECT_ID = ? AND BASE_DIR = ? AND DIR = ?",
+                                      ((self.project_id, self.base_dir, directory) for directory in deletedDirs))
+
+        self.nListed = len(changedDirs)
+        return added, modified, removed
+
+    def close(self):
+        if self.conn is None:
+            return
+        self.conn.close()
+        self.conn = None
@@ -0,0 +1,142 @@
+import os, logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PyQt6.QtCore import QObject, pyqtSignal
+from astrodom.starMeasurement import scale_image
+from astrodom.headerCache import image_data
+from astrodom.previewPyramid import get_pyramid
+from astrodom.previewStretch import file_limits, stretch_pixels
+
+# Frames prepared before and after the current one
+PREFETCH_FRAMES = 3
+# Memory of the prepared frames kept in the cache
+CACHE_BYTES = 256 * 1024 * 1024
+
+# Stride of the preview of an image: the preview has twice the pixels of the canvas width
+def preview_stride(width, previewWidth):
+    return max(int(width / (previewWidth * 2)), 1)
+
+# Read every stride rows and columns of a window (x_start, y_start, x_end, y_end) of a FITS image, None for
+# the whole image. Only those rows and columns are read (memmap of the data unit, the header is cached by the
+# headerCache module). Returns (image, (height, width) of the image)
+# A stride of None is the stride of the preview of a canvas of previewWidth
+def read_image(fits_path, stride=None, window=None, previewWidth=None):
+    data, header = image_data(fits_path)
+    height, width = data.shape
+    if stride is None:
+        stride = preview_stride(width, previewWidth)
+    x_start, y_start, x_end, y_end = window if window is not None else (0, 0, width, height)
+    image = np.array(data[y_start:y_end:stride, x_start:x_end:stride])
+
+    return scale_image(image, header.get('BSCALE', 1), header.get('BZERO', 0)), (height, width)
+
+# Read a FITS image subsampled for a canvas of previewWidth and stretch it to 8 bit. The preview is the
+# nearest level of the preview pyramid (previewPyramid module, built on the first preview), or the FITS file
+# read every stride rows and columns if there is no pyramid
+# On the GUI thread build is False: a missing pyramid is built in the background and the FITS file is read
+# The stretch uses the limits of the file (previewStretch module) or the limits passed (eg locked by the blink)
+# Returns (pixels, (height, width) of the image, stride, limits)
+def load_frame(fits_path, previewWidth, limits=None, build=True):
+    pyramid = get_pyramid(fits_path, build=build)
+    stride = pyramid.level_factor(preview_stride(pyramid.width, previewWidth)) if pyramid is not None else 1
+    if stride > 1:
+        image, _ = pyramid.read(stride)
+        height, width = pyramid.height, pyramid.width
+    else:
+        image, (height, width) = read_image(fits_path, previewWidth=previewWidth)
+        stride = preview_stride(width, previewWidth)
+
+    if limits is None:
+        limits = file_limits(fits_path, image, pyramid)
+    return stretch_pixels(image, limits), (height, width), stride, limits
+
+# Frames of the blink dialog prepared in the background: the FITS files are read, subsampled and stretched
+# (load_frame) by a pool of threads, so that the next and previous frames are ready to be shown.
+# prefetch() is called with the files in order of priority (current one first): the files not read yet are
+# queued, the queued files that are not needed anymore are cancelled.
+# The prepared frames are kept in a LRU cache of CACHE_BYTES, frameReady is emitted (GUI thread) when a
+# frame is ready, with None if the file can't be read.
+# The frames are stretched with the limits of each file, or with the limits set by setLimits (locked stretch):
+# changing them drops the frames stretched differently, the frames being read are ignored (generation).
+class FramePrefetcher(QObject):
+    frameReady = pyqtSignal(str)
+    # Emitted by the threads of the pool, received in the GUI thread
+    loaded = pyqtSignal(str, object, int)
+
+    def __init__(self, previewWidth, nWorkers=0, parent=None):
+        super().__init__(parent)
+        self.previewWidth = previewWidth
+        nWorkers = nWorkers if nWorkers > 0 else min(4, os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(max_workers=nWorkers)
+        self.frames = OrderedDict()
+        self.cacheBytes = 0
+        self.futures = {}
+        self.limits = None
+        self.generation = 0
+        self.loaded.connect(self.on_loaded)
+
+    # The prepared frame of a file, None if it isn't ready
+    def frame(self, fits_path):
+        frame = self.frames.get(fits_path)
+        if frame is not None:
+            self.frames.move_to_end(fits_path)
+        return frame
+
+    def prefetch(self, fits_paths):
+        for fits_path in list(self.futures):
+            if fits_path not in fits_paths and self.futures[fits_path].cancel():
+                del self.futures[fits_path]
+
+        for fits_path in fits_paths:
+            if fits_path in self.frames:
+                self.frames.move_to_end(fits_path)
+            elif fits_path not in self.futures:
+                self.futures[fits_path] = self.executor.submit(self.load, fits_path, self.limits, self.generation)
+
+    # Run by the pool
+    def load(self, fits_path, limits, generation):
+        try:
+            frame = load_frame(fits_path, self.previewWidth, limits)
+        except Exception as e:
+            logging.error(f"Cannot read the preview of {fits_path}: {e}")
+            frame = None
+        self.loaded.emit(fits_path, frame, generation)
+
+    def on_loaded(self, fits_path, frame, generation):
+        if generation != self.generation:
+            return
+        self.futures.pop(fits_path, None)
+        if frame is not None:
+            self.frames[fits_path] = frame
+            self.cacheBytes += frame[0].nbytes
+            # The least recently used frames are removed, the last one is kept
+            while self.cacheBytes > CACHE_BYTES and len(self.frames) > 1:
+                _, removed = self.frames.popitem(last=False)
+                self.cacheBytes -= removed[0].nbytes
+        self.frameReady.emit(fits_path)
+
+    # Stretch the frames with the same limits, None for the limits of each file
+    def setLimits(self, limits):
+        if limits == self.limits:
+            return
+        self.limits = limits
+        self.generation += 1
+        for future in self.futures.values():
+            future.cancel()
+        self.futures.clear()
+        # The frames already stretched with the locked limits are kept
+        for fits_path in [fits_path for fits_path, frame in self.frames.items() if limits is None or frame[3] != limits]:
+            self.discard(fits_path)
+
+    # Remove a file from the cache (eg deleted)
+    def discard(self, fits_path):
+        frame = self.frames.pop(fits_path, None)
+        if frame is not None:
+            self.cacheBytes -= frame[0].nbytes
+
+    # The queued files are cancelled, the files being read are left to complete
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.frames.clear()
+        self.cacheBytes = 0
@@ -0,0 +1,56 @@
+import os, threading
+from collections import OrderedDict
+import numpy as np
+from astropy.io import fits
+
+# Headers kept in memory
+CACHE_HEADERS = 64
+
+# numpy types of the BITPIX values, FITS data is big endian
+bitpixTypes = {8: 'u1', 16: '>i2', 32: '>i4', 64: '>i8', -32: '>f4', -64: '>f8'}
+
+# Headers of the FITS files shown by the previews and the keywords table. Only the header block of the primary
+# HDU is read (Header.fromfile), the data unit is not touched: the header and the offset of the data unit are
+# kept in a LRU cache keyed by path, size and mtime, so selecting a row again or blinking between the same
+# frames doesn't parse the header again and a modified file is read again.
+# image_data maps the data unit with the cached header, so that the preview and the keywords table of a file
+# share a single read of the header.
+class HeaderCache:
+    headers = OrderedDict()
+    lock = threading.Lock()
+
+    @classmethod
+    def get(cls, key):
+        with cls.lock:
+            cached = cls.headers.get(key)
+            if cached is not None:
+                cls.headers.move_to_end(key)
+            return cached
+
+    @classmethod
+    def put(cls, key, cached):
+        with cls.lock:
+            cls.headers[key] = cached
+            while len(cls.headers) > CACHE_HEADERS:
+                cls.headers.popitem(last=False)
+
+# The primary header of a file and the offset of its data unit
+def read_header(fits_path):
+    file_stat = os.stat(fits_path)
+    key = (fits_path, file_stat.st_size, file_stat.st_mtime_ns)
+    cached = HeaderCache.get(key)
+    if cached is None:
+        with open(fits_path, 'rb') as file:
+            header = fits.Header.fromfile(file)
+            # The header blocks are padded, the data unit starts here
+            cached = (header, file.tell())
+        HeaderCache.put(key, cached)
+    return cached
+
+# The raw pixels of the primary image of a file (memmap, not scaled by BSCALE/BZERO) and its header
+def image_data(fits_path):
+    header, offset = read_header(fits_path)
+    if header.get('NAXIS', 0) != 2 or header.get('BITPIX') not in bitpixTypes:
+        raise ValueError(f"No data in the FITS file {fits_path}")
+    shape = (header['NAXIS2'], header['NAXIS1'])
+    return np.memmap(fits_path, dtype=bitpixTypes[header['BITPIX']], mode='r', offset=offset, shape=shape), header
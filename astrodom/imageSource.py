@@ -0,0 +1,243 @@
+import sqlite3, logging
+import numpy as np
+import pandas as pd
+
+from astrodom.loadSettings import *
+
+# Images of a project read by the dashboard (dashboardTreeModel) in small queries instead of
+# loading the whole images table: group totals of the targets and filters, pages of the images
+# of a filter and the few columns needed to apply the thresholds.
+# The group totals are read from the image_summary table (create_summary), kept up to date by
+# triggers on the images table, so they don't depend on the number of images.
+# The images of a filter are in (DATE_OBS, FILE) order and a page starts after the key of the last
+# image already read (keyset paging), so the images inserted or deleted by a sync don't shift the pages.
+# SqliteImageSource reads the database, DataFrameImageSource reads a dataframe of the images table
+# (dashboard benchmark). Both return dataframes with the columns of the images table.
+
+# Totals of a group: number of images, sums and number of values of the columns (missing values are
+# skipped), signal is the sum of MEDIAN - BIAS_SIGNAL and noise the sum of STD squared (SNR of a filter)
+totalColumns = ["count", "exposure", "size", "fwhm", "fwhmCount", "eccentricity", "eccentricityCount",
+                "mean", "meanCount", "median", "medianCount", "signal", "noise"]
+
+# Columns of the rejection of the images by the thresholds (DashboardTreeModel.setThresholds)
+measureColumns = ["OBJECT", "FILTER", "FILE", "FWHM", "ECCENTRICITY", "MEDIAN", "STD", "OBJECT_ALT"]
+
+# Columns of the images table that are numbers: a page where all the values are missing returns
+# them as floats as the pages with values
+numericColumns = ["EXPOSURE", "CCD_TEMP", "XBINNING", "GAIN", "OFFSET", "FWHM", "ECCENTRICITY", "SIZE",
+                  "MEAN", "MEDIAN", "STD", "MOON_PHASE", "MOON_SEPARATION"]
+
+def numeric_columns(data):
+    for column in numericColumns:
+        if column in data.columns and data[column].dtype == object:
+            data[column] = pd.to_numeric(data[column], errors='coerce')
+    return data
+
+# Sums of the image_summary table: a row for each project, target and filter with the value added
+# by every image ({row} is NEW or OLD in the triggers, images when the table is filled)
+# Missing values are not added and not counted (the averages skip them)
+summarySums = {
+    "COUNT": "1",
+    "EXPOSURE": "IFNULL({row}.EXPOSURE, 0)",
+    "SIZE": "IFNULL({row}.SIZE, 0)",
+    "FWHM": "IFNULL({row}.FWHM, 0)",
+    "FWHM_COUNT": "({row}.FWHM IS NOT NULL)",
+    "ECCENTRICITY": "IFNULL({row}.ECCENTRICITY, 0)",
+    "ECCENTRICITY_COUNT": "({row}.ECCENTRICITY IS NOT NULL)",
+    "MEAN": "IFNULL({row}.MEAN, 0)",
+    "MEAN_COUNT": "({row}.MEAN IS NOT NULL)",
+    "MEDIAN": "IFNULL({row}.MEDIAN, 0)",
+    "MEDIAN_COUNT": "({row}.MEDIAN IS NOT NULL)",
+    "NOISE": "IFNULL({row}.STD * {row}.STD, 0)",
+}
+
+# Create the image_summary table and its triggers if missing. The table is filled from the images
+# table when it is created (databases of previous versions), then every insert, delete and update
+# of the images (sync, file operations, project delete, star analysis) adds or subtracts the image
+# to its group in the same transaction. A group is removed with its last image
+# Keys are compared with IS because an image can be without target or filter (NULL)
+def create_summary(conn):
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'image_summary'").fetchone():
+        return
+
+    def group(row):
+        return f"PROJECT_ID IS {row}.PROJECT_ID AND OBJECT IS {row}.OBJECT AND FILTER IS {row}.FILTER"
+
+    def add(row):
+        return f"""INSERT INTO image_summary (PROJECT_ID, OBJECT, FILTER) SELECT {row}.PROJECT_ID, {row}.OBJECT, {row}.FILTER
+                   WHERE NOT EXISTS (SELECT 1 FROM image_summary WHERE {group(row)});
+                   UPDATE image_summary SET {", ".join(f"{column} = {column} + {value.format(row=row)}" for column, value in summarySums.items())}
+                   WHERE {group(row)};"""
+
+    def subtract(row):
+        return f"""UPDATE image_summary SET {", ".join(f"{column} = {column} - {value.format(row=row)}" for column, value in summarySums.items())}
+                   WHERE {group(row)};
+                   DELETE FROM image_summary WHERE {group(row)} AND COUNT <= 0;"""
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(f"""CREATE TABLE image_summary (PROJECT_ID INTEGER, OBJECT VARCHAR(255), FILTER VARCHAR(255),
+                         {", ".join(f"{column} {'INTEGER' if column == 'COUNT' or column.endswith('_COUNT') else 'REAL'} DEFAULT 0" for column in summarySums)})""")
+        conn.execute("CREATE INDEX idx_image_summary ON image_summary (PROJECT_ID, OBJECT, FILTER)")
+        conn.execute(f"""INSERT INTO image_summary SELECT PROJECT_ID, OBJECT, FILTER,
+                         {", ".join(f"SUM({value.format(row='images')})" for value in summarySums.values())}
+                         FROM images GROUP BY PROJECT_ID, OBJECT, FILTER""")
+        conn.execute(f"CREATE TRIGGER image_summary_insert AFTER INSERT ON images BEGIN {add('NEW')} END")
+        conn.execute(f"CREATE TRIGGER image_summary_delete AFTER DELETE ON images BEGIN {subtract('OLD')} END")
+        conn.execute(f"""CREATE TRIGGER image_summary_update AFTER UPDATE OF PROJECT_ID, OBJECT, FILTER, EXPOSURE, SIZE, FWHM,
+                         ECCENTRICITY, MEAN, MEDIAN, STD ON images BEGIN {subtract('OLD')} {add('NEW')} END""")
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+# project_id None (or 0) reads all the projects
+class SqliteImageSource:
+    def __init__(self, db_path, project_id=None):
+        self.project_id = project_id if project_id else None
+        self.conn = sqlite3.connect(db_path)
+        # Pages of a filter are read with this index
+        try:
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_images_group ON images (PROJECT_ID, OBJECT, FILTER, DATE_OBS, FILE)")
+            self.conn.commit()
+        except sqlite3.Error as e:
+            logging.warning(f"Index of the images not created: {e}")
+        create_summary(self.conn)
+
+    def close(self):
+        self.conn.close()
+
+    # WHERE clause and parameters of the project
+    def project(self):
+        if self.project_id is None:
+            return "1", []
+        return "PROJECT_ID = ?", [self.project_id]
+
+    # (key, totals) of the targets (keys "OBJECT") or of the filters of the targets (keys ["OBJECT", "FILTER"]), in key order
+    # The target totals include the images without filter
+    def group_totals(self, keys):
+        keys = [keys] if isinstance(keys, str) else list(keys)
+        where, params = self.project()
+        columns = ", ".join(keys)
+        notNull = " AND ".join(f"{key} IS NOT NULL" for key in keys)
+        query = f"""SELECT {columns}, SUM(COUNT), SUM(EXPOSURE), SUM(SIZE),
+                    SUM(FWHM), SUM(FWHM_COUNT), SUM(ECCENTRICITY), SUM(ECCENTRICITY_COUNT),
+                    SUM(MEAN), SUM(MEAN_COUNT), SUM(MEDIAN), SUM(MEDIAN_COUNT),
+                    SUM(MEDIAN) - ? * SUM(MEDIAN_COUNT), SUM(NOISE)
+                    FROM image_summary WHERE {where} AND {notNull} GROUP BY {columns} ORDER BY {columns}"""
+        rows = self.conn.execute(query, [BIAS_SIGNAL] + params).fetchall()
+        return [(row[0] if len(keys) == 1 else tuple(row[:len(keys)]), dict(zip(totalColumns, row[len(keys):])))
+                for row in rows]
+
+    # Images of a filter after the key (DATE_OBS, FILE) of the last image read, at most limit (None for all)
+    def page(self, object_name, filter_name, after=None, limit=None):
+        where, params = self.project()
+        query = f"SELECT * FROM images WHERE {where} AND OBJECT = ? AND FILTER = ?"
+        params = params + [object_name, filter_name]
+        # Images without date are the first ones (as NULL in the order)
+        if after is not None and after[0] is None:
+            query += " AND ((DATE_OBS IS NULL AND FILE > ?) OR DATE_OBS IS NOT NULL)"
+            params.append(after[1])
+        elif after is not None:
+            query += " AND (DATE_OBS, FILE) > (?, ?)"
+            params += list(after)
+        query += " ORDER BY DATE_OBS, FILE"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(int(limit))
+        return numeric_columns(pd.read_sql_query(query, self.conn, params=params))
+
+    # Files of the images of a filter
+    def files(self, object_name, filter_name):
+        where, params = self.project()
+        rows = self.conn.execute(f"SELECT FILE FROM images WHERE {where} AND OBJECT = ? AND FILTER = ?",
+                                 params + [object_name, filter_name]).fetchall()
+        return [row[0] for row in rows]
+
+    # Columns of the rejection of all the images
+    def measures(self):
+        where, params = self.project()
+        query = f"SELECT {', '.join(measureColumns)} FROM images WHERE {where} AND OBJECT IS NOT NULL AND FILTER IS NOT NULL"
+        return numeric_columns(pd.read_sql_query(query, self.conn, params=params))
+
+    # All the columns of the images of a target and filter (None for all) or of a list of files
+    # The files are read in chunks to stay under the limit of the SQL variables
+    def frame(self, object_name=None, filter_name=None, files=None):
+        where, params = self.project()
+        if files is not None:
+            files = list(files)
+            chunks = [pd.read_sql_query(f"SELECT * FROM images WHERE {where} AND FILE IN ({', '.join('?' * len(chunk))})",
+                                        self.conn, params=params + chunk)
+                      for chunk in (files[start:start + 500] for start in range(0, len(files), 500))]
+            if not chunks:
+                return numeric_columns(pd.read_sql_query("SELECT * FROM images WHERE 0", self.conn))
+            return numeric_columns(pd.concat(chunks, ignore_index=True))
+
+        query = f"SELECT * FROM images WHERE {where}"
+        if object_name is not None:
+            query += " AND OBJECT = ?"
+            params.append(object_name)
+        if filter_name is not None:
+            query += " AND FILTER = ?"
+            params.append(filter_name)
+        return numeric_columns(pd.read_sql_query(query + " ORDER BY DATE_OBS", self.conn, params=params))
+
+    # The database is already written by the sync
+    def insert(self, data):
+        pass
+
+    def remove(self, files):
+        pass
+
+class DataFrameImageSource:
+    def __init__(self, data):
+        self.data = data.reset_index(drop=True)
+
+    def close(self):
+        pass
+
+    def group_totals(self, keys):
+        data = self.data
+        groups = data.assign(SIGNAL=data['MEDIAN'] - BIAS_SIGNAL, NOISE=np.square(data['STD'])).groupby(keys, sort=True).agg(
+            count=('FILE', 'size'), exposure=('EXPOSURE', 'sum'), size=('SIZE', 'sum'),
+            fwhm=('FWHM', 'sum'), fwhmCount=('FWHM', 'count'), eccentricity=('ECCENTRICITY', 'sum'), eccentricityCount=('ECCENTRICITY', 'count'),
+            mean=('MEAN', 'sum'), meanCount=('MEAN', 'count'), median=('MEDIAN', 'sum'), medianCount=('MEDIAN', 'count'),
+            signal=('SIGNAL', 'sum'), noise=('NOISE', 'sum'))
+        return list(zip(groups.index, groups.to_dict('records')))
+
+    def group(self, object_name, filter_name):
+        data = self.data
+        return data[(data['OBJECT'] == object_name) & (data['FILTER'] == filter_name)]
+
+    def page(self, object_name, filter_name, after=None, limit=None):
+        data = self.group(object_name, filter_name)
+        # Images without date first as in the database
+        dates = data['DATE_OBS'].fillna('')
+        if after is not None:
+            date = after[0] if after[0] is not None else ''
+            data = data[(dates > date) | ((dates == date) & (data['FILE'] > after[1]))]
+            dates = data['DATE_OBS'].fillna('')
+        data = data.assign(KEY=dates).sort_values(['KEY', 'FILE']).drop(columns='KEY')
+        return data if limit is None else data.head(limit)
+
+    def files(self, object_name, filter_name):
+        return self.group(object_name, filter_name)['FILE'].tolist()
+
+    def measures(self):
+        return self.data.dropna(subset=['OBJECT', 'FILTER'])[measureColumns]
+
+    def frame(self, object_name=None, filter_name=None, files=None):
+        data = self.data
+        if files is not None:
+            return data[data['FILE'].isin(list(files))].reset_index(drop=True)
+        if object_name is not None:
+            data = data[data['OBJECT'] == object_name]
+        if filter_name is not None:
+            data = data[data['FILTER'] == filter_name]
+        return data.reset_index(drop=True)
+
+    def insert(self, data):
+        self.data = pd.concat([self.data, data], ignore_index=True)
+
+    def remove(self, files):
+        self.data = self.data[~self.data['FILE'].isin(list(files))].reset_index(drop=True)
@@ -0,0 +1,103 @@
+from datetime import datetime
+from astropy.io import fits
+from astropy.coordinates import Angle
+
+# Converters of the FITS header values to the values saved in the database
+
+def to_text(value):
+    return str(value)
+
+def to_int(value):
+    return int(value)
+
+def to_float(value):
+    return round(float(value), 2)
+
+# Dates are saved as YYYY-MM-DDTHH:MM:SS, fractional seconds are dropped
+def to_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f').strftime('%Y-%m-%dT%H:%M:%S')
+    except ValueError:
+        try:
+            return datetime.strptime(value.split('.')[0], '%Y-%m-%dT%H:%M:%S').strftime('%Y-%m-%dT%H:%M:%S')
+        except ValueError:
+            try:
+                return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%dT00:00:00')
+            except ValueError:
+                return '1970-01-01T00:00:00'
+
+# RA is in hours (sexagesimal string or decimal), saved in decimal degrees
+def to_hourangle(value):
+    return round(Angle(value, unit='hourangle').degree, 4)
+
+def to_degree(value):
+    return round(Angle(value, unit='deg').degree, 4)
+
+# Converter of each AstroDom keyword read from the header (the FILTER converter is set by the resolver)
+keywordConverters = {
+    "OBJECT": to_text,
+    "IMAGETYP": to_text,
+    "DATE-OBS": to_date,
+    "EXPOSURE": to_int,
+    "XBINNING": to_int,
+    "GAIN": to_int,
+    "OFFSET": to_int,
+    "CCD-TEMP": to_float,
+    "OBJECT-RA": to_hourangle,
+    "OBJECT-DEC": to_degree,
+    "OBJECT-ALT": to_degree,
+    "OBJECT-AZ": to_degree,
+    "SITELAT": to_degree,
+    "SITELONG": to_degree,
+}
+
+# A keyword in the header with no value is treated as missing
+def is_empty(value):
+    return value is None or value == '' or isinstance(value, fits.card.Undefined)
+
+# The ad_keywords and filterMapping dictionaries (syncWorker module) compiled once in lookup tables:
+# fitsKeys maps every FITS keyword to the AstroDom keywords it can be read for, with its priority
+# (position in the fits_key list) and filterAliases maps every filter name to the AstroDom filter.
+# resolve() reads the header in a single pass over its cards and returns a record with
+# the converted values of the keywords found and the raw header values (used to compute ALT/AZ).
+# A value that can't be converted is logged and left out of the record.
+class KeywordResolver:
+    def __init__(self, ad_keywords, filterMapping, converters=keywordConverters):
+
+        self.filterAliases = {}
+        for filter_key, filter_values in filterMapping.items():
+            for filter_value in filter_values:
+                self.filterAliases[filter_value] = filter_key
+
+        self.converters = dict(converters)
+        self.converters["FILTER"] = self.to_filter
+
+        self.fitsKeys = {}
+        for ad_keyword, ad_value in ad_keywords.items():
+            if ad_keyword not in self.converters:
+                continue
+            for priority, fits_key in enumerate(ad_value['fits_key']):
+                self.fitsKeys.setdefault(fits_key, []).append((ad_keyword, priority))
+
+    def to_filter(self, value):
+        return self.filterAliases[value]
+
+    def resolve(self, header, log):
+        raw = {}
+        rank = {}
+        for fits_key, value in header.items():
+            for ad_keyword, priority in self.fitsKeys.get(fits_key, ()):
+                if is_empty(value) or (ad_keyword in rank and priority >= rank[ad_keyword]):
+                    continue
+                raw[ad_keyword] = value
+                rank[ad_keyword] = priority
+
+        record = {}
+        for ad_keyword, value in raw.items():
+            try:
+                record[ad_keyword] = self.converters[ad_keyword](value)
+            except Exception as e:
+                log.append((f"Invalid value {value} for {ad_keyword}: {e}", "warning"))
+
+        log.append((f"FITS header keywords: {record}", "debug"))
+        return record, raw
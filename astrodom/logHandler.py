@@ -1,19 +1,71 @@
-import logging
+import logging, time
 from PyQt6.QtWidgets import QTextEdit
+from PyQt6.QtCore import QTimer
 
+# Refresh interval (ms) of the log widget and of the log batches sent by the threads
+LOG_REFRESH_INTERVAL = 100
+
+# The log widget keeps at most maxLines lines, the oldest are dropped (maximumBlockCount of the document)
+# Records are collected when logged and appended by a timer every LOG_REFRESH_INTERVAL with a single scroll
 class QTextEditLogger(logging.Handler):
-    def __init__(self, log_edit: QTextEdit):
+    def __init__(self, log_edit: QTextEdit, maxLines=5000):
         super().__init__()
         self.log_edit = log_edit
+        self.log_edit.document().setMaximumBlockCount(maxLines)
+        self.pending = []
+
+        self.timer = QTimer(log_edit)
+        self.timer.setInterval(LOG_REFRESH_INTERVAL)
+        self.timer.timeout.connect(self.append_pending)
+        self.timer.start()
 
     def emit(self, record):
-        self.log_edit.append(self.format(record))
-        self.log_edit.verticalScrollBar().setValue(self.log_edit.verticalScrollBar().maximum()) 
+        self.pending.append(self.format(record))
+
+    def append_pending(self):
+        if not self.pending:
+            return
+        lines, self.pending = self.pending, []
+
+        # Lines over the maximum would be dropped anyway
+        for line in lines[-self.log_edit.document().maximumBlockCount():]:
+            self.log_edit.append(line)
+        self.log_edit.verticalScrollBar().setValue(self.log_edit.verticalScrollBar().maximum())
         self.flush()
 
     def flush(self):
         self.log_edit.ensureCursorVisible()
-                
+
+# Thread side of the log: messages below the logging level are dropped before any signal is sent,
+# the others are collected and sent together every LOG_REFRESH_INTERVAL to emitBatch as a list of
+# (message, logType) tuples (eg the emit of a pyqtSignal(list)). Call flush when the thread ends.
+class ThreadLogBuffer:
+    levels = {
+        "debug": logging.DEBUG,
+        "info": logging.INFO,
+        "warning": logging.WARNING,
+        "error": logging.ERROR,
+        "critical": logging.CRITICAL
+    }
+
+    def __init__(self, emitBatch):
+        self.emitBatch = emitBatch
+        self.records = []
+        self.lastEmit = time.monotonic()
+
+    def log(self, message, logType="info"):
+        if not logging.getLogger().isEnabledFor(self.levels.get(logType, logging.INFO)):
+            return
+        self.records.append((message, logType))
+        if time.monotonic() - self.lastEmit >= LOG_REFRESH_INTERVAL / 1000:
+            self.flush()
+
+    def flush(self):
+        if self.records:
+            records, self.records = self.records, []
+            self.emitBatch(records)
+        self.lastEmit = time.monotonic()
+
 class ColorFormatter(logging.Formatter):
     COLORS = {
         'DEBUG': 'green',
@@ -26,4 +78,4 @@ class ColorFormatter(logging.Formatter):
     def format(self, record):
         color = self.COLORS.get(record.levelname, 'black')
         record.msg = f'<span style="color: {color};">{record.msg}</span>'
-        return super().format(record)
\ No newline at end of file
+        return super().format(record)
@@ -1,25 +1,25 @@
 import numpy as np
 import logging
+import pyqtgraph as pg
 from PyQt6.QtWidgets import QWidget, QVBoxLayout, QTableView, QHeaderView,QSizePolicy
-from PyQt6.QtCore import QAbstractTableModel, Qt
-from astropy.io import fits
-from astropy.visualization import *
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas, NavigationToolbar2QT
-from matplotlib.figure import Figure
-from matplotlib import colors, cm, pyplot as plt
+from PyQt6.QtCore import QAbstractTableModel, Qt, QRectF, QTimer
+from astrodom.framePrefetcher import load_frame, read_image, preview_stride
+from astrodom.previewPyramid import PreviewPyramid
+from astrodom.previewStretch import stretch_pixels
+from astrodom.headerCache import read_header
 
-logging.getLogger('matplotlib.font_manager').setLevel(logging.WARNING)
+# Milliseconds without zoom or pan before the visible region is read at a higher resolution
+REFINE_DELAY = 150
 
 # This class is the model for the FITS keywords table.
+# The cards are read from the header when displayed, the keywords and values are not copied.
 class KeywordsModel(QAbstractTableModel):
     def __init__(self, header, parent=None):
         super(KeywordsModel, self).__init__(parent)
         self.header = header
-        self.keys = list(header.keys())
-        self.values = list(header.values())
 
     def rowCount(self, parent=None):
-        return len(self.keys)
+        return len(self.header)
 
     def columnCount(self, parent=None):
         return 2
@@ -28,9 +28,9 @@ class KeywordsModel(QAbstractTableModel):
         if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
             return None
         if index.column() == 0:
-            return self.keys[index.row()]
+            return self.header.cards[index.row()].keyword
         elif index.column() == 1:
-            return self.values[index.row()]
+            return self.header[index.row()]
 
     def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
         if role != Qt.ItemDataRole.DisplayRole:
@@ -46,43 +46,60 @@ class KeywordsModel(QAbstractTableModel):
 # and the itemsAtSelectedRow is set  when the user clicks a row in the table.
 # When a new row is clicked, the setItemsAtSelectedRow method is called and the plot method of this class
 # is called. 
-# The zoom events are tracked by the onPress and onRelease methods and dimensions stored in class variables.
-# So that when a new row is clicked, the plot method can use the stored dimensions to plot the image with the
-# same zoom level as the previous image.
+# The preview is drawn by pyqtgraph: the 8 bit pixels (framePrefetcher module) are the buffer of an ImageItem
+# placed in the coordinates of the full image, so zoom and pan only change the transform of the view and
+# the pixels are not drawn again. The base item has the whole image read every imageScaleFactor rows and columns.
+# When the view is zoomed beyond that resolution, the visible region (and a margin for the pan) is read again
+# with a smaller stride in the detail item over it (refineView), zooming out hides it. The region is read from
+# the tiles of the nearest level of the preview pyramid (previewPyramid module), the FITS file is read only
+# at full resolution or when there is no pyramid. It is stretched with the limits of the frame, so the zoomed
+# region has the same contrast of the whole preview.
+# The view range is kept when a new image is shown, so the next image has the same zoom level as the previous
+# image. A double click resets the zoom.
 class PreviewAndDataWidget(QWidget):
     def __init__(self, previewWidth=320, parent=None):
         super().__init__(parent)
         self.resetZoom = True
-        self.x_start = 0
-        self.x_end = 0
-        self.y_start = 0
-        self.y_end = 0
         self.previewWidth = previewWidth
+        self.fits_path = None
+        self.pyramid = None
+        # Display limits of the frame shown (previewStretch module)
+        self.limits = None
+        self.imageWidth = 0
+        self.imageHeight = 0
+        self.imageScaleFactor = 1
+        # (x_start, y_start, x_end, y_end, stride) of the region read in the detail item
+        self.detailWindow = None
         
         layout = QVBoxLayout(self)
         layout.setContentsMargins(0, 0, 0, 0)
         layout.setSpacing(0)
         self.setLayout(layout)
 
-        #Add the image preview canvas
-        self.canvas = FigureCanvas(Figure(figsize=(self.width() / 100, self.width() / 100)))
-        self.ax = self.canvas.figure.subplots()
-        self.canvas.figure.patch.set_facecolor('gray')
-        self.ax.set_facecolor('black')
-        self.ax.set_xticks([])
-        self.ax.set_yticks([])
-        self.resetZoom = True
-        self.connectZoomEvent()
-        
-        layout.addWidget(self.canvas)
-        self.canvas.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
-        self.canvas.updateGeometry()
-        # Image preview controls
-        self.toolbar = NavigationToolbar2QT(self.canvas, self)
-        self.toolbar.zoom()
-        self.toolbar.hide()
-        layout.addWidget(self.toolbar)
-        layout.addWidget(self.canvas)
+        #Add the image preview view, y goes up as the FITS rows
+        self.graphicsView = pg.GraphicsView(self)
+        self.graphicsView.setBackground('gray')
+        self.viewBox = pg.ViewBox(lockAspect=True, enableMenu=False)
+        self.viewBox.setBackgroundColor('k')
+        # Left drag draws the zoom rectangle, the wheel zooms too
+        self.viewBox.setMouseMode(pg.ViewBox.RectMode)
+        self.graphicsView.setCentralItem(self.viewBox)
+
+        self.imageItem = pg.ImageItem(axisOrder='row-major')
+        self.detailItem = pg.ImageItem(axisOrder='row-major')
+        self.detailItem.setZValue(1)
+        self.viewBox.addItem(self.imageItem)
+        self.viewBox.addItem(self.detailItem)
+
+        self.refineTimer = QTimer(self)
+        self.refineTimer.setSingleShot(True)
+        self.refineTimer.setInterval(REFINE_DELAY)
+        self.refineTimer.timeout.connect(self.refineView)
+        self.viewBox.sigRangeChanged.connect(self.refineTimer.start)
+        self.graphicsView.scene().sigMouseClicked.connect(self.onClick)
+
+        layout.addWidget(self.graphicsView)
+        self.graphicsView.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
 
         # Add the keyowords table to the layout 
         self.tableView = QTableView(self)
@@ -94,6 +111,24 @@ class PreviewAndDataWidget(QWidget):
         logging.debug(f"Setting blink item: {self.fits_path}")
         self.plotImage()
 
+    # Show a frame (load_frame), eg prepared by the blink dialog (framePrefetcher module)
+    def showFrame(self, fits_path, frame):
+        self.fits_path = fits_path
+        self.pyramid = PreviewPyramid.open(fits_path)
+        pixels, (self.imageHeight, self.imageWidth), self.imageScaleFactor, self.limits = frame
+        logging.debug(f"Image width: {self.imageWidth}, Image height: {self.imageHeight}, Scale factor: {self.imageScaleFactor}")
+
+        # Each preview pixel covers imageScaleFactor image pixels
+        self.imageItem.setImage(pixels, levels=(0, 255), autoLevels=False)
+        self.imageItem.setRect(0, 0, pixels.shape[1] * self.imageScaleFactor, pixels.shape[0] * self.imageScaleFactor)
+        self.detailWindow = None
+        self.detailItem.clear()
+
+        if self.resetZoom:
+            self.viewBox.setRange(QRectF(0, 0, self.imageWidth, self.imageHeight), padding=0)
+        else:
+            self.refineView()
+
     # Called by the main window when a new row is clicked
     def setItemsAtSelectedRow(self, itemsAtSelectedRow):
 
@@ -103,97 +138,74 @@ class PreviewAndDataWidget(QWidget):
         self.plotImage()
         self.printKeywords()
 
+    # The header is read once and cached (headerCache module), the preview of the same file shares it
     def printKeywords(self):
         try:
-            with fits.open(self.fits_path) as hdul:
-                header = hdul[0].header
-                keywordsModel = KeywordsModel(header)
-                self.tableView.setModel(keywordsModel)
-                self.tableView.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+            header, _ = read_header(self.fits_path)
         except Exception as e:  
             logging.error(f"Cannot open fits file: {e}")
             return
+        keywordsModel = KeywordsModel(header)
+        self.tableView.setModel(keywordsModel)
+        self.tableView.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
 
-    # Plot the preview image
+    # Plot the preview image, the pyramid of a file seen for the first time is built in the background
     def plotImage(self):
+        try:
+            frame = load_frame(self.fits_path, self.previewWidth, build=False)
+        except Exception as e:
+            logging.error(f"Error in plotting image: {e}")
+            return
+        self.showFrame(self.fits_path, frame)
 
-        self.ax.clear()
-
-        with fits.open(self.fits_path) as hdul:
-            if len(hdul) > 0 and hdul[0].data is not None:
-                image_data = hdul[0].data
-
-                # Get the real image dimensions, without any zoom
-                self.height, self.width = image_data.shape
-                logging.debug(f"Image width: {self.width}, Image height: {self.height}")
-
-                # Scale the image to fit the canvas size twice
-                # Or another way to see it, a small canvas  can have a lower resolution image
-                # The scale factor will be used as the sampling reading of the image
-                self.imageScaleFactor = max(int(self.width / (self.previewWidth * 2)), 1)
-                logging.debug(f"Scale factor: {self.imageScaleFactor}")
-
-                if self.x_end == 0:
-                    #This case is on first load or when the image zoom is reset
-                    self.image = image_data[0:self.height:self.imageScaleFactor, 0:self.width:self.imageScaleFactor]
-                else:
-                    #This case is when the user zooms in the image
-                    self.image = image_data[self.y_start:self.y_end:self.zoomScaleFactor, self.x_start:self.x_end:self.zoomScaleFactor]
+    # Read the visible region again when the view is zoomed beyond the resolution of the base item
+    def refineView(self):
+        if self.fits_path is None or self.imageWidth == 0:
+            return
 
-                norm = ImageNormalize(self.image, interval=ZScaleInterval(contrast=0.05), stretch=AsinhStretch())      
+        (x_start, x_end), (y_start, y_end) = self.viewBox.viewRange()
+        x_start, y_start = max(int(x_start), 0), max(int(y_start), 0)
+        x_end, y_end = min(int(np.ceil(x_end)), self.imageWidth), min(int(np.ceil(y_end)), self.imageHeight)
+        self.resetZoom = x_start == 0 and y_start == 0 and x_end == self.imageWidth and y_end == self.imageHeight
+        if x_end <= x_start or y_end <= y_start:
+            return
 
-                try:
-                    self.ax.imshow(self.image, cmap=cm.gray, norm=norm,origin='lower')
-                    self.ax.set_xticks([])
-                    self.ax.set_yticks([])
-                except Exception as e:
-                    logging.error(f"Error in plotting image: {e}")
+        # The visible region has twice the pixels of the canvas width, as the base item has for the whole image
+        stride = preview_stride(x_end - x_start, self.previewWidth)
+        if self.pyramid is not None:
+            stride = self.pyramid.level_factor(stride)
+        if stride >= self.imageScaleFactor:
+            self.detailWindow = None
+            self.detailItem.clear()
+            return
 
-                self.canvas.draw()
+        # The region already read covers the visible one
+        if self.detailWindow is not None:
+            x0, y0, x1, y1, detailStride = self.detailWindow
+            if detailStride == stride and x0 <= x_start and y0 <= y_start and x1 >= x_end and y1 >= y_end:
+                return
 
+        # Half the visible size is read around it, so that a short pan doesn't read the file again
+        x_margin, y_margin = (x_end - x_start) // 2, (y_end - y_start) // 2
+        window = (max(x_start - x_margin, 0), max(y_start - y_margin, 0),
+                  min(x_end + x_margin, self.imageWidth), min(y_end + y_margin, self.imageHeight))
+        try:
+            if self.pyramid is not None and stride > 1:
+                image, (x, y) = self.pyramid.read(stride, window)
             else:
-                logging.error("No data in the FITS file")
-                self.image = np.zeros((1, 1))  # Return a default image if no data is present
-  
-    def onPress(self, event):
-        # Zoom events are only tracked when the toolbar mode is 'zoom rect'
-        if self.toolbar.mode == 'zoom rect':
-            # Press is the starting point of the zoom rectangle
-            self.press = (event.xdata, event.ydata)
-        
-    def onRelease(self, event):
-        # Zoom events are only tracked when the toolbar mode is 'zoom rect'
-        if self.toolbar.mode == 'zoom rect':
-            # Release is the ending point of the zoom rectangle
-            self.release = (event.xdata, event.ydata)
-
-            if self.press and self.release:
-                # If the rectangle is big enough, zoom in the image
-                if abs(self.release[1] - self.press[1]) > 10 and abs(self.release[0] - self.press[0]) > 10 :
-                    self.x_start = int(min(self.press[0], self.release[0]) * self.imageScaleFactor)
-                    self.x_end = int(max(self.press[0], self.release[0]) * self.imageScaleFactor)
-                    self.y_start = int(min(self.press[1], self.release[1]) * self.imageScaleFactor)
-                    self.y_end = int(max(self.press[1], self.release[1]) * self.imageScaleFactor)
-
-                    self.resetZoom = False
-                    self.zoomScaleFactor = max(int(abs(self.x_end  - self.x_start) / (self.previewWidth*2)), 1)
-
-                else:      
-                    # If the rectangle is too small, reset the zoom, this is the case of a double click
-                    # to reset the zoom.          
-                    self.resetZoom = True
-                    self.zoomScaleFactor = self.imageScaleFactor
-                    self.x_end=self.width
-                    self.y_end=self.height
-                    self.x_start=0          
-                    self.y_start=0
-                    self.plotImage()
-
-                logging.debug(f"Zoom scale factor: {self.zoomScaleFactor}")
-                logging.debug(f"New coordinates: x_start={self.x_start}, x_end={self.x_end}, y_start={self.y_start}, y_end={self.y_end}")
-
-    def connectZoomEvent(self):
-        self.canvas.mpl_connect('button_press_event', self.onPress)
-        self.canvas.mpl_connect('button_release_event', self.onRelease)
+                image, _ = read_image(self.fits_path, stride, window)
+                x, y = window[0], window[1]
+        except Exception as e:
+            logging.error(f"Error in plotting image: {e}")
+            return
+        logging.debug(f"Zoom scale factor: {stride}, region: {window}")
 
+        self.detailItem.setImage(stretch_pixels(image, self.limits), levels=(0, 255), autoLevels=False)
+        self.detailItem.setRect(x, y, image.shape[1] * stride, image.shape[0] * stride)
+        self.detailWindow = (*window, stride)
 
+    # A double click resets the zoom
+    def onClick(self, event):
+        if event.double() and self.imageWidth > 0:
+            self.resetZoom = True
+            self.viewBox.setRange(QRectF(0, 0, self.imageWidth, self.imageHeight), padding=0)
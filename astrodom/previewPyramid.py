@@ -0,0 +1,223 @@
+import os, json, shutil, hashlib, logging, tempfile, threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import importlib_resources
+from astrodom.starMeasurement import scale_image
+from astrodom.headerCache import image_data
+from astrodom.previewStretch import zscale_limits
+from astrodom.loadSettings import *
+
+# Side of the square tiles of the pyramid levels
+TILE_SIZE = 256
+# Pyramids waiting to be built in the background, the other files are built on a later preview
+PENDING_BUILDS = 4
+
+# Preview pyramids of the FITS files, built once (first preview or sync) and kept in the previews folder
+# next to the database.
+# A pyramid has the levels of the image averaged over blocks of 2x2, 4x4, 8x8... pixels, down to the level
+# that fits a tile. Each level is a .npy file of TILE_SIZE x TILE_SIZE uint16 tiles (rows, columns, tile rows,
+# tile columns): the pixel values are mapped to uint16 from the min/max of the image (offset, scale).
+# The display limits of the image (previewStretch module) are computed at build and saved with the levels.
+# The levels are read with memmap, so a window reads only the tiles it covers and the FITS file is not read.
+# The folder of a pyramid is named from the path, size and mtime of the file: a modified file gets a new
+# pyramid, the old one is evicted with the least recently used ones when the cache is over PREVIEW_CACHE_MB.
+# A pyramid is written to a temporary folder and renamed, so threads and sync workers can build the same file.
+class PreviewPyramid:
+    def __init__(self, path, info):
+        self.path = path
+        self.width = info["width"]
+        self.height = info["height"]
+        self.offset = info["offset"]
+        self.scale = info["scale"]
+        self.factors = info["factors"]
+        self.limits = tuple(info["stretch"]) if "stretch" in info else None
+        self.levels = {}
+
+    # The pyramid of a file if it's in the cache, None otherwise
+    @classmethod
+    def open(cls, fits_path, cacheDir=None):
+        path = pyramid_path(fits_path, cacheDir)
+        if path is None:
+            return None
+        try:
+            with open(os.path.join(path, "pyramid.json"), "r") as file:
+                info = json.load(file)
+            # The access time of the eviction
+            os.utime(os.path.join(path, "pyramid.json"))
+        except (OSError, ValueError):
+            return None
+        return cls(path, info)
+
+    # The level of the stride of a preview: the nearest block size, 1 is the FITS file itself
+    def level_factor(self, stride):
+        factor = 1
+        for levelFactor in self.factors:
+            if levelFactor <= stride * np.sqrt(2):
+                factor = levelFactor
+        return factor
+
+    # The pixels of a level in a window (x_start, y_start, x_end, y_end) of the image, None for the whole
+    # image. Returns (image, (x, y) of the first pixel in the image), one pixel covers factor image pixels
+    def read(self, factor, window=None):
+        tiles = self.levels.get(factor)
+        if tiles is None:
+            tiles = self.levels[factor] = np.load(os.path.join(self.path, f"level_{factor}.npy"), mmap_mode='r')
+        height, width = -(-self.height // factor), -(-self.width // factor)
+
+        x_start, y_start, x_end, y_end = window if window is not None else (0, 0, self.width, self.height)
+        x_start, y_start = max(x_start // factor, 0), max(y_start // factor, 0)
+        x_end, y_end = min(-(-x_end // factor), width), min(-(-y_end // factor), height)
+
+        row_start, row_end = y_start // TILE_SIZE, -(-y_end // TILE_SIZE)
+        col_start, col_end = x_start // TILE_SIZE, -(-x_end // TILE_SIZE)
+        block = np.asarray(tiles[row_start:row_end, col_start:col_end]).transpose(0, 2, 1, 3)
+        block = block.reshape((row_end - row_start) * TILE_SIZE, (col_end - col_start) * TILE_SIZE)
+        block = block[y_start - row_start * TILE_SIZE:y_end - row_start * TILE_SIZE,
+                      x_start - col_start * TILE_SIZE:x_end - col_start * TILE_SIZE]
+
+        return block.astype(np.float32) * np.float32(self.scale) + np.float32(self.offset), (x_start * factor, y_start * factor)
+
+# The previews folder next to the database
+def cache_dir():
+    return str(importlib_resources.files("astrodom").joinpath('rsc', 'previews'))
+
+# Maximum size of the cache in bytes, 0 means no pyramids
+def cache_bytes():
+    return int(PREVIEW_CACHE_MB) * 1024 * 1024
+
+# Folder of the pyramid of a file, None if the file doesn't exist
+def pyramid_path(fits_path, cacheDir=None):
+    try:
+        file_stat = os.stat(fits_path)
+    except OSError:
+        return None
+    key = f"{os.path.abspath(fits_path)}|{file_stat.st_size}|{file_stat.st_mtime_ns}"
+    return os.path.join(cacheDir or cache_dir(), hashlib.sha1(key.encode()).hexdigest())
+
+# Average of the 2x2 blocks of an image, the last row and column are repeated for odd sizes
+def block_average(image):
+    height, width = image.shape
+    if height % 2 or width % 2:
+        image = np.pad(image, ((0, height % 2), (0, width % 2)), mode='edge')
+    return image.reshape(image.shape[0] // 2, 2, image.shape[1] // 2, 2).mean(axis=(1, 3), dtype=np.float32)
+
+# Split a level into tiles, the pixels out of the level are 0
+def to_tiles(level):
+    height, width = level.shape
+    rows, cols = -(-height // TILE_SIZE), -(-width // TILE_SIZE)
+    tiles = np.zeros((rows * TILE_SIZE, cols * TILE_SIZE), dtype=np.uint16)
+    tiles[:height, :width] = level
+    return np.ascontiguousarray(tiles.reshape(rows, TILE_SIZE, cols, TILE_SIZE).transpose(0, 2, 1, 3))
+
+# Build the pyramid of a file (if it's not in the cache) and return it, None if the cache is disabled
+def build_pyramid(fits_path, cacheDir=None):
+    if cache_bytes() <= 0:
+        return None
+    pyramid = PreviewPyramid.open(fits_path, cacheDir)
+    if pyramid is not None:
+        return pyramid
+
+    path = pyramid_path(fits_path, cacheDir)
+    data, header = image_data(fits_path)
+    image = scale_image(np.array(data), header.get('BSCALE', 1), header.get('BZERO', 0)).astype(np.float32, copy=False)
+    height, width = image.shape
+
+    # uint16 levels: the full range of the image is mapped to 0-65535, NaN pixels are 0
+    offset, top = float(np.nanmin(image)), float(np.nanmax(image))
+    scale = (top - offset) / 65535 if top > offset else 1.0
+    if not np.isfinite(offset):
+        offset, scale = 0.0, 1.0
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=os.path.dirname(path), prefix=".build_")
+    try:
+        factors = []
+        level, factor = image, 1
+        while max(level.shape) > TILE_SIZE:
+            level, factor = block_average(level), factor * 2
+            quantized = np.rint(np.nan_to_num((level - offset) / scale, nan=0.0))
+            np.save(os.path.join(tmp_path, f"level_{factor}.npy"), to_tiles(np.clip(quantized, 0, 65535)))
+            factors.append(factor)
+
+        info = {"file": fits_path, "width": width, "height": height, "offset": offset, "scale": scale, "factors": factors,
+                "stretch": zscale_limits(image)}
+        with open(os.path.join(tmp_path, "pyramid.json"), "w") as file:
+            json.dump(info, file)
+        os.rename(tmp_path, path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        # Built by another thread or process in the meantime
+        pyramid = PreviewPyramid.open(fits_path, cacheDir)
+        if pyramid is None:
+            raise
+        return pyramid
+
+    logging.debug(f"Preview pyramid of {fits_path}: levels {factors}")
+    return PreviewPyramid(path, info)
+
+# Remove the least recently used pyramids until the cache is below maxBytes
+def evict_cache(cacheDir=None, maxBytes=None):
+    cacheDir = cacheDir or cache_dir()
+    maxBytes = cache_bytes() if maxBytes is None else maxBytes
+    entries = []
+    total = 0
+    try:
+        folders = [entry for entry in os.scandir(cacheDir) if entry.is_dir() and not entry.name.startswith(".")]
+    except OSError:
+        return
+    for folder in folders:
+        try:
+            size = sum(entry.stat().st_size for entry in os.scandir(folder.path))
+            accessed = os.stat(os.path.join(folder.path, "pyramid.json")).st_mtime
+        except OSError:
+            continue
+        entries.append((accessed, size, folder.path))
+        total += size
+
+    for accessed, size, path in sorted(entries):
+        if total <= maxBytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+# The pyramid of a file, built on first use. None if the cache is disabled or the pyramid can't be built
+# With build False (GUI thread) the pyramid is only opened: a missing one is built in the background
+# (build_later) and None is returned, the caller reads the FITS file instead
+def get_pyramid(fits_path, cacheDir=None, build=True):
+    pyramid = PreviewPyramid.open(fits_path, cacheDir)
+    if pyramid is not None or cache_bytes() <= 0:
+        return pyramid
+    if not build:
+        build_later(fits_path, cacheDir)
+        return None
+    try:
+        pyramid = build_pyramid(fits_path, cacheDir)
+    except Exception as e:
+        logging.error(f"Cannot build the preview pyramid of {fits_path}: {e}")
+        return None
+    evict_cache(cacheDir)
+    return pyramid
+
+# Background builds of the pyramids missing on a preview of the GUI thread: one thread, at most
+# PENDING_BUILDS files queued so that quitting doesn't wait for a long queue
+_builder = None
+_building = set()
+_buildingLock = threading.Lock()
+
+def build_later(fits_path, cacheDir=None):
+    global _builder
+    with _buildingLock:
+        if fits_path in _building or len(_building) >= PENDING_BUILDS:
+            return
+        _building.add(fits_path)
+        if _builder is None:
+            _builder = ThreadPoolExecutor(max_workers=1)
+    _builder.submit(_build, fits_path, cacheDir)
+
+# Run by the background thread
+def _build(fits_path, cacheDir):
+    try:
+        get_pyramid(fits_path, cacheDir)
+    finally:
+        with _buildingLock:
+            _building.discard(fits_path)
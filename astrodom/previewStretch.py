@@ -0,0 +1,116 @@
+import os, threading
+from collections import OrderedDict
+import numpy as np
+
+# Pixels sampled to compute the display limits of an image
+SAMPLE_SIZE = 5000
+# Contrast of the ZScale limits
+CONTRAST = 0.05
+# Softening of the asinh stretch, as astropy AsinhStretch
+ASINH_A = 0.1
+# Files whose limits are kept in memory
+CACHE_FILES = 2000
+# Levels of the lookup table of the stretch
+LUT_LEVELS = 4096
+
+# Stretch of the previews: the display limits are the ZScale limits (as astropy ZScaleInterval) computed on a
+# fixed size sample of the pixels, the pixels between the limits are mapped to 8 bit with an asinh stretch.
+# The limits of a file are a (vmin, vmax, a) tuple: they are computed once and kept by StretchCache, the preview
+# pyramid (previewPyramid module) saves them with the levels so they survive a restart.
+# The same limits are used for the whole preview and its zoomed regions, and the blink dialog can lock the
+# limits of one frame for all the frames.
+
+# Random (but repeatable) sample of the finite pixels of an image
+def sample_pixels(image, nSamples=SAMPLE_SIZE):
+    pixels = np.asarray(image).ravel()
+    if pixels.size > nSamples:
+        pixels = pixels[np.random.default_rng(0).integers(0, pixels.size, nSamples)]
+    return pixels[np.isfinite(pixels)]
+
+# ZScale limits (IRAF zscale as astropy): a line is fitted to the sorted sample rejecting the outliers,
+# the limits are around the median with the slope of the line divided by the contrast
+def zscale_limits(image, contrast=CONTRAST, nSamples=SAMPLE_SIZE, maxReject=0.5, minPixels=5, krej=2.5, maxIterations=5):
+    samples = np.sort(sample_pixels(image, nSamples)).astype(np.float64)
+    npix = samples.size
+    if npix == 0:
+        return (0.0, 1.0, ASINH_A)
+    vmin, vmax = samples[0], samples[-1]
+
+    x = np.arange(npix)
+    minpix = max(minPixels, int(npix * maxReject))
+    ngrow = max(1, int(npix * 0.01))
+    kernel = np.ones(ngrow, dtype=bool)
+    bad = np.zeros(npix, dtype=bool)
+    ngood, last = npix, npix + 1
+    slope = 0.0
+    for _ in range(maxIterations):
+        if ngood >= last or ngood < minpix:
+            break
+        # Least squares line of the good pixels
+        xGood, yGood = x[~bad], samples[~bad]
+        xMean, yMean = xGood.mean(), yGood.mean()
+        slope = np.dot(xGood - xMean, yGood - yMean) / max(np.dot(xGood - xMean, xGood - xMean), 1e-12)
+        intercept = yMean - slope * xMean
+        residuals = samples - (intercept + slope * x)
+        threshold = krej * residuals[~bad].std()
+        # The rejected pixels and their neighbours are excluded from the next fits
+        bad |= np.abs(residuals) > threshold
+        bad = np.convolve(bad, kernel, mode='same')
+        last, ngood = ngood, np.sum(~bad)
+
+    if ngood >= minpix:
+        if contrast > 0:
+            slope /= contrast
+        center = (npix - 1) // 2
+        median = np.median(samples)
+        vmin = max(vmin, median - (center - 1) * slope)
+        vmax = min(vmax, median + (npix - center) * slope)
+    return (float(vmin), float(vmax), ASINH_A)
+
+# 8 bit pixels of an image stretched between the limits, NaN pixels are black
+def stretch_pixels(image, limits):
+    vmin, vmax, a = limits
+    lut = (np.clip(np.arcsinh(np.linspace(0, 1, LUT_LEVELS) / a) / np.arcsinh(1 / a), 0, 1) * 255).astype(np.uint8)
+    scaled = (np.asarray(image, dtype=np.float32) - np.float32(vmin)) * np.float32((LUT_LEVELS - 1) / max(vmax - vmin, 1e-12))
+    np.nan_to_num(scaled, copy=False, nan=0.0)
+    np.clip(scaled, 0, LUT_LEVELS - 1, out=scaled)
+    return lut[scaled.astype(np.uint16)]
+
+# Limits of the files read (or loaded from the pyramids), shared by the threads of the previews.
+# Files are identified by path, size and mtime so that a modified file gets new limits
+class StretchCache:
+    limits = OrderedDict()
+    lock = threading.Lock()
+
+    @classmethod
+    def key(cls, fits_path):
+        try:
+            file_stat = os.stat(fits_path)
+        except OSError:
+            return None
+        return (fits_path, file_stat.st_size, file_stat.st_mtime_ns)
+
+    @classmethod
+    def get(cls, key):
+        with cls.lock:
+            limits = cls.limits.get(key)
+            if limits is not None:
+                cls.limits.move_to_end(key)
+            return limits
+
+    @classmethod
+    def put(cls, key, limits):
+        with cls.lock:
+            cls.limits[key] = limits
+            while len(cls.limits) > CACHE_FILES:
+                cls.limits.popitem(last=False)
+
+# Limits of a file: from the cache, from its pyramid or computed on the image read for the preview
+def file_limits(fits_path, image, pyramid=None):
+    key = StretchCache.key(fits_path)
+    limits = StretchCache.get(key) if key is not None else None
+    if limits is None:
+        limits = pyramid.limits if pyramid is not None and pyramid.limits is not None else zscale_limits(image)
+        if key is not None:
+            StretchCache.put(key, limits)
+    return limits
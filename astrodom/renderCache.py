@@ -0,0 +1,59 @@
+import importlib_resources
+from PyQt6.QtGui import QBrush, QColor, QFont, QIcon
+
+# Render cache of the dashboard: the brushes, fonts, colors and icons used by the model (data method of
+# dashboardTreeModel) and by the delegates (viewDelegates module) are created once and shared, instead
+# of building new Qt objects on every data() call or paint.
+# Qt objects can only be created once the application exists, so the cache is filled by the first
+# call of load(), then they are class attributes: RenderCache.filterBrushes, RenderCache.moonIcons...
+
+# Background of the filter names (filter rows and Filter column) and of the frame types (Frame column)
+filterColors = [
+    (["Luminance", "luminance", "Lum", "lum", "L", "l"], (244, 244, 244, 35)),
+    (["Red", "R", "r", "red"], (255, 0, 0, 35)),
+    (["Blue", "B", "b", "blue"], (55, 55, 255, 35)),
+    (["Green", "G", "g", "green"], (0, 140, 55, 35)),
+    (["Ha", "ha", "Halpha", "halpha", "H_alpha", "h_alpha", "H_Alpha", "h_Alpha"], (190, 255, 0, 35)),
+    (["OIII", "Oiii", "oiii", "O3"], (150, 200, 255, 35)),
+    (["SII", "Sii", "sii"], (255, 120, 190, 35)),
+]
+
+frameColors = [
+    (["Light", "LIGHT", "Light Frame"], (120, 120, 244, 55)),
+    (["Dark", "Dark Frame"], (80, 80, 80, 55)),
+    (["Flat", "Flat Frame"], (80, 80, 160, 55)),
+    (["DarkFlat", "Dark Flat"], (80, 80, 80, 55)),
+    (["Bias", "Bias Frame"], (55, 55, 55, 55)),
+]
+
+# Moon icons of the Date column (see DashboardTreeModel.get_moon_phase_icon)
+moonPhaseIcons = ["newmoon.png", "waxinggibbous.png", "firstquarter.png", "waxingcrescent.png",
+                  "fullmoon.png", "waningcrescent.png", "lastquarter.png", "waninggibbous.png"]
+
+class RenderCache:
+    loaded = False
+
+    @classmethod
+    def load(cls):
+        if cls.loaded:
+            return
+
+        cls.filterBrushes = {name: QBrush(QColor(*color)) for names, color in filterColors for name in names}
+        cls.frameBrushes = {name: QBrush(QColor(*color)) for names, color in frameColors for name in names}
+
+        # Target rows are bold italic, filter rows italic
+        cls.targetFont = QFont()
+        cls.targetFont.setBold(True)
+        cls.targetFont.setItalic(True)
+        cls.filterFont = QFont()
+        cls.filterFont.setItalic(True)
+
+        # Text of the values over the thresholds
+        cls.rejectedColor = QColor("red")
+
+        icons = importlib_resources.files("astrodom").joinpath('rsc', 'icons')
+        cls.moonIcons = {name: QIcon(str(icons.joinpath(name))) for name in moonPhaseIcons}
+        # No moon phase
+        cls.moonIcons[""] = QIcon()
+
+        cls.loaded = True
@@ -37,6 +37,23 @@ class SettingsDialog(QDialog):
         # Bias signal
         self.bias_signal_edit = QLineEdit(str(self.settings.get("BIAS_SIGNAL", 0)))
 
+        # Number of processes used to parse the files during sync, 0 means one per CPU
+        self.sync_workers_edit = QLineEdit(str(self.settings.get("SYNC_WORKERS", 0)))
+
+        # Number of files written to the database in a single transaction during sync
+        self.sync_batch_size_edit = QLineEdit(str(self.settings.get("SYNC_BATCH_SIZE", 50)))
+
+        # Disk space of the preview pyramids, 0 disables them
+        self.preview_cache_edit = QLineEdit(str(self.settings.get("PREVIEW_CACHE_MB", 1024)))
+
+        # Build the preview pyramids during sync instead of on the first preview
+        self.preview_sync = QComboBox()
+        self.preview_sync.addItems(["YES", "NO"])
+        self.preview_sync.setCurrentText(self.settings.get("PREVIEW_SYNC", "NO"))
+
+        # Lines kept in the log window, the oldest are removed
+        self.log_max_lines_edit = QLineEdit(str(self.settings.get("LOG_MAX_LINES", 5000)))
+
         # Create a combo box for logging levels
         self.file_log = QComboBox()
         self.file_log.addItems(["YES", "NO"])
@@ -50,10 +67,15 @@ class SettingsDialog(QDialog):
         form_layout.addRow("Database Name:", self.dbname_edit)
         form_layout.addRow("Logging Level:", self.logging_level_edit)
         form_layout.addRow("Enable Log File :", self.file_log)
+        form_layout.addRow("Log Max Lines:", self.log_max_lines_edit)
         form_layout.addRow(separator)
         form_layout.addRow("Date Format:", self.date_format_edit)
         form_layout.addRow(separator)
         form_layout.addRow("BIAS Signal:", self.bias_signal_edit)
+        form_layout.addRow("Sync Workers (0 = auto):", self.sync_workers_edit)
+        form_layout.addRow("Sync Batch Size:", self.sync_batch_size_edit)
+        form_layout.addRow("Preview Cache MB (0 = off):", self.preview_cache_edit)
+        form_layout.addRow("Build Previews on Sync:", self.preview_sync)
 
         form_layout.addRow(separator)
         form_layout.addRow("ALT Threshold Default:", self.alt_limit_edit)
@@ -99,12 +121,17 @@ class SettingsDialog(QDialog):
         self.settings["DBNAME"] = self.dbname_edit.text() + '.db'
         self.settings["LOGGING_LEVEL"] = self.logging_level_edit.currentText()
         self.settings["FILE_LOG"] = self.file_log.currentText()
+        self.settings["LOG_MAX_LINES"] = int(self.log_max_lines_edit.text() or 5000)
         self.settings["DATE_FORMAT"] = self.date_format_edit.currentText()
         self.settings["ALT_LIMIT_DEFAULT"] = float(self.alt_limit_edit.text())
         self.settings["FWHM_LIMIT_DEFAULT"] = float(self.fwhm_limit_edit.text())
         self.settings["ECCENTRICITY_LIMIT_DEFAULT"] = float(self.eccentricity_limit_edit.text())
         self.settings["SNR_LIMIT_DEFAULT"] = float(self.snr_limit_edit.text())
         self.settings["BIAS_SIGNAL"] = float(self.bias_signal_edit.text())
+        self.settings["SYNC_WORKERS"] = int(self.sync_workers_edit.text() or 0)
+        self.settings["SYNC_BATCH_SIZE"] = int(self.sync_batch_size_edit.text() or 50)
+        self.settings["PREVIEW_CACHE_MB"] = int(self.preview_cache_edit.text() or 0)
+        self.settings["PREVIEW_SYNC"] = self.preview_sync.currentText()
         self.settings["ADDITIONAL_COLUMNS"] = [item.text() for item in self.additional_columns_list.selectedItems()]
 
         if not self.dbname_edit.text():
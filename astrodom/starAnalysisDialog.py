@@ -4,25 +4,23 @@ import matplotlib.pyplot as plt
 import astropy.units as u
 
 from matplotlib.colors import LogNorm
-from photutils.detection import DAOStarFinder
-from photutils.psf import fit_2dgaussian, fit_fwhm
 from photutils.aperture import CircularAperture
-from astropy.io import fits
-from astropy.stats import sigma_clipped_stats,gaussian_sigma_to_fwhm
-from astropy.modeling import models, fitting
 from PyQt6.QtWidgets import QApplication, QDialog, QLabel, QVBoxLayout, QGridLayout, QHBoxLayout, QLineEdit, QComboBox, QTableView, QWidget, QPushButton
 from PyQt6.QtGui import QIcon
-from PyQt6.QtCore import QAbstractTableModel, Qt
+from PyQt6.QtCore import QAbstractTableModel, Qt, QThread, pyqtSignal
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT, FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
-from astropy.table import QTable
 from pandas import DataFrame
 from PyQt6.QtWidgets import QSpacerItem, QSizePolicy, QGroupBox, QStyle
 
 from astrodom.loadSettings import *  
+from astrodom.starMeasurement import load_image, measure_image, summarize
 import os
 import sqlite3
 
+# Columns of the stars table
+starColumns = ['id', 'xcentroid', 'ycentroid', 'sharpness', 'roundness2', 'peak', 'peak_median_ratio', 'fwhm']
+
 # Stars data are displayed in a QTableView
 class QTableModel(QAbstractTableModel):
     def __init__(self, data):
@@ -48,6 +46,46 @@ class QTableModel(QAbstractTableModel):
                 return str(self._data.index[section])
         return None
     
+# Star measurement of the dialog, run in a thread so that the dialog is not frozen by the star detection and fits.
+# The signals are received in the GUI thread: imageLoaded with the cropped image, starsMeasured with the selected
+# stars when they are detected and again after every chunk of fitted stars (see measure_image in the
+# starMeasurement module), measureCompleted with the stars, the summary and the log messages at the end.
+# The stop method cancels the measurement between two steps, a stopped thread doesn't emit measureCompleted.
+# A step already started (eg the star detection) runs to its end: the dialog keeps the stopped threads until
+# they finish and waits for them when it is closed.
+class StarMeasureThread(QThread):
+    imageLoaded = pyqtSignal(object)
+    starsMeasured = pyqtSignal(object)
+    measureCompleted = pyqtSignal(object, object, list)
+
+    def __init__(self, fits_path, measureParams, parent=None):
+        super().__init__(parent)
+        self.fits_path = fits_path
+        self.measureParams = measureParams
+        self.runs = True
+
+    def run(self):
+        log = []
+        stars, data_stars = None, None
+        try:
+            image_data = load_image(self.fits_path, self.measureParams["cropFactor"])
+            if not self.runs:
+                return
+            self.imageLoaded.emit(image_data)
+            stars, stats = measure_image(image_data, self.measureParams, log, progress=self.starsMeasured.emit, stop=self.stopped)
+            if not self.runs:
+                return
+            data_stars = summarize(stars, stats, log)
+        except Exception as e:
+            log.append((f"Error measuring stars: {e}", "error"))
+        self.measureCompleted.emit(stars, data_stars, log)
+
+    def stop(self):
+        self.runs = False
+
+    def stopped(self):
+        return not self.runs
+
 class StarAnalysisDialog(QDialog):
     def __init__(self, parent = None, fits_path = None):
         super().__init__(parent)
@@ -64,6 +102,13 @@ class StarAnalysisDialog(QDialog):
         self.bin = 1 # binning factor
         self.radius = 7 # radius of the aperture for the star measurement
         self.saturationLimit = 95 # saturation limit in percent of the peak value
+        # Thread of the last measurement, the previous ones are stopped and kept until they finish
+        self.worker = None
+        self.stoppedWorkers = []
+        self.sources = None
+        self.data_stars = None
+        # Apertures and labels of the fitted stars drawn over the image
+        self.overlay = []
 
         # Crop the image by cropFactor of its width and height (faster processing)
         try:
@@ -172,6 +217,7 @@ class StarAnalysisDialog(QDialog):
 
         # Add QTableView to the left side
         self.starTableView = QTableView(self)
+        self.starTableView.clicked.connect(self.on_table_row_clicked)
         bottom_layout.addWidget(self.starTableView, 1)
 
         # Add two matplotlib canvases to the right side
@@ -196,7 +242,7 @@ class StarAnalysisDialog(QDialog):
         self.setLayout(main_layout)
 
     # When the "Analyze Image" button is clicked, read the star detection parameters
-    # and call the measure_stars method
+    # and start the measurement thread. A measurement still running is cancelled
     def on_apply_clicked(self):
         
         self.cropFactor = int(self.cropFactorComboBox.currentText())
@@ -208,6 +254,10 @@ class StarAnalysisDialog(QDialog):
         self.saturationLimit = int(self.saturationLimitComboBox.currentText())
 
         # Clear the star table view and both figure canvases
+        self.sources = None
+        self.data_stars = None
+        self.overlay = []
+        self.saveButton.setEnabled(False)
         self.starTableView.setModel(None)
         self.imageCanvas.figure.clear()
         self.starCanvas.figure.clear()
@@ -215,16 +265,16 @@ class StarAnalysisDialog(QDialog):
         self.imageCanvas.draw()
         self.starCanvas.draw()
 
-        self.data_stars = self.measure_stars(self.fits_path)
-        logging.info(self.data_stars)
-
-        df = DataFrame(np.array(self.sources))
-        df = df[['id', 'xcentroid', 'ycentroid', 'sharpness', 'roundness2', 'peak', 'peak_median_ratio']].round(2)
-        
-        model = QTableModel(df)
-        
-        self.starTableView.setModel(model)
-        self.starTableView.clicked.connect(self.on_table_row_clicked)
+        if self.worker is not None:
+            self.worker.stop()
+            self.stoppedWorkers.append(self.worker)
+        self.worker = StarMeasureThread(self.fits_path, self.measure_params(), self)
+        self.worker.imageLoaded.connect(self.on_image_loaded)
+        self.worker.starsMeasured.connect(self.on_stars_measured)
+        self.worker.measureCompleted.connect(self.on_measure_completed)
+        self.worker.finished.connect(self.on_worker_finished)
+        self.worker.finished.connect(self.worker.deleteLater)
+        self.worker.start()
 
     # Get the row index when a row in the table is clicked
     # and call the plot_star method
@@ -260,150 +310,94 @@ class StarAnalysisDialog(QDialog):
         ax2.set_title(f'Star at ({x:.2f}, {y:.2f})')
         self.starCanvas.draw()
     
-    # The main function that selects and measures the relevant value of stars in the FITS file
-    def measure_stars(self,fits_file):
-    
-        fwhmfit = []
-
-        # Load the FITS file
-        hdu_list = fits.open(fits_file)
-        self.image_data = hdu_list[0].data
-        hdu_list.close()
-
-        # Crop the image by cropFactor of its width and height (faster processing)
-        height, width = self.image_data.shape
-        crop_height = height // self.cropFactor
-        crop_width = width // self.cropFactor
-        start_y = (height - crop_height) // 2
-        start_x = (width - crop_width) // 2
-        self.image_data = self.image_data[start_y:start_y + crop_height, start_x:start_x + crop_width]
-
-        # Calculate basic statistics
-        mean, median, std = sigma_clipped_stats(self.image_data, sigma = 3.0)
-        if std == 0:
-            logging.error("Standard deviation is zero, invalid operation encountered.")
-            return
-        logging.info(f"Mean: {mean:.2f}, Median: {median:.2f}, Std: {std:.2f}")
-        
-        # Detect stars using photutils.DAOStarFinder
-        try:
-            daofind = DAOStarFinder(fwhm = 3.0, threshold = self.threshold*std)
-            sources = daofind(self.image_data - median)
-            logging.info(f"Number of stars detected by DAO: {len(sources)}")
-        except Exception as e:
-            logging.error(f"Error detecting stars: {e}")
+    def measure_params(self):
+        return {
+            "nStars": self.nStars,
+            "cropFactor": self.cropFactor,
+            "threshold": self.threshold,
+            "bit": self.bit,
+            "bin": self.bin,
+            "radius": self.radius,
+            "saturationLimit": self.saturationLimit,
+        }
+
+    # The measurement is done by the starMeasurement module (the same used by the sync) in a StarMeasureThread,
+    # the slots below show its results as they arrive. The signals of a cancelled thread are ignored.
+
+    # Plot the image on self.imageCanvas, the detected stars are drawn over it when they are fitted
+    def on_image_loaded(self, image_data):
+        if self.sender() is not self.worker:
             return
-
-        # Cutting saturated stars and roundness < 0.5
-        sources = sources[(sources['peak'] < (2**self.bit)*self.saturationLimit/100)] 
-        sources = sources[(np.abs(sources['roundness2']) < 0.5)] 
-        logging.info(f"Number of non clipped stars (< {self.saturationLimit}% peak): {len(sources)}")
-        
-        # Order the stars by peak/median ratio so by how much they are above the background
-        sources['peak_median_ratio'] = sources['peak'] / median
-        sources.sort('peak_median_ratio', reverse=True)
-        logging.info(f"Number of non clipped  stars above background*10: {len(sources)}")
-
-        if len(sources) == 0:
-            logging.error("No stars detected")
-            return  
-        
-        # Reduce the number of stars (faster processing)
-        if len(sources) > self.nStars:
-            sources = sources[:self.nStars]
-        self.sources = sources
-
-        # Calculate and print the average peak value
-        average_peak = np.mean(sources['peak'])
-        logging.info(f"Average Peak: {average_peak:.2f}")
-
-        logging.info(f"Mean: {mean:.2f}, Median: {median:.2f}, Std: {std:.2f}")
-        logging.info(f"Number of sources detected: {len(sources)}")
-        results_table = QTable(names=('xcentroid', 'ycentroid', 'peak', 'fwhm', 'roundness', 'peak_median_ratio'), dtype=('f4', 'f4', 'f4', 'f4', 'f4', 'f4'))
-        # Iterate over the detected stars
-        for source in sources:
-            x = source['xcentroid']
-            y = source['ycentroid']
-            try:
-                #this condition is to avoid stars too close to the edge
-                if (x > self.radius and x < (width - self.radius) and y > self.radius and y < (height - self.radius)):
-                    # Assuming you have the star's image data in `data` and the aperture in `aperture`
-                    # A cutout of the star is a square region around the star
-                    logging.debug(f"Cutout centered on the star at position: {x,y} ")
-
-                    starCutOut = self.image_data[int(y-self.radius):int(y+self.radius), int(x-self.radius):int(x+self.radius)]
-                    try:
-                        starCutOutMean, starCutOutMedian, starCutOutStd = sigma_clipped_stats(starCutOut, sigma = 3.0)
-                    except Exception as e:  
-                        logging.warning(f"Error calculating cutout stats: {e}")
-                        continue    
-                    
-                    logging.debug(f"Star Cutout Mean: {starCutOutMean:.2f}, Star Cutout Median: {starCutOutMedian:.2f}, Star Cutout Std: {starCutOutStd:.2f}")
-                    
-                    # A larger cutout is a square region around the same star, but larger
-                    largerCutOut = self.image_data[int(y-10*self.radius):int(y+10*self.radius), int(x-10*self.radius):int(x+10*self.radius)]
-                    try:
-                        largerCutOutMean, largerCutOutMedian, largerCutOutStd = sigma_clipped_stats(largerCutOut, sigma = 3.0)
-                    except Exception as e:
-                        logging.warning(f"Error calculating larger cutout stats: {e}")
-                        continue    
-                
-                    logging.debug(f"Larger Cutout Mean: {largerCutOutMean:.2f}, Larger Cutout Median: {largerCutOutMedian:.2f}, Larger Cutout Std: {largerCutOutStd:.2f}")
-
-                    # If the median value of the larger region around the star is not above
-                    # (twice) the background of the image, we have a representative region that
-                    # is not affected by other sources like a nebula or a galaxy.
-                    if largerCutOutMedian < 2 * median:
-
-                        # Use photutils to fit the star with a 2D Gaussian
-                        fwhml = fit_fwhm(starCutOut - median, fit_shape=(7, 7))
-                        fwhmfit.append( fwhml)
-
-                        results_table.add_row((source['xcentroid'], source['ycentroid'], source['peak'], fwhml, source['roundness2'], source['peak_median_ratio']))
-                        #print(f"Star at position x: {x}, y: {y} has a FWHM of {fwhml:.2f} and a peak of {float(source['peak']):.2f}")
-
-                    else:
-                        logging.warning(f"Star rejected because of high background, probably a star in a nebula or galaxy : {largerCutOutMedian}, vs : {median} ")
-                else:
-                    logging.warning(f"Star at position x: {x}, y: {y} is too close to the edge")
-            except Exception as e:
-                logging.warning(f"Error fitting 2D Gaussian at position x: {x}, y: {y}")
-                logging.warning(f"Cutout values: {starCutOut}")
-                logging.warning(f"Exception: {e}")
-
-
-        
-        # Plot the image with detected stars on self.imageCanvas
+        self.image_data = image_data
         self.imageCanvas.figure.clear()
         self.ax1 = self.imageCanvas.figure.add_subplot(111)
         self.ax1.imshow(self.image_data, cmap='Greys', origin='lower', norm=LogNorm(), interpolation='nearest')
         self.ax1.set_title('Detected Stars')
+        self.overlay = []
+        self.imageCanvas.draw()
 
-        cpositions = np.transpose((results_table['xcentroid'], results_table['ycentroid']))
-        apertures = CircularAperture(cpositions, r = 7)
-        apertures.plot(color='red', lw=2.5, alpha=0.5, ax=self.ax1)
+    # The table lists the selected stars, the FWHM is filled as they are fitted
+    def on_stars_measured(self, stars):
+        if self.sender() is not self.worker:
+            return
+        self.sources = stars
+        df = DataFrame(stars)[starColumns].round(2)
+        self.starTableView.setModel(QTableModel(df))
+        self.plot_stars(stars)
+
+    # Draw the apertures, FWHM and peak of the fitted stars, replacing the previous ones
+    def plot_stars(self, stars):
+        for artist in self.overlay:
+            artist.remove()
+        self.overlay = []
+
+        fitted = stars[np.isfinite(stars['fwhm'])]
+        cpositions = np.transpose((fitted['xcentroid'], fitted['ycentroid']))
+        if len(cpositions) > 0:
+            apertures = CircularAperture(cpositions, r = 7)
+            self.overlay.extend(apertures.plot(color='red', lw=2.5, alpha=0.5, ax=self.ax1))
         
         for i, cposition in enumerate(cpositions):
-            self.ax1.text(cposition[0], cposition[1], f'{results_table["fwhm"][i]:.2f}', color='red', fontsize=9, ha='right', va='top')
-            self.ax1.text(cposition[0], cposition[1], f'{results_table["peak"][i]:.2f}', color='blue', fontsize=9, ha='left', va='bottom')
+            self.overlay.append(self.ax1.text(cposition[0], cposition[1], f'{fitted["fwhm"][i]:.2f}', color='red', fontsize=9, ha='right', va='top'))
+            self.overlay.append(self.ax1.text(cposition[0], cposition[1], f'{fitted["peak"][i]:.2f}', color='blue', fontsize=9, ha='left', va='bottom'))
  
-        self.imageCanvas.draw()
-        
-        # FWHM average
-        average_fwhm = np.mean(fwhmfit)
-        logging.info(f"Average FWHM: {average_fwhm:.2f}")
+        self.imageCanvas.draw_idle()
 
-        # Eccentricity in DAOStarFinder is the ratio of the minor and major axes of the star
-        roundness2_avg = np.mean(abs(results_table['roundness']))
-        logging.info(f"Average Roundness: {roundness2_avg:.2f}")
+    def on_measure_completed(self, stars, data_stars, log):
+        if self.sender() is not self.worker:
+            return
+        for message, logType in log:
+            getattr(logging, logType)(message)
 
-        if average_fwhm and roundness2_avg:
+        self.data_stars = data_stars
+        logging.info(self.data_stars)
+        if data_stars is not None:
+            average_fwhm, roundness2_avg, mean, median, std = data_stars
             self.averageFwhmLabel.setText(f"<b>Average FWHM: {average_fwhm:.2f}</b>")
             self.averageRoundnessLabel.setText(f"<b>Average Roundness: {roundness2_avg:.2f}</b>")
             self.SNRLabel.setText(f"<b>SNR: {((median - BIAS_SIGNAL) / std):.2f}</b>")
             self.saveButton.setEnabled(True)
 
-        return np.array([ round(average_fwhm, 2), round(roundness2_avg, 2), round(mean, 2), round(median, 2), round(std, 2)])
+    # The thread is deleted when it finishes (deleteLater), its reference is dropped here
+    def on_worker_finished(self):
+        worker = self.sender()
+        if worker is self.worker:
+            self.worker = None
+        elif worker in self.stoppedWorkers:
+            self.stoppedWorkers.remove(worker)
+
+    # Cancel the running measurements and wait for them: a QThread can't be destroyed while it runs
+    def stop_measurements(self):
+        workers = self.stoppedWorkers + ([self.worker] if self.worker is not None else [])
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            worker.wait()
+
+    # Called when the dialog is closed (closeEvent rejects the dialog), a measurement still running is cancelled
+    def done(self, result):
+        self.stop_measurements()
+        super().done(result)
 
     def save_to_db(self):
         # Connect to the database
@@ -0,0 +1,218 @@
+import numpy as np
+from photutils.detection import DAOStarFinder
+from photutils.psf import fit_fwhm
+from astropy.io import fits
+from astropy.stats import sigma_clipped_stats
+
+# Star measurement parameters used when the Star Analysis widget is not available
+defaultMeasureParams = {
+    "nStars": 30,
+    "cropFactor": 2,
+    "threshold": 20,
+    "bit": 16,
+    "bin": 1,
+    "radius": 7,
+    "saturationLimit": 95,
+}
+
+# Stars fitted between two progress callbacks of measure_image
+FIT_CHUNK = 5
+
+# Measured stars are returned in a structured array with a row per selected star (brightest first).
+# fwhm is NaN for the stars that were not fitted (too close to the edge or on a bright background)
+starDtype = [('id', 'i4'), ('xcentroid', 'f4'), ('ycentroid', 'f4'), ('sharpness', 'f4'), ('roundness2', 'f4'),
+             ('peak', 'f4'), ('peak_median_ratio', 'f4'), ('fwhm', 'f4')]
+
+# Star measurement shared by the sync workers and the Star Analysis dialog. It doesn't depend on Qt,
+# log messages are collected as (message, logType) tuples in the log list like in the syncWorker module.
+# Stars are detected with DAOStarFinder, the local background and the fit starting position of all the
+# stars are computed at once on stacks of cutouts and all the stars are fitted with a single fit_fwhm call.
+# measure_stars is the sync entry point: it returns the [fwhm, eccentricity, mean, median, std] array
+# saved to the database or None if no star could be measured.
+# The Star Analysis dialog runs measure_image in a thread with a progress callback, called with a copy of the
+# stars when they are selected and after every FIT_CHUNK fitted stars, and a stop callback checked between
+# the steps: when it returns True the measurement is cancelled and no stars are returned.
+
+def get_measure_params(measureParams=None):
+    params = dict(defaultMeasureParams)
+    if measureParams:
+        params.update({key: value for key, value in measureParams.items() if value})
+    return params
+
+# Load the FITS image cropped by cropFactor of its width and height (faster processing)
+# Only the central window is read from the file (memmap and section access) and the file is closed
+# when the function returns. The data keeps the native integer type (scale_image)
+def load_image(fits_file, cropFactor):
+    with fits.open(fits_file, memmap=True, do_not_scale_image_data=True) as hdu_list:
+        hdu = hdu_list[0]
+        height, width = hdu.shape
+        crop_height = height // cropFactor
+        crop_width = width // cropFactor
+        start_y = (height - crop_height) // 2
+        start_x = (width - crop_width) // 2
+        image_data = hdu.section[start_y:start_y + crop_height, start_x:start_x + crop_width]
+        bscale = hdu.header.get('BSCALE', 1)
+        bzero = hdu.header.get('BZERO', 0)
+
+    return scale_image(image_data, bscale, bzero)
+
+# Apply BSCALE/BZERO to data read with do_not_scale_image_data: astropy can't scale a memory
+# mapped section, so the usual unsigned integer convention (BZERO = 2**(bits-1)) is applied here
+# and only the other BSCALE/BZERO values are converted to float
+def scale_image(image_data, bscale, bzero):
+    if bscale == 1 and bzero == 0:
+        return image_data
+    if bscale == 1 and image_data.dtype.kind == 'i' and bzero == 2**(image_data.dtype.itemsize*8 - 1):
+        unsigned = image_data.dtype.newbyteorder('=').str.replace('i', 'u')
+        return image_data.astype(unsigned) ^ np.array(bzero, dtype=unsigned)
+    return image_data * np.float32(bscale) + np.float32(bzero)
+
+# Stack the size x size cutouts centered on the stars, the pixels outside the image are NaN.
+# The cutout of a star starts at int(x - size/2), int(y - size/2) as the slices of the old per star code
+def stack_cutouts(image_data, x, y, size, dtype=np.float32):
+    height, width = image_data.shape
+    half = size // 2
+    cutouts = np.full((len(x), size, size), np.nan, dtype=dtype)
+    x0 = np.floor(x).astype(int) - half
+    y0 = np.floor(y).astype(int) - half
+    for i in range(len(x)):
+        top, left = max(y0[i], 0), max(x0[i], 0)
+        bottom, right = min(y0[i] + size, height), min(x0[i] + size, width)
+        if top < bottom and left < right:
+            cutouts[i, top - y0[i]:bottom - y0[i], left - x0[i]:right - x0[i]] = image_data[top:bottom, left:right]
+    return cutouts
+
+# Detect, select and fit the stars of an image. Returns (stars, (mean, median, std)),
+# stars is None if the stars can't be detected
+def measure_image(image_data, measureParams=None, log=None, progress=None, stop=None):
+    if log is None:
+        log = []
+    params = get_measure_params(measureParams)
+    for key, value in params.items():
+        log.append((f"{key}: {value}", "debug"))
+    radius = params["radius"]
+
+    # Calculate basic statistics
+    mean, median, std = sigma_clipped_stats(image_data, sigma = 3.0)
+    if std == 0:
+        log.append(("Standard deviation is zero, invalid operation encountered.","error"))
+        return None, (mean, median, std)
+    log.append((f"Mean: {mean:.2f}, Median: {median:.2f}, Std: {std:.2f}", "info"))
+    if stop is not None and stop():
+        return None, (mean, median, std)
+
+    data = image_data - median
+
+    # Detect stars
+    try:
+        daofind = DAOStarFinder(fwhm = 3.0, threshold = params["threshold"]*std)
+        sources = daofind(data)
+    except Exception as e:
+        log.append((f"Error detecting stars: {e}","error"))
+        return None, (mean, median, std)
+    if sources is None or len(sources) == 0:
+        log.append(("No stars detected, cannot calc Fwhm, eccentricity and snr", "error"))
+        return None, (mean, median, std)
+    log.append((f"Number of stars detected by DAO: {len(sources)}","debug"))
+
+    # Cutting saturated stars and roundness < 0.5
+    peak = np.asarray(sources['peak'])
+    roundness2 = np.asarray(sources['roundness2'])
+    keep = (peak < (2**params["bit"])*params["saturationLimit"]/100) & (np.abs(roundness2) < 0.5)
+    log.append((f"Number of non clipped stars (less than {params['saturationLimit']} perc peak): {np.count_nonzero(keep)}","debug"))
+
+    # Order the stars by peak/median ratio so by how much they are above the background
+    # and reduce the number of stars (faster processing)
+    selected = np.flatnonzero(keep)
+    selected = selected[np.argsort(-(peak[selected] / median), kind='stable')][:params["nStars"]]
+    if len(selected) == 0:
+        log.append(("No stars detected, cannot calc Fwhm, eccentricity and snr", "error"))
+        return None, (mean, median, std)
+
+    stars = np.zeros(len(selected), dtype=starDtype)
+    for field in ('id', 'xcentroid', 'ycentroid', 'sharpness', 'roundness2', 'peak'):
+        stars[field] = np.asarray(sources[field])[selected]
+    stars['peak_median_ratio'] = stars['peak'] / median
+    stars['fwhm'] = np.nan
+    log.append((f"Number of stars detected: {len(stars)}","info"))
+    log.append((f"Average Peak: {np.mean(stars['peak']):.2f}","debug"))
+
+    if stop is not None and stop():
+        return None, (mean, median, std)
+    if progress is not None:
+        progress(stars.copy())
+
+    # Stars too close to the edge are skipped
+    height, width = image_data.shape
+    x, y = stars['xcentroid'], stars['ycentroid']
+    inside = (x > radius) & (x < width - radius) & (y > radius) & (y < height - radius)
+    if not np.all(inside):
+        log.append((f"Skipping {np.count_nonzero(~inside)} stars too close to the edge","warning"))
+
+    # If the median value of the larger region around the star is not above
+    # (twice) the background of the image, we have a representative region that
+    # is not affected by other sources like a nebula or a galaxy.
+    # The background of all the stars is computed at once on the stack of the larger cutouts
+    largerCutOuts = stack_cutouts(image_data, x[inside], y[inside], 20*radius)
+    _, largerCutOutMedians, _ = sigma_clipped_stats(largerCutOuts, mask=np.isnan(largerCutOuts), sigma = 3.0, axis=(1, 2))
+    fit = np.flatnonzero(inside)[largerCutOutMedians < 2 * median]
+    if len(fit) < np.count_nonzero(inside):
+        log.append((f"Rejected {np.count_nonzero(inside) - len(fit)} stars because of high background, probably stars in a nebula or galaxy", "warning"))
+
+    # The stars used to be fitted one by one on their 2*radius cutout, the fit starting at the center of mass
+    # of the cutout. The same starting positions are computed at once on the stack of the cutouts so that
+    # the fit on the whole image uses the same pixels and gives the same FWHM
+    starCutOuts = stack_cutouts(data, x[fit], y[fit], 2*radius, dtype=np.float64)
+    totals = np.sum(starCutOuts, axis=(1, 2))
+    indices = np.arange(2*radius)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xcom = np.sum(starCutOuts * indices[None, None, :], axis=(1, 2)) / totals
+        ycom = np.sum(starCutOuts * indices[None, :, None], axis=(1, 2)) / totals
+    xypos = np.column_stack((np.floor(x[fit]) - radius + xcom, np.floor(y[fit]) - radius + ycom))
+    centered = np.all(np.isfinite(xypos), axis=1)
+    if not np.all(centered):
+        log.append((f"Skipping {np.count_nonzero(~centered)} stars with a null cutout", "warning"))
+    fit, xypos = fit[centered], xypos[centered]
+
+    # Use photutils to fit all the stars with a 2D Gaussian in a single call, or in chunks to report the progress
+    chunk = FIT_CHUNK if progress is not None else max(len(fit), 1)
+    for start in range(0, len(fit), chunk):
+        if stop is not None and stop():
+            return None, (mean, median, std)
+        stars_fit = fit[start:start + chunk]
+        try:
+            stars['fwhm'][stars_fit] = fit_fwhm(data, xypos=xypos[start:start + chunk], fit_shape=(7, 7))
+        except Exception as e:
+            log.append((f"Error fitting 2D Gaussian: {e}", "warning"))
+        if progress is not None:
+            progress(stars.copy())
+
+    return stars, (mean, median, std)
+
+# Average FWHM and roundness of the fitted stars plus the image statistics, rounded as saved to the database
+def summarize(stars, stats, log=None):
+    if log is None:
+        log = []
+    fitted = stars[np.isfinite(stars['fwhm'])] if stars is not None else []
+    if len(fitted) == 0:
+        log.append(("No stars measured, cannot calc Fwhm, eccentricity and snr", "error"))
+        return None
+
+    # FWHM average
+    average_fwhm = np.mean(fitted['fwhm'])
+    log.append((f"Average FWHM: {average_fwhm:.2f}", "info"))
+
+    # Eccentricity in DAOStarFinder is the ratio of the minor and major axes of the star
+    roundness2_avg = np.mean(np.abs(fitted['roundness2']))
+    log.append((f"Average Roundness: {roundness2_avg:.2f}", "info"))
+
+    mean, median, std = stats
+    return np.array([round(float(average_fwhm), 2), round(float(roundness2_avg), 2), round(float(mean), 2), round(float(median), 2), round(float(std), 2)])
+
+# Sync entry point: measure the stars of a FITS file
+def measure_stars(fits_file, measureParams=None, log=None):
+    if log is None:
+        log = []
+    image_data = load_image(fits_file, get_measure_params(measureParams)["cropFactor"])
+    stars, stats = measure_image(image_data, measureParams, log)
+    return summarize(stars, stats, log)
@@ -0,0 +1,186 @@
+import sqlite3
+
+# Columns of the images table written by the sync, with the default used when a value is missing
+# in the parsed data. The keys are the AstroDom internal keywords of the syncWorker module.
+imageColumns = [
+    ("OBJECT", "OBJECT", ''),
+    ("DATE_OBS", "DATE-OBS", '1970-01-01T00:00:00'),
+    ("FILTER", "FILTER", ''),
+    ("EXPOSURE", "EXPOSURE", 0),
+    ("CCD_TEMP", "CCD-TEMP", 0.0),
+    ("IMAGETYP", "IMAGETYP", ''),
+    ("XBINNING", "XBINNING", 1),
+    ("OBJECT_RA", "OBJECT-RA", ''),
+    ("OBJECT_DEC", "OBJECT-DEC", ''),
+    ("OBJECT_ALT", "OBJECT-ALT", ''),
+    ("OBJECT_AZ", "OBJECT-AZ", ''),
+    ("GAIN", "GAIN", 0),
+    ("OFFSET", "OFFSET", 0),
+    ("FWHM", "FWHM", 0.0),
+    ("ECCENTRICITY", "ECCENTRICITY", 0.0),
+    ("FILE", "FILE", ''),
+    ("SIZE", "SIZE", 0.0),
+    ("MEAN", "MEAN", 0.0),
+    ("MEDIAN", "MEDIAN", 0.0),
+    ("STD", "STD", 0.0),
+    ("SITELAT", "SITELAT", 0.0),
+    ("SITELONG", "SITELONG", 0.0),
+    ("MOON_PHASE", "MOON_PHASE", 0.0),
+    ("MOON_SEPARATION", "MOON_SEPARATION", 0.0),
+]
+
+# The sync writes the database through this class instead of opening a connection per file.
+# A single connection is kept open for the whole sync (it must be created and used in the sync thread),
+# parsed rows are buffered by add() and written by flush() with executemany in a single transaction
+# every batchSize rows. Stale files are removed with one set based delete (delete_files).
+# Messages are sent to the log callable with the same (message, logType) arguments of threadLogger.
+# Use it as a context manager so that the remaining rows are flushed and the connection closed.
+# The writer also maintains the star_metrics table, a cache of the star measurements keyed by file size,
+# mtime, header hash and measurement parameters hash. It is not cleared by a resync, so that unchanged
+# files are not measured again (see parse_fits_file in the syncWorker module).
+# The files inserted and deleted are collected so that the dashboard can be updated without reloading
+# all the images (pop_changes).
+class SyncDbWriter:
+    def __init__(self, db_path, project_id, batchSize=50, log=None):
+        self.project_id = project_id
+        self.batchSize = max(int(batchSize), 1)
+        self.log = log if log else lambda message, logType: None
+
+        self.rows = []
+        self.metricsRows = []
+        self.nSaved = 0
+        self.insertedFiles = []
+        self.deletedFiles = []
+
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS star_metrics (
+            FILE VARCHAR(255) PRIMARY KEY,
+            PROJECT_ID INTEGER,
+            FILE_SIZE INTEGER,
+            MTIME_NS INTEGER,
+            HEADER_HASH VARCHAR(40),
+            PARAMS_HASH VARCHAR(40),
+            FWHM REAL,
+            ECCENTRICITY REAL,
+            MEAN REAL,
+            MEDIAN REAL,
+            STD REAL
+            )
+            ''')
+        self.conn.commit()
+
+        self.fileIndex = [column for column, _, _ in imageColumns].index("FILE")
+        columns = ", ".join(column for column, _, _ in imageColumns)
+        placeholders = ", ".join("?" for _ in imageColumns)
+        self.insertSql = f"INSERT INTO images ({columns}, PROJECT_ID) VALUES ({placeholders}, ?)"
+        self.insertMetricsSql = "INSERT OR REPLACE INTO star_metrics VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    # Filenames of the project images already in the database
+    def get_files(self):
+        cursor = self.conn.execute("SELECT FILE FROM images WHERE PROJECT_ID = ?", (self.project_id,))
+        return [row[0] for row in cursor.fetchall()]
+
+    # Cached star measurements of the project: file -> (size, mtime, header hash, params hash, metrics)
+    def get_star_metrics(self):
+        cursor = self.conn.execute('''
+            SELECT FILE, FILE_SIZE, MTIME_NS, HEADER_HASH, PARAMS_HASH, FWHM, ECCENTRICITY, MEAN, MEDIAN, STD
+            FROM star_metrics WHERE PROJECT_ID = ?''', (self.project_id,))
+        return {row[0]: (row[1], row[2], row[3], row[4], row[5:]) for row in cursor.fetchall()}
+
+    # Buffer a parsed file, the batch is written when full. Returns the number of rows
+    # written to the database (0 if the row was only buffered)
+    def add(self, fits_data):
+        self.rows.append(tuple(fits_data.get(key, default) for _, key, default in imageColumns) +
+                         (fits_data.get('PROJECT_ID', self.project_id),))
+
+        # New star measurements are cached
+        if 'METRICS_KEY' in fits_data:
+            self.metricsRows.append((fits_data['FILE'], fits_data.get('PROJECT_ID', self.project_id), *fits_data['METRICS_KEY'],
+                                     fits_data['FWHM'], fits_data['ECCENTRICITY'], fits_data['MEAN'], fits_data['MEDIAN'], fits_data['STD']))
+
+        if len(self.rows) >= self.batchSize:
+            return self.flush()
+        return 0
+
+    # Write the buffered rows in a single transaction. If the batch fails (eg a duplicate file)
+    # the rows are inserted one by one so that only the wrong ones are lost and logged
+    def flush(self):
+        if not self.rows:
+            return 0
+
+        rows, self.rows = self.rows, []
+        metricsRows, self.metricsRows = self.metricsRows, []
+        nRows = 0
+        try:
+            with self.conn:
+                self.conn.executemany(self.insertSql, rows)
+                self.conn.executemany(self.insertMetricsSql, metricsRows)
+            nRows = len(rows)
+            self.insertedFiles.extend(row[self.fileIndex] for row in rows)
+        except sqlite3.Error as e:
+            self.log(f"Error: {e} saving a batch of {len(rows)} files, retrying one by one", "warning")
+            for row in rows:
+                try:
+                    with self.conn:
+                        self.conn.execute(self.insertSql, row)
+                    nRows += 1
+                    self.insertedFiles.append(row[self.fileIndex])
+                except sqlite3.Error as e:
+                    self.log(f"Error: {e} for file {row[self.fileIndex]}", "error")
+            try:
+                with self.conn:
+                    self.conn.executemany(self.insertMetricsSql, metricsRows)
+            except sqlite3.Error as e:
+                self.log(f"Error: {e} saving star metrics cache", "error")
+
+        self.nSaved += nRows
+        self.log(f"Saved to db a batch of {nRows} files", "debug")
+        return nRows
+
+    # To be used when a resync is forced: all the project files are removed
+    def delete_project_files(self):
+        self.deletedFiles.extend(self.get_files())
+        with self.conn:
+            self.conn.execute("DELETE FROM images WHERE PROJECT_ID = ?", (self.project_id,))
+        self.log(f"All files for project {self.project_id} deleted from database", "info")
+
+    # Remove a list of files with a single delete joined to a temporary table
+    def delete_files(self, files):
+        if not files:
+            return 0
+
+        with self.conn:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS stale_files (FILE VARCHAR(255) PRIMARY KEY)")
+            self.conn.execute("DELETE FROM stale_files")
+            self.conn.executemany("INSERT OR IGNORE INTO stale_files (FILE) VALUES (?)", ((file,) for file in files))
+            cursor = self.conn.execute("DELETE FROM images WHERE PROJECT_ID = ? AND FILE IN (SELECT FILE FROM stale_files)", (self.project_id,))
+            nRemoved = cursor.rowcount
+            self.conn.execute("DELETE FROM star_metrics WHERE FILE IN (SELECT FILE FROM stale_files)")
+            self.conn.execute("DELETE FROM stale_files")
+
+        self.deletedFiles.extend(files)
+        return nRemoved
+
+    # Files inserted and deleted since the last call (the deleted ones were deleted before the inserted ones
+    # because a file is deleted only before parsing or after the last batch)
+    def pop_changes(self):
+        inserted, self.insertedFiles = self.insertedFiles, []
+        deleted, self.deletedFiles = self.deletedFiles, []
+        return inserted, deleted
+
+    def close(self):
+        if self.conn is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self.conn.close()
+            self.conn = None
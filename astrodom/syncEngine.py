@@ -0,0 +1,236 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from astrodom.syncWorker import parse_fits_file
+from astrodom.syncDbWriter import SyncDbWriter
+from astrodom.folderScanner import FolderScanner
+from astrodom.ephemeris import compute_ephemeris
+from astrodom.previewPyramid import evict_cache
+
+# Sync of a project folder (or of a list of files) to the database without any dependency on Qt.
+# It is run by the SyncImages thread (sync and autosync buttons of the main window) and by the
+# command line (cli module): the caller is notified through plain callbacks:
+# log(message, logType), total(nFiles) when the folder has been scanned, progress(nSaved) after each
+# batch written to the database, fileParsed(file_path, status, timings) for every file
+# (status is parsed, skipped or error, timings the seconds spent by parse_fits_file or None) and
+# filesChanged(inserted, deleted) with the files inserted and deleted in the database since the last call.
+# The run method is the entry point.
+# The syncFolder method is used to read all the fits files starting from the base directory. Sends a list to syncFiles.
+# The folder is read by a FolderScanner (folderScanner module) that lists only the directories changed since
+# the previous sync and returns the added, modified and removed files. Modified files are parsed again.
+# The syncFiles method is called by syncFolder or directly (files_path, eg autosync) to parse the FITS files
+# SyncFiles sends the FITS files to parse_fits_file (syncWorker module) that iterates over the AstroDom internal keywords.
+# With more than one worker (0 means one per CPU) files are parsed in a pool of processes
+# and the results are saved in completion order.
+# Star measurements are cached (star_metrics table): on a resync only the files whose content or measurement parameters
+# changed are measured again, the header values are always refreshed.
+# The bResync bool is used to force re parsing all files (true) or only new ones (false)
+# The database is written through a SyncDbWriter (syncDbWriter module) that keeps one connection for the whole sync
+# and saves the parsed files in batches of batchSize rows: progress is reported after each batch.
+# Based on bResync files can be deleted from db (writer.delete_project_files) and likewise
+# writer.get_files has images already in db so that are skipped when parsing)
+# There are then utility methods:
+# save_result collects the parsed data, process_pending calculates the ALT/AZ and moon ephemeris of the
+# collected files at once (ephemeris module) and sends them to the writer
+# The stop method is used to stop the sync based on self.runs flag, it can be called from another thread
+# With a previewCache folder the workers build the preview pyramids of the parsed files (previewPyramid module),
+# the cache is evicted once at the end of the sync.
+
+class SyncEngine:
+    def __init__(self, project_id, base_dir, db_path, bResync=False, files_path=None, measureParams=None,
+                 nWorkers=0, batchSize=50, log=None, total=None, progress=None, fileParsed=None, filesChanged=None,
+                 previewCache=None):
+
+        self.project_id = project_id
+        self.base_directory = base_dir
+        self.db_path = db_path
+        self.bResync = bResync
+        # Autosync passes a single file path
+        self.files_path = [files_path] if isinstance(files_path, str) else files_path
+        self.measureParams = measureParams or {}
+        self.nWorkers = nWorkers if nWorkers > 0 else (os.cpu_count() or 1)
+        self.batchSize = batchSize
+        self.previewCache = previewCache
+
+        self.logCallback = log
+        self.totalCallback = total
+        self.progressCallback = progress
+        self.fileParsedCallback = fileParsed
+        self.filesChangedCallback = filesChanged
+
+        self.runs = True
+        #this is used to store the filenames of the images in the database so that are skipped when parsing
+        self.filesAlreadyInDb = set()
+        # Cached star measurements of the project files
+        self.starMetrics = {}
+        # Parsed files waiting for the ephemeris calculation
+        self.pending = []
+        self.nSaved = 0
+        self.nRemoved = 0
+
+    # The connection is opened here so that it is used only by the thread running the sync
+    def run(self):
+        with SyncDbWriter(self.db_path, self.project_id, self.batchSize, self.log) as self.writer:
+            self.filesAlreadyInDb = set(self.writer.get_files())
+            self.starMetrics = self.writer.get_star_metrics()
+
+            if self.files_path is not None:
+                self.syncFiles(self.files_path)
+                self.flush_results()
+            else:
+                self.files_path = []
+                self.syncFolder()
+            self.nSaved = self.writer.nSaved
+
+        if self.previewCache is not None:
+            evict_cache(self.previewCache)
+
+    def stop(self):
+        self.runs = False
+
+    def log(self, message, logType="info"):
+        if self.logCallback is not None:
+            self.logCallback(message, logType)
+
+    def report_total(self, nFiles):
+        if self.totalCallback is not None:
+            self.totalCallback(nFiles)
+
+    def report_progress(self):
+        if self.progressCallback is not None:
+            self.progressCallback(self.writer.nSaved)
+        self.report_changes()
+
+    def report_changes(self):
+        inserted, deleted = self.writer.pop_changes()
+        if self.filesChangedCallback is not None and (inserted or deleted):
+            self.filesChangedCallback(inserted, deleted)
+
+    def report_file(self, file_path, status, timings=None):
+        if self.fileParsedCallback is not None:
+            self.fileParsedCallback(file_path, status, timings)
+
+    def syncFolder(self)  :
+
+        self.log(f"Start syncing project n: {self.project_id}", "debug")
+        self.log(f"Base folder: {self.base_directory}", "debug")
+        self.log(f"Resync: {self.bResync}", "debug")
+
+        # If a resync is requested, all the files have to be parsed again
+        # So the first step is to delete all the project files that are in the database
+        if self.bResync == True:
+            self.writer.delete_project_files()
+
+        # Search for FITS files starting from the base directory, a resync lists again all the directories
+        with FolderScanner(self.db_path, self.project_id, self.base_directory) as scanner:
+            added, modified, removed = scanner.scan(bFull=self.bResync)
+        self.files_path = scanner.files
+        self.log(f"Folder scan: {scanner.nListed} directories listed, {len(added)} files added, "
+                               f"{len(modified)} modified, {len(removed)} removed", "info")
+
+        # Modified files are removed from the db so that they are parsed again
+        if self.bResync == False and modified:
+            self.writer.delete_files(modified)
+            self.filesAlreadyInDb.difference_update(modified)
+
+        self.report_total(len(self.files_path))
+
+        self.syncFiles(self.files_path)
+        self.flush_results()
+
+        self.log(f"New files inserted in the database: {self.writer.nSaved}", "info")
+
+        # Syncing means also that files that are not in the folder anymore (deleted by user?) are removed from the db
+        # If a resync is forced, the files are already removed from the db
+        if len(self.filesAlreadyInDb)  > 0 and self.bResync == False:
+            self.log(f"These are files not found in the database anymore: {self.filesAlreadyInDb}", "debug")
+
+            # Remove the files that are not in the folder anymore
+            self.nRemoved = self.writer.delete_files(self.filesAlreadyInDb)
+            self.log(f"Files removed from database: {self.nRemoved}","warning")
+
+        self.report_changes()
+
+        self.log("Task completed in sync thread", "debug")
+
+        return
+
+    def syncFiles(self,files_path):
+
+        # Skip parsing if the file is already in the database
+        files_to_parse = []
+        for file_path in files_path:
+            if self.bResync == False and file_path in self.filesAlreadyInDb:
+                self.filesAlreadyInDb.discard(file_path)
+                self.log(f"File was already parsed, so skipping: {os.path.basename(file_path)}", "warning")
+                self.report_file(file_path, "skipped")
+                continue
+            files_to_parse.append(file_path)
+
+        # A single worker (or a single file) doesn't need the overhead of a process pool
+        if self.nWorkers <= 1 or len(files_to_parse) <= 1:
+            for file_path in files_to_parse:
+                if not self.runs:
+                    self.log("Sync stop requested by user","warning")
+                    return
+                fits_data, log = parse_fits_file(file_path, self.project_id, self.measureParams, self.starMetrics.get(file_path),
+                                                 self.previewCache)
+                self.save_result(file_path, fits_data, log)
+            return
+
+        self.log(f"Parsing {len(files_to_parse)} files with {self.nWorkers} workers", "info")
+
+        # Workers are spawned (not forked) because forking a process that runs Qt threads is not safe
+        with ProcessPoolExecutor(max_workers=self.nWorkers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = {executor.submit(parse_fits_file, file_path, self.project_id, self.measureParams, self.starMetrics.get(file_path),
+                                       self.previewCache): file_path
+                       for file_path in files_to_parse}
+
+            # Results are collected in completion order
+            for future in as_completed(futures):
+                if not self.runs:
+                    # Queued files are cancelled, the ones being parsed are left to complete
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self.log("Sync stop requested by user","warning")
+                    return
+                try:
+                    fits_data, log = future.result()
+                except Exception as e:
+                    self.log(f"Error in sync worker: {e}", "error")
+                    self.report_file(futures[future], "error")
+                    continue
+                self.save_result(futures[future], fits_data, log)
+
+        return
+
+    # Forward the worker log messages and collect the parsed data for the ephemeris
+    def save_result(self, file_path, fits_data, log):
+        for message, logType in log:
+            self.log(message, logType)
+        if fits_data is None:
+            self.report_file(file_path, "error")
+            return
+
+        self.report_file(file_path, "parsed", fits_data.pop("TIMINGS", None))
+        self.pending.append(fits_data)
+        if len(self.pending) >= self.batchSize:
+            self.process_pending()
+
+    # Calculate the ephemeris of the collected files and send them to the writer
+    # Progress is reported when a batch is written to the database
+    def process_pending(self):
+        pending, self.pending = self.pending, []
+        log = []
+        compute_ephemeris(pending, log)
+        for message, logType in log:
+            self.log(message, logType)
+
+        for fits_data in pending:
+            if self.writer.add(fits_data):
+                self.report_progress()
+
+    # Write the last, incomplete batch
+    def flush_results(self):
+        self.process_pending()
+        if self.writer.flush():
+            self.report_progress()
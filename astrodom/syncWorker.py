@@ -0,0 +1,161 @@
+import os, warnings, hashlib, json, time
+from astropy.io import fits
+from astropy.coordinates import Angle
+from datetime import datetime
+from astrodom.starMeasurement import get_measure_params, measure_stars
+from astrodom.keywordResolver import KeywordResolver
+from astrodom.previewPyramid import build_pyramid
+
+# AstroDom internal keywords used to parse the FITS files and display the data in the main window
+# The keywords are mapped to the FITS header keywords but there are also calculated values (eg FWHM, Moon Phase)
+ad_keywords = {
+    "OBJECT": {'fits_key': ["OBJECT", "OBJ", "TARGET"], 'display_name': 'Target'},
+    "DATE-OBS": {'fits_key': ["DATE-OBS"], 'display_name': 'Date'},
+    "FILTER": {'fits_key': ["FILTER"], 'display_name': 'Filter'},
+    "EXPOSURE": {'fits_key': ["EXPOSURE","EXPTIME"], 'display_name': 'Exposure'},
+    "CCD-TEMP": {'fits_key': ["CCD-TEMP"], 'display_name': 'Temperature'},
+    "IMAGETYP": {'fits_key': ["IMAGETYP","FRAME"], 'display_name': 'Frame'},
+    "XBINNING": {'fits_key': ["XBINNING"], 'display_name': 'Bin X'},
+    "OBJECT-RA": {'fits_key': ["OBJECT-RA","OBJCTRA"], 'display_name': 'RA'},
+    "OBJECT-DEC": {'fits_key': ["OBJECT-DEC","OBJCTDEC"], 'display_name': 'DEC'},
+    "OBJECT-ALT": {'fits_key': ["OBJECT-ALT","OBJCTALT"], 'display_name': 'ALT'},
+    "OBJECT-AZ": {'fits_key': ["OBJECT-AZ","OBJCTAZ"], 'display_name': 'AZ'},
+    "GAIN": {'fits_key': ["GAIN"], 'display_name': 'Gain'},
+    "OFFSET": {'fits_key': ["OFFSET"], 'display_name': 'Offset'},
+    "FWHM": {'fits_key': '', 'display_name': 'FWHM'},
+    "ECCENTRICITY": {'fits_key':'', 'display_name': 'Eccentricity'},
+    "MEAN": {'fits_key':'', 'display_name': 'Mean'},
+    "MEDIAN": {'fits_key':'', 'display_name': 'Median'},
+    "STD": {'fits_key':'', 'display_name': 'SNR'},
+    "SIZE": {'fits_key': "", 'display_name': 'Size'},
+    "FILE": {'fits_key': '', 'display_name': 'File Name'},
+    "SITELAT": {'fits_key': ["SITELAT","LAT-OBS"], 'display_name': 'Site Lat'},
+    "SITELONG": {'fits_key': ["SITELONG","LONG-OBS"], 'display_name': 'Site Long'},
+    "MOON_PHASE": {'fits_key': '', 'display_name': 'Moon Phase'},
+    "MOON_SEPARATION": {'fits_key': '', 'display_name': 'Moon Separation'}
+    }
+# Mapping of the filter names to the FITS header values because
+# the filters are not always the same in the FITS header (depends on the imaging software)
+filterMapping = {"L": ["Luminance", "luminance", "Lum", "lum", "L", "l"],
+           "R": ["Red", "R", "r", "red"],
+           "B": ["Blue", "B", "b", "blue"],
+           "G": ["Green", "G", "g", "green"],
+           "Ha": ["Ha", "ha", "Halpha", "halpha", "H_alpha", "h_alpha", "H_Alpha", "h_Alpha"],
+           "Sii": ["SII", "Sii", "sii", "s2"],
+           "Oiii": ["OIII", "Oiii", "oiii", "O3"],
+           "LPR": ["Lpr", "LPR", "lpr"]}
+
+# Compiled once per process, reads the header keywords of every file
+keywordResolver = KeywordResolver(ad_keywords, filterMapping)
+
+# Worker processes print warnings to the console too, so they are suppressed here as in the sync thread
+warnings.filterwarnings("ignore")
+
+# The functions in this module do the per-file work of the sync (header parsing and star measurement,
+# see the starMeasurement module). They don't depend on Qt so that SyncImages can run them in a pool of worker processes.
+# ALT/AZ and moon ephemeris are calculated later for a batch of files (see the ephemeris module).
+# A worker cannot emit the threadLogger signal: log messages are collected as (message, logType) tuples
+# in the log list and sent back to the sync thread together with the parsed data.
+# parse_fits_file is the entry point submitted to the pool, it returns the (fits_data, log) tuple
+# where fits_data is the dictionary saved to the database (None if the file can't be opened)
+# Star measurement is the only step that reads the pixel data: cachedMetrics is the star_metrics row
+# (see SyncDbWriter.get_star_metrics) of a previous sync. If the file size, mtime, header and measurement
+# parameters did not change, the cached metrics are used and the pixel data is not read at all.
+# New measurements are returned in fits_data under the METRICS_KEY key so that the writer caches them.
+# The seconds spent reading the header, measuring the stars and in total are returned under the TIMINGS key
+# (removed by the sync engine before the data is saved).
+# With a previewCache folder the preview pyramid of the file is built too (previewPyramid module), if not cached.
+
+def parse_fits_file(file_path, project_id, measureParams=None, cachedMetrics=None, previewCache=None):
+    log = []
+    start = time.perf_counter()
+    file = os.path.basename(file_path)
+    log.append((f"Parsing file: {file}", "info"))
+
+    # Open the single FITS file and extract the header
+    try:
+        with fits.open(file_path) as hdul:
+            header = hdul[0].header
+        file_stat = os.stat(file_path)
+    except Exception as e:
+        log.append((f"Error opening FITS file: {e}", "error"))
+        return None, log
+
+    metricsKey = (file_stat.st_size, file_stat.st_mtime_ns, header_hash(header), measure_params_hash(measureParams))
+
+    # The header keywords are read in a single pass and converted by the resolver
+    fits_data, raw = keywordResolver.resolve(header, log)
+    headerTime = time.perf_counter() - start
+
+    # ALT/AZ (if not in the FITS header, eg NINA doesn't have ALT/ AZ), moon phase and separation
+    # are calculated for a batch of files by compute_ephemeris (ephemeris module), here the values
+    # needed are collected (not rounded)
+    fits_data["EPHEMERIS"] = {
+        "obstime": raw.get("DATE-OBS", header.get("DATE")),
+        "date": datetime.strptime(fits_data["DATE-OBS"], '%Y-%m-%dT%H:%M:%S') if "DATE-OBS" in fits_data else None,
+        "lat": raw_degree(fits_data, raw, "SITELAT", 'deg'),
+        "lon": raw_degree(fits_data, raw, "SITELONG", 'deg'),
+        "ra": raw_degree(fits_data, raw, "OBJECT-RA", 'hourangle'),
+        "dec": raw_degree(fits_data, raw, "OBJECT-DEC", 'deg'),
+        "altaz": "OBJECT-ALT" not in fits_data or "OBJECT-AZ" not in fits_data,
+    }
+
+    # Other Ad_keyowrds are not meant to be in the FITS header so they are derived from calculation
+    fits_data["FILE"] = file_path
+    fits_data["SIZE"] = round(file_stat.st_size / (1024 * 1024), 2)
+    fits_data["PROJECT_ID"] = project_id
+
+    # Measure stars for FWHM, ECCENTRICITY, MEAN, MEDIAN, STD
+    # only needs file path
+    starsStart = time.perf_counter()
+    if cachedMetrics and tuple(cachedMetrics[:4]) == metricsKey:
+        starMeasurement = cachedMetrics[4]
+        log.append((f"Star metrics unchanged, read from cache: {starMeasurement}", "debug"))
+    else:
+        try:
+            starMeasurement = measure_stars(file_path, measureParams, log)
+            if starMeasurement is None:
+                starMeasurement = [0.0, 0.0, 0.0, 0.0, 0.0]
+            # Only a completed measurement is cached, errors are retried at next sync
+            fits_data["METRICS_KEY"] = metricsKey
+        except Exception as e:
+            log.append((f"Error measuring stars: {e}", "error"))
+            starMeasurement = [0.0, 0.0, 0.0, 0.0, 0.0]
+
+    fits_data["FWHM"] = starMeasurement[0]
+    fits_data["ECCENTRICITY"] = starMeasurement[1]
+    fits_data["MEAN"] = starMeasurement[2]
+    fits_data["MEDIAN"] = starMeasurement[3]
+    fits_data["STD"] = starMeasurement[4]
+
+    if previewCache is not None:
+        try:
+            build_pyramid(file_path, previewCache)
+        except Exception as e:
+            log.append((f"Error building the preview pyramid: {e}", "error"))
+
+    end = time.perf_counter()
+    fits_data["TIMINGS"] = {
+        "header": round(headerTime, 4),
+        "stars": round(end - starsStart, 4),
+        "total": round(end - start, 4),
+    }
+
+    log.append(("File parsed: " + file_path,"debug"))
+
+    return fits_data, log
+
+# Angle of a raw header value in degrees, None if the keyword was not resolved
+def raw_degree(fits_data, raw, ad_keyword, unit):
+    if ad_keyword not in fits_data:
+        return None
+    return Angle(raw[ad_keyword], unit=unit).degree
+
+# Hash of all the header cards, part of the star metrics cache key
+def header_hash(header):
+    return hashlib.sha1(header.tostring().encode("ascii", "replace")).hexdigest()
+
+# Hash of the star measurement parameters (defaults included), part of the star metrics cache key
+def measure_params_hash(measureParams=None):
+    params = get_measure_params(measureParams)
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
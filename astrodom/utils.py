@@ -1,3 +1,7 @@
+import numpy as np
+import pandas as pd
+from astropy import units as u
+from astropy.coordinates import Angle
 
 def format_seconds( seconds, format = "hms"):
     if seconds is None or seconds == "": return ""
@@ -34,3 +38,58 @@ def format_file_size(size):
             return f"{value:.2f} {name}"
 
     return f"{size} B"
+
+# Text of a column of values (numpy array): the formatting function is called with the distinct values
+# (a value repeated in many rows, eg the RA of a target, is formatted once) and returns their texts
+def format_column(values, function):
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    texts = np.empty(len(uniques), dtype=object)
+    texts[:] = function(np.asarray(uniques, dtype=object))
+    return texts[codes]
+
+# Numbers with 2 decimals (FWHM, Eccentricity, SNR, Mean, Median)
+def format_decimals(values):
+    return ["" if value is None or (isinstance(value, str) and value == "") else f"{float(value):.2f}" for value in values]
+
+# Dates of the images (ISO strings as DATE_OBS) as strftime text, "" if not a date
+def format_dates(values, format):
+    dates = pd.to_datetime(pd.Series(values, dtype=object), errors='coerce', format='ISO8601')
+    return dates.dt.strftime(format).fillna("").tolist()
+
+# Angles in degrees (numbers or strings) as sexagesimal text without decimals: 12°34'56'' or
+# 1h02m03s if hours. The text is the same of astropy Angle.to_string(precision=0) but computed with
+# numpy, seconds are carried to the minute from 59.0 as astropy does. "" for missing values,
+# only the strings that are not numbers (eg "12 34 56") are parsed by astropy
+def format_angles(values, hours=False):
+    numbers = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype=float)
+    # Degrees to hours with the same factor of astropy
+    angles = numbers * ((np.pi / 180) / (np.pi / 12) if hours else 1.0)
+    sep = ("h", "m", "s") if hours else ("°", "'", "''")
+
+    sign = np.copysign(1.0, angles)
+    fraction, degrees = np.modf(np.fabs(angles))
+    fraction, minutes = np.modf(fraction * 60.0)
+    seconds = fraction * 60.0
+    sign = np.copysign(1.0, np.floor(sign * degrees))
+
+    carry = seconds >= 59.0
+    seconds = np.where(carry, 0.0, seconds)
+    minutes = minutes + carry
+    carry = minutes >= 60.0
+    minutes = np.where(carry, 0.0, minutes)
+    degrees = degrees + carry
+
+    texts = []
+    for value, number, d, m, s, sg in zip(values, numbers.tolist(), degrees.tolist(), minutes.tolist(), seconds.tolist(), sign.tolist()):
+        if number != number:
+            if isinstance(value, str) and value not in ("", "nan"):
+                try:
+                    texts.append(str(Angle(value, u.deg).to_string(unit=u.hour if hours else u.degree, precision=0, sep=sep)))
+                except ValueError:
+                    texts.append(value)
+            else:
+                texts.append("")
+            continue
+        s = f"{s:.0f}"
+        texts.append(f"{np.copysign(d, sg):.0f}{sep[0]}{int(m):02d}{sep[1]}{s.zfill(2)}{sep[2]}")
+    return texts
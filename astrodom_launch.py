@@ -1,8 +1,10 @@
 import astrodom.__main__ as astrodom
-import sys
+import sys, multiprocessing
 from PyQt6.QtWidgets import QApplication
 
 if __name__ == "__main__":
+    # Needed by the sync worker processes in the frozen executable
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     window = astrodom.MainWindow()
     window.show()
@@ -0,0 +1,111 @@
+############################################################
+# Scroll benchmark of the dashboard tree
+#
+# Builds a DashboardTreeModel on a synthetic project (no database needed),
+# times the build (group totals only) and the first page of a filter, then reads
+# all the images, times index/parent/rowCount calls and scrolls the expanded tree
+# page by page in a QTreeView through the proxy model, as the dashboard does.
+#
+# Usage: python dashboard_benchmark.py [frames] [targets] [filters]
+# Without a display: QT_QPA_PLATFORM=offscreen python dashboard_benchmark.py
+###########################################################
+import sys, time
+import numpy as np
+import pandas as pd
+from PyQt6.QtWidgets import QApplication, QTreeView
+from PyQt6.QtCore import QModelIndex
+from astrodom.dashboardTreeModel import DashboardTreeModel, CustomFilterProxyModel
+
+filterNames = ["L", "R", "G", "B", "Ha", "Oiii", "Sii"]
+
+# Images table of a synthetic project, frames are spread over targets x filters groups
+def synthetic_project(frames, targets, filters):
+    rng = np.random.default_rng(0)
+    dates = pd.Timestamp("2024-01-01T20:00:00") + pd.to_timedelta(np.arange(frames) * 180, unit="s")
+    return pd.DataFrame({
+        "PROJECT_ID": 1,
+        "OBJECT": [f"Target {n}" for n in rng.integers(0, targets, frames)],
+        "DATE_OBS": dates.strftime("%Y-%m-%dT%H:%M:%S"),
+        "FILTER": np.array(filterNames[:filters])[rng.integers(0, filters, frames)],
+        "EXPOSURE": 180,
+        "CCD_TEMP": -10.0,
+        "IMAGETYP": "Light Frame",
+        "XBINNING": 1,
+        "OBJECT_RA": "10.6833",
+        "OBJECT_DEC": "41.2692",
+        "OBJECT_ALT": [str(value) for value in np.round(rng.uniform(10, 80, frames), 4)],
+        "OBJECT_AZ": [str(value) for value in np.round(rng.uniform(0, 360, frames), 4)],
+        "GAIN": 100,
+        "OFFSET": 50,
+        "FWHM": np.round(rng.normal(3.5, 0.5, frames), 2),
+        "ECCENTRICITY": np.round(rng.uniform(0, 0.1, frames), 2),
+        "FILE": [f"/data/frame_{n:06d}.fits" for n in range(frames)],
+        "SIZE": 32.5,
+        "MEAN": np.round(rng.normal(1000, 5, frames), 2),
+        "MEDIAN": np.round(rng.normal(1000, 5, frames), 2),
+        "STD": np.round(rng.normal(20, 2, frames), 2),
+        "SITELAT": "45.5",
+        "SITELONG": "9.2",
+        "MOON_PHASE": np.round(rng.uniform(0, 100, frames), 2),
+        "MOON_SEPARATION": np.round(rng.uniform(0, 180, frames), 2),
+    })
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    targets = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    filters = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    app = QApplication(sys.argv)
+    data = synthetic_project(frames, targets, filters)
+
+    start = time.perf_counter()
+    model = DashboardTreeModel(data)
+    print(f"Model of {frames} frames ({targets} targets, {filters} filters) built in {time.perf_counter() - start:.3f} s")
+
+    # First page of a filter, as when it is expanded
+    groups = [model.index(f, 0, model.index(t, 0)) for t in range(model.rowCount()) for f in range(model.rowCount(model.index(t, 0)))]
+    start = time.perf_counter()
+    model.fetchMore(groups[0])
+    print(f"First page of {model.rowCount(groups[0])} frames read in {time.perf_counter() - start:.3f} s")
+
+    start = time.perf_counter()
+    model.setLoadAll(True)
+    print(f"All the frames read in {time.perf_counter() - start:.3f} s")
+
+    # Index navigation on the largest filter group
+    group = max(groups, key=model.rowCount)
+    rows = model.rowCount(group)
+    start = time.perf_counter()
+    for row in range(rows):
+        index = model.index(row, 0, group)
+        DashboardTreeModel.parent(model, index).row()
+        model.rowCount(index)
+    elapsed = time.perf_counter() - start
+    print(f"index + parent + rowCount on a group of {rows} frames: {elapsed * 1e6 / rows:.2f} us per row")
+
+    # Scroll the expanded tree one page at a time, every page is painted
+    proxy_model = CustomFilterProxyModel()
+    proxy_model.setSourceModel(model)
+    view = QTreeView()
+    view.setModel(proxy_model)
+    view.resize(1400, 900)
+    view.show()
+    start = time.perf_counter()
+    view.expandAll()
+    app.processEvents()
+    print(f"Expand all: {time.perf_counter() - start:.3f} s")
+
+    scrollBar = view.verticalScrollBar()
+    pages = max(1, scrollBar.maximum() // max(1, scrollBar.pageStep()))
+    step = max(1, pages // 200)
+    times = []
+    for page in range(0, pages + 1, step):
+        start = time.perf_counter()
+        scrollBar.setValue(page * scrollBar.pageStep())
+        view.viewport().repaint()
+        times.append(time.perf_counter() - start)
+    times = np.array(times) * 1000
+    print(f"Scrolled {len(times)} pages: mean {times.mean():.2f} ms, max {times.max():.2f} ms per page")
+
+if __name__ == "__main__":
+    main()
@@ -41,6 +41,9 @@ setup(
         'astrodom.rsc': ['gui/*', 'icons/*'],
     },
     python_requires=">=3.12",
+    entry_points={
+        'console_scripts': ['astrodom=astrodom.cli:main'],
+    },
     install_requires=[
         "astropy",
         "ephem",